@@ -0,0 +1,58 @@
+from django.core.cache import caches
+from django.http import Http404
+
+from InvoiceEngineApp.models import Tenancy
+
+
+# The cached company ids expire after this many seconds, as a safeguard for
+# changes that do not send signals, like queryset updates
+CACHE_TIMEOUT = 5 * 60
+
+# Shared by the server processes, so invalidating it revokes access in all,
+# see CACHES in the settings
+cache = caches['access']
+
+
+def get_cache_key(username):
+    return "tenancy_access:{}".format(username)
+
+
+def get_company_ids(username):
+    """Return the company ids of the tenancies the user has access to. They
+    are kept in the access cache, so most requests do not query them.
+    """
+    company_ids = cache.get(get_cache_key(username))
+    if company_ids is None:
+        if str(username).isdigit():
+            company_ids = frozenset(
+                Tenancy.objects.filter(
+                    tenancy_id=username
+                ).values_list('company_id', flat=True)
+            )
+        else:
+            company_ids = frozenset()
+        cache.set(get_cache_key(username), company_ids, CACHE_TIMEOUT)
+    return company_ids
+
+
+def has_access(username, company_id):
+    try:
+        return int(company_id) in get_company_ids(username)
+    except (TypeError, ValueError):
+        return False
+
+
+def check_access(username, company_id):
+    """Raise Http404 if the user has no access to the tenancy. Queries that
+    follow can then filter on the company id alone, without joining the
+    tenancy.
+    """
+    if not has_access(username, company_id):
+        raise Http404("No Tenancy matches the given query.")
+
+
+def invalidate(tenancy_id):
+    """Forget the company ids of a user, after a tenancy has been added,
+    reassigned or removed.
+    """
+    cache.delete(get_cache_key(tenancy_id))
@@ -0,0 +1,293 @@
+import datetime
+import multiprocessing
+
+from django.db import connection, connections, transaction
+
+from InvoiceEngineApp.models import (
+    Collection,
+    Component,
+    Contract,
+    ContractPerson,
+    GeneralLedgerPost,
+    Invoice,
+    Tenancy,
+)
+
+
+AMOUNT_DIFFERENCES_SQL = """
+SELECT contract.contract_id,
+    contract.base_amount, contract.vat_amount, contract.total_amount,
+    COALESCE(sums.base_amount, 0), COALESCE(sums.vat_amount, 0),
+    COALESCE(sums.total_amount, 0)
+FROM {contract} contract
+LEFT JOIN (
+    SELECT component.contract_id,
+        SUM(component.total_amount - component.vat_amount) AS base_amount,
+        SUM(component.vat_amount) AS vat_amount,
+        SUM(component.total_amount) AS total_amount
+    FROM {component} component
+    JOIN {contract} parent ON parent.contract_id = component.contract_id
+    WHERE component.tenancy_id = %(company_id)s
+        AND component.start_date IS NOT NULL
+        AND (parent.status = %(draft)s OR component.end_date IS NULL
+            OR component.date_next_prolongation IS NOT NULL)
+    GROUP BY component.contract_id
+) sums ON sums.contract_id = contract.contract_id
+WHERE contract.tenancy_id = %(company_id)s
+    AND (contract.base_amount, contract.vat_amount, contract.total_amount)
+        IS DISTINCT FROM (COALESCE(sums.base_amount, 0),
+            COALESCE(sums.vat_amount, 0), COALESCE(sums.total_amount, 0))
+ORDER BY contract.contract_id
+"""
+
+# The total percentage of the persons of a contract changes on their start
+# dates and on the days after their end dates. A running sum over these
+# changes gives the total from every change until the next one, as in
+# validators.get_percentage_ranges.
+PERCENTAGE_RANGES_SQL = """
+WITH contracts AS (
+    SELECT contract_id, start_date
+    FROM {contract}
+    WHERE tenancy_id = %(company_id)s AND status IN %(statuses)s
+), changes AS (
+    SELECT person.contract_id, person.start_date AS date,
+        person.percentage_of_total AS change
+    FROM {person} person
+    JOIN contracts ON contracts.contract_id = person.contract_id
+    WHERE person.tenancy_id = %(company_id)s
+        AND person.start_date IS NOT NULL
+    UNION ALL
+    SELECT person.contract_id, person.end_date + 1,
+        -person.percentage_of_total
+    FROM {person} person
+    JOIN contracts ON contracts.contract_id = person.contract_id
+    WHERE person.tenancy_id = %(company_id)s
+        AND person.start_date IS NOT NULL AND person.end_date IS NOT NULL
+    UNION ALL
+    SELECT contract_id, start_date, 0
+    FROM contracts
+    WHERE start_date IS NOT NULL
+), totals AS (
+    SELECT contract_id, date,
+        SUM(SUM(change)) OVER (
+            PARTITION BY contract_id ORDER BY date
+        ) AS total,
+        LEAD(date) OVER (PARTITION BY contract_id ORDER BY date) - 1
+            AS last_day
+    FROM changes
+    GROUP BY contract_id, date
+)
+SELECT contract_id, date, last_day, total
+FROM totals
+WHERE total <> 100
+ORDER BY contract_id, date
+"""
+
+# The amount and the balance of an invoice according to the ledger, its
+# debtors posts: the invoice is debited, and credited by payments (see
+# payments.py). The balance of a contract is the sum of those of its
+# invoices.
+BALANCES_SQL = """
+WITH invoices AS (
+    SELECT invoice.invoice_id, invoice.contract_id, invoice.balance,
+        COALESCE(SUM(post.amount_debit - post.amount_credit), 0) AS amount,
+        COALESCE(SUM(post.amount_debit), 0) AS invoiced
+    FROM {invoice} invoice
+    LEFT JOIN {post} post ON post.invoice_id = invoice.invoice_id
+        AND post.tenancy_id = %(company_id)s
+    WHERE invoice.tenancy_id = %(company_id)s
+    GROUP BY invoice.invoice_id
+), contracts AS (
+    SELECT contract.contract_id, contract.balance,
+        COALESCE(SUM(invoices.amount), 0) AS amount
+    FROM {contract} contract
+    LEFT JOIN invoices ON invoices.contract_id = contract.contract_id
+    WHERE contract.tenancy_id = %(company_id)s
+    GROUP BY contract.contract_id
+)
+"""
+
+BALANCE_DIFFERENCES_SQL = BALANCES_SQL + """
+SELECT 'invoice', invoice_id, balance, amount
+FROM invoices
+WHERE balance <> amount
+UNION ALL
+SELECT 'contract', contract_id, balance, amount
+FROM contracts
+WHERE balance <> amount
+ORDER BY 1 DESC, 2
+"""
+
+FIX_BALANCES_SQL = BALANCES_SQL + """
+, fixed_invoices AS (
+    UPDATE {invoice} invoice SET balance = invoices.amount
+    FROM invoices
+    WHERE invoice.invoice_id = invoices.invoice_id
+        AND invoices.balance <> invoices.amount
+    RETURNING 1
+), fixed_contracts AS (
+    UPDATE {contract} contract SET balance = contracts.amount
+    FROM contracts
+    WHERE contract.contract_id = contracts.contract_id
+        AND contracts.balance <> contracts.amount
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM fixed_invoices),
+    (SELECT COUNT(*) FROM fixed_contracts)
+"""
+
+# Every collection is rounded to cents, so together they can differ up to
+# half a cent each from the invoice
+COLLECTION_DIFFERENCES_SQL = BALANCES_SQL + """
+SELECT invoices.invoice_id, invoices.invoiced,
+    COALESCE(collections.amount, 0)
+FROM invoices
+LEFT JOIN (
+    SELECT invoice_id, SUM(amount) AS amount, COUNT(*) AS number
+    FROM {collection}
+    WHERE tenancy_id = %(company_id)s
+    GROUP BY invoice_id
+) collections ON collections.invoice_id = invoices.invoice_id
+WHERE ABS(COALESCE(collections.amount, 0) - invoices.invoiced)
+    > 0.005 * COALESCE(collections.number, 0)
+ORDER BY invoices.invoice_id
+"""
+
+
+def format_sql(sql):
+    return sql.format(**{
+        name: connection.ops.quote_name(model._meta.db_table)
+        for name, model in [
+            ('collection', Collection),
+            ('contract', Contract),
+            ('invoice', Invoice),
+            ('post', GeneralLedgerPost),
+        ]
+    })
+
+
+def get_amount_differences(company_id):
+    """Return the contracts of a tenancy whose base, VAT and total amounts
+    are not the sums of those of their components, as (contract id, amounts
+    of the contract, sums of the components) tuples. Like Component.invoice,
+    the sums leave out the components of contracts that are no longer
+    drafts once they have ended and are not invoiced anymore, and like
+    Component.create, components that have been replaced as a whole (see
+    Component.is_in_contract_amounts).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            AMOUNT_DIFFERENCES_SQL.format(
+                contract=connection.ops.quote_name(Contract._meta.db_table),
+                component=connection.ops.quote_name(Component._meta.db_table)
+            ),
+            {'company_id': company_id, 'draft': Contract.DRAFT}
+        )
+        return [
+            (row[0], tuple(row[1:4]), tuple(row[4:7]))
+            for row in cursor.fetchall()
+        ]
+
+
+def get_percentage_ranges(company_id,
+                          statuses=(Contract.ACTIVE, Contract.TERMINATED)):
+    """Return the date ranges in which the persons of the contracts of a
+    tenancy with one of the statuses do not pay 100 percent together, as
+    (contract id, first day, last day, percentage) tuples, with the same
+    rule as validators.validate_person_percentages. The last day of a range
+    that runs on indefinitely is None.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            PERCENTAGE_RANGES_SQL.format(
+                contract=connection.ops.quote_name(Contract._meta.db_table),
+                person=connection.ops.quote_name(
+                    ContractPerson._meta.db_table
+                )
+            ),
+            {'company_id': company_id, 'statuses': tuple(statuses)}
+        )
+        ranges = []
+        for contract_id, first_day, last_day, total in cursor.fetchall():
+            day_before = first_day - datetime.timedelta(days=1)
+            # Join ranges that are only split by a change of nothing
+            if ranges and ranges[-1][0] == contract_id \
+                    and ranges[-1][3] == total and ranges[-1][2] == day_before:
+                ranges[-1] = (contract_id, ranges[-1][1], last_day, total)
+            else:
+                ranges.append((contract_id, first_day, last_day, total))
+        return ranges
+
+
+def get_balance_differences(company_id):
+    """Return the invoices and contracts of a tenancy whose balance is not
+    the one in the general ledger, as ('invoice' or 'contract', id, balance,
+    balance in the ledger) tuples, invoices first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            format_sql(BALANCE_DIFFERENCES_SQL), {'company_id': company_id}
+        )
+        return cursor.fetchall()
+
+
+def get_collection_differences(company_id):
+    """Return the invoices of a tenancy whose collections do not add up to
+    the invoiced amount in the general ledger, as (invoice id, invoiced
+    amount, sum of the collections) tuples. Collections cannot be corrected
+    here, as they may have been sent to the bank already.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            format_sql(COLLECTION_DIFFERENCES_SQL), {'company_id': company_id}
+        )
+        return cursor.fetchall()
+
+
+def fix_balances(company_id):
+    """Set the balances of the invoices and contracts of a tenancy to those
+    in the general ledger, with one statement. Returns the amount of
+    invoices and the amount of contracts that were changed.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            format_sql(FIX_BALANCES_SQL), {'company_id': company_id}
+        )
+        fixed_invoices, fixed_contracts = cursor.fetchone()
+        if fixed_invoices or fixed_contracts:
+            Tenancy.raise_data_generation(company_id)
+    return fixed_invoices, fixed_contracts
+
+
+def reconcile_tenancy(company_id, fix=False):
+    """Compare the balances of a tenancy with the general ledger and its
+    collections, and fix the balances if asked to. Returns the company id,
+    the balance differences and the collection differences.
+    """
+    with transaction.atomic():
+        balance_differences = get_balance_differences(company_id)
+        collection_differences = get_collection_differences(company_id)
+        if fix and balance_differences:
+            fix_balances(company_id)
+    return company_id, balance_differences, collection_differences
+
+
+def reconcile_balances(company_ids, fix=False, processes=None):
+    """Reconcile the balances of many tenancies, one tenancy at a time per
+    worker process. Generates the results of reconcile_tenancy as the
+    tenancies are done.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    # The workers open connections of their own
+    connections.close_all()
+    # Fork, so the workers inherit the configured Django environment
+    context = multiprocessing.get_context('fork')
+    with context.Pool(max(1, min(processes, len(company_ids)))) as pool:
+        yield from pool.imap_unordered(
+            reconcile_worker,
+            [(company_id, fix) for company_id in company_ids]
+        )
+
+
+def reconcile_worker(args):
+    return reconcile_tenancy(*args)
@@ -0,0 +1,700 @@
+import datetime as dt
+import multiprocessing
+import os
+import traceback
+
+from django.db import connection, connections, transaction
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.utils import timezone
+
+from InvoiceEngineApp.models import (
+    BulkOperation,
+    Collection,
+    Component,
+    Contract,
+    ContractPerson,
+    GeneralLedgerPost,
+    Invoice,
+    InvoiceLine,
+    Tenancy,
+    VATRate,
+    get_next_invoice_id,
+)
+
+
+# Amount of component ids that is updated in one statement, and transaction,
+# by a bulk operation
+BATCH_SIZE = 5000
+
+# Amount of contracts whose components are changed in one transaction by a
+# bulk operation that works in memory
+CONTRACT_BATCH_SIZE = 1000
+
+
+def round_two_places(expression):
+    """Return SQL that rounds an expression to two decimal places the way
+    Decimal.quantize does in the default context, with ties to even, as
+    mul_d and div do. ROUND in PostgreSQL rounds ties away from zero.
+    """
+    return (
+        "(CASE WHEN ({0}) * 100 - TRUNC(({0}) * 100) IN (0.5, -0.5) "
+        "AND MOD(TRUNC(({0}) * 100), 2) = 0 "
+        "THEN TRUNC(({0}) * 100) / 100 "
+        "ELSE ROUND(({0}), 2) END)"
+    ).format(expression)
+
+
+# Replace the VAT rate of the next batch of components of a VAT rate, after
+# a component id, and recompute their VAT and total amounts as
+# Component.set_derived_fields does. The differences are added to the
+# amounts of the contracts, per contract in one grouped update, for the
+# components those amounts count (see audit.AMOUNT_DIFFERENCES_SQL).
+REPLACE_VAT_RATE_SQL = """
+WITH old AS (
+    SELECT component_id, contract_id, vat_amount, total_amount,
+        start_date IS NOT NULL AS started,
+        end_date IS NULL OR date_next_prolongation IS NOT NULL AS invoiced,
+        CASE WHEN COALESCE(base_amount, 0) <> 0 THEN base_amount
+        ELSE {amount} END AS amount
+    FROM {component}
+    WHERE vat_rate_id = %(vat_rate_id)s AND component_id > %(after)s
+    ORDER BY component_id
+    LIMIT %(batch_size)s
+    FOR UPDATE
+), new AS (
+    SELECT old.*,
+        CASE WHEN %(percentage)s::numeric IS NULL THEN 0
+        ELSE {vat_amount} END AS new_vat_amount
+    FROM old
+), changed AS (
+    UPDATE {component} SET
+        vat_rate_id = %(new_vat_rate_id)s,
+        vat_amount = new.new_vat_amount,
+        total_amount = new.amount + new.new_vat_amount
+    FROM new
+    WHERE {component}.component_id = new.component_id
+    RETURNING new.component_id, new.contract_id, new.started, new.invoiced,
+        new.amount - (new.total_amount - new.vat_amount) AS base_difference,
+        new.new_vat_amount - new.vat_amount AS vat_difference,
+        new.amount + new.new_vat_amount - new.total_amount
+            AS total_difference
+), contracts AS (
+    UPDATE {contract} SET
+        base_amount = {contract}.base_amount + differences.base_amount,
+        vat_amount = {contract}.vat_amount + differences.vat_amount,
+        total_amount = {contract}.total_amount + differences.total_amount
+    FROM (
+        SELECT changed.contract_id,
+            SUM(base_difference) AS base_amount,
+            SUM(vat_difference) AS vat_amount,
+            SUM(total_difference) AS total_amount
+        FROM changed
+        JOIN {contract} parent ON parent.contract_id = changed.contract_id
+        WHERE changed.started
+            AND (parent.status = %(draft)s OR changed.invoiced)
+        GROUP BY changed.contract_id
+    ) differences
+    WHERE {contract}.contract_id = differences.contract_id
+)
+SELECT COUNT(*), MAX(component_id) FROM changed
+""".format(
+    component=connection.ops.quote_name(Component._meta.db_table),
+    contract=connection.ops.quote_name(Contract._meta.db_table),
+    amount=round_two_places(
+        "COALESCE(number_of_units, 0) * COALESCE(unit_amount, 0)"
+    ),
+    vat_amount=round_two_places(
+        round_two_places("%(percentage)s::numeric / 100") + " * amount"
+    ),
+)
+
+
+def replace_vat_rate(vat_rate, new_vat_rate, progress=None,
+                     batch_size=BATCH_SIZE):
+    """Move all components of a VAT rate to a new VAT rate, which may be the
+    same rate with a changed percentage, or None, and recompute their VAT
+    and total amounts and those of their contracts.
+
+    This is done in SQL, in batches of components that are each committed
+    separately, so a large tenancy is not locked as a whole. Every batch
+    takes the next components of the VAT rate by id, after the last one of
+    the previous batch. The progress function, if given, is called with the
+    amount of components done and the total amount after every batch.
+    Returns the amount of components.
+    """
+    total = Component.objects.filter(
+        vat_rate_id=vat_rate.vat_rate_id
+    ).count()
+    done = 0
+    after = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(REPLACE_VAT_RATE_SQL, {
+                'vat_rate_id': vat_rate.vat_rate_id,
+                'new_vat_rate_id':
+                    new_vat_rate.vat_rate_id if new_vat_rate else None,
+                'percentage':
+                    new_vat_rate.percentage if new_vat_rate else None,
+                'after': after,
+                'batch_size': batch_size,
+                'draft': Contract.DRAFT,
+            })
+            changed, last = cursor.fetchone()
+        if not changed:
+            break
+        done += changed
+        after = last
+        if progress:
+            progress(done, max(done, total))
+
+    if done:
+        Tenancy.raise_data_generation(vat_rate.tenancy_id)
+    return done
+
+
+class CorrectionInvoices:
+    """The correction invoices of a bulk operation on components, for
+    periods that have already been invoiced. A contract gets at most one
+    invoice with a line for every changed component, instead of an invoice
+    per component. The invoice ids are reserved once for all of them, and
+    everything is saved with one bulk insert per table.
+    """
+    def __init__(self, tenancy, date):
+        self.tenancy = tenancy
+        self.date = date
+        self.invoices = {}
+        self.invoice_lines = []
+        self.gl_posts = []
+        self.next_invoice_id = None
+        self.next_invoice_line_id = None
+
+    def add_line(self, component, amounts):
+        """Add an invoice line for the base, VAT, total and unit amounts of
+        a component to the correction invoice of its contract.
+        """
+        contract = component.contract
+        invoice = self.invoices.get(contract.contract_id)
+        if invoice is None:
+            if self.next_invoice_id is None:
+                self.next_invoice_id, self.next_invoice_line_id = \
+                    get_next_invoice_id()
+            invoice = contract.create_invoice(
+                self.date, self.next_invoice_id, self.tenancy
+            )
+            self.invoices[contract.contract_id] = invoice
+            self.next_invoice_id += 1
+
+        component.create_invoice_line(
+            self.next_invoice_line_id,
+            invoice,
+            *amounts,
+            self.invoice_lines,
+            self.gl_posts
+        )
+        self.next_invoice_line_id += 1
+
+    def save(self):
+        """Create the collections and the debtor posts of the invoices and
+        save everything. Returns the amount of invoices.
+        """
+        if not self.invoices:
+            return 0
+
+        collections = []
+        for person in ContractPerson.objects.filter(
+                Q(contract_id__in=self.invoices)
+                & Q(start_date__lte=self.date)
+                & (Q(end_date__gte=self.date) | Q(end_date__isnull=True))
+        ).defer('search_vector'):
+            person.invoice(
+                self.tenancy, self.invoices[person.contract_id], collections
+            )
+        for invoice in self.invoices.values():
+            invoice.create_gl_post(self.gl_posts)
+
+        # Numbered now rather than from the tenancy as it was loaded, as
+        # other invoices may have been made since
+        self.tenancy.number_invoices(list(self.invoices.values()))
+        Invoice.objects.bulk_create(self.invoices.values())
+        InvoiceLine.objects.bulk_create(self.invoice_lines)
+        GeneralLedgerPost.objects.bulk_create(self.gl_posts)
+        Collection.objects.bulk_create(collections)
+        return len(self.invoices)
+
+
+def get_current_components(tenancy, date):
+    """Return the components of the tenancy that run on the given date, of
+    contracts that have not ended.
+    """
+    return tenancy.component_set.filter(
+        Q(start_date__isnull=False)
+        & Q(start_date__lte=date)
+        & (Q(end_date__gte=date) | Q(end_date__isnull=True))
+    ).exclude(
+        contract__status__in=[Contract.ENDED, Contract.HISTORIC]
+    )
+
+
+def get_contract_batches(components, batch_size):
+    """Split the contracts of the components into batches of contract ids."""
+    contract_ids = list(
+        components.order_by(
+            'contract_id'
+        ).values_list(
+            'contract_id', flat=True
+        ).distinct()
+    )
+    return [
+        contract_ids[i:i + batch_size]
+        for i in range(0, len(contract_ids), batch_size)
+    ]
+
+
+def index_components(tenancy, start_date, percentage=None, amount=None,
+                     base_component_id=None, progress=None,
+                     batch_size=CONTRACT_BATCH_SIZE):
+    """Index the components that run on the start date, of one base
+    component or of all: raise their amount (or unit amount) by a
+    percentage, or set it to a new amount, from the start date on.
+
+    Like Component.create does for a single component, every component is
+    replaced by a new one that starts on the start date, and ends the
+    old component the day before. If the start date has already been
+    invoiced, the difference is invoiced with one correction invoice per
+    contract. The contracts are processed in batches, each in one
+    transaction. The progress function, if given, is called with the
+    amount of contracts done and the total amount after every batch.
+    Returns the amount of new components.
+    """
+    components = get_current_components(tenancy, start_date)
+    if base_component_id:
+        components = components.filter(base_component_id=base_component_id)
+
+    reference_data = tenancy.get_reference_data()
+    batches = get_contract_batches(components, batch_size)
+    total = sum(len(batch) for batch in batches)
+    done = 0
+    number_of_components = 0
+    for contract_ids in batches:
+        with transaction.atomic():
+            old_components = list(
+                components.filter(
+                    contract_id__in=contract_ids
+                ).select_related(
+                    'contract'
+                ).order_by(
+                    'contract_id', 'component_id'
+                ).select_for_update()
+            )
+            contracts = {}
+            new_components = []
+            for component in old_components:
+                # The components of a contract share one instance of it, so
+                # all their changes to its amounts are saved
+                component.contract = contracts.setdefault(
+                    component.contract_id, component.contract
+                )
+                reference_data.attach(component)
+                new_components.append(
+                    component.get_indexed(
+                        start_date, percentage, amount
+                    )
+                )
+
+            Component.objects.bulk_create(new_components)
+
+            corrections = CorrectionInvoices(tenancy, dt.date.today())
+            for old, new in zip(old_components, new_components):
+                invoiced_until = old.contract.date_next_prolongation
+                if new.date_next_prolongation and \
+                        new.start_date < new.date_next_prolongation:
+                    corrections.add_line(new, new.get_amounts_between_dates(
+                        new.start_date, invoiced_until
+                    ))
+                    corrections.add_line(old, [
+                        -value for value in old.get_amounts_between_dates(
+                            new.start_date,
+                            min(old.end_date + dt.timedelta(days=1),
+                                invoiced_until)
+                            if old.end_date else invoiced_until
+                        )
+                    ])
+
+                # End the old component, or remove it from the periods if
+                # it starts on the same date. Like Component.change_end_date,
+                # an old component that ends within the invoiced period is
+                # not invoiced anymore, and like Component.invoice, it is
+                # then taken out of the amounts of the contract, as is one
+                # that has been replaced as a whole.
+                in_contract_amounts = old.is_in_contract_amounts()
+                if old.start_date < start_date:
+                    old.end_date = start_date - dt.timedelta(days=1)
+                    if invoiced_until and old.end_date < invoiced_until:
+                        old.date_next_prolongation = None
+                else:
+                    old.start_date = None
+                    old.end_date = None
+                    old.date_next_prolongation = None
+                if in_contract_amounts and not old.is_in_contract_amounts():
+                    old.contract.remove_component(old)
+            corrections.save()
+
+            Component.objects.bulk_update(
+                old_components,
+                ['start_date', 'end_date', 'date_next_prolongation']
+            )
+            Contract.objects.bulk_update(
+                contracts.values(),
+                ['base_amount', 'vat_amount', 'total_amount', 'balance']
+            )
+            Tenancy.raise_data_generation(tenancy.company_id)
+
+        done += len(contract_ids)
+        number_of_components += len(new_components)
+        if progress:
+            progress(done, total)
+
+    return number_of_components
+
+
+def end_contracts(tenancy, contract_ids, end_date, progress=None,
+                  batch_size=CONTRACT_BATCH_SIZE):
+    """End the active and terminated contracts among the given ids on the
+    end date, with their components and current contract persons, for
+    instance when a building is sold.
+
+    As Contract.end does for a single contract, the periods after the end
+    date that have already been invoiced are credited with a correction
+    invoice. The contracts are processed in batches, each in one
+    transaction, with the correction invoices of a batch created in one
+    pass under one reservation of invoice ids. The progress function, if
+    given, is called with the amount of contracts done and the total amount
+    after every batch. Returns the amount of contracts that was ended.
+    """
+    date_today = dt.date.today()
+    contracts = tenancy.contract_set.filter(
+        contract_id__in=contract_ids,
+        status__in=[Contract.ACTIVE, Contract.TERMINATED]
+    )
+    ids = list(contracts.order_by('contract_id').values_list(
+        'contract_id', flat=True
+    ))
+    reference_data = tenancy.get_reference_data()
+    done = 0
+    for i in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            batch = {
+                contract.contract_id: contract
+                for contract in contracts.filter(
+                    contract_id__in=ids[i:i + batch_size]
+                ).select_for_update()
+            }
+            components = list(
+                Component.objects.filter(
+                    Q(contract_id__in=batch)
+                    & (Q(end_date__isnull=True) | Q(end_date__gt=end_date))
+                ).order_by('contract_id', 'component_id')
+            )
+
+            corrections = CorrectionInvoices(tenancy, date_today)
+            for component in components:
+                contract = component.contract = batch[component.contract_id]
+                reference_data.attach(component)
+                invoiced_until = contract.date_next_prolongation
+                if invoiced_until and \
+                        end_date < invoiced_until - dt.timedelta(days=1):
+                    amounts = component.get_amounts_between_dates(
+                        end_date,
+                        min(component.end_date + dt.timedelta(days=1),
+                            invoiced_until)
+                        if component.end_date else invoiced_until
+                    )
+                    corrections.add_line(
+                        component, [-value for value in amounts]
+                    )
+                    # Not invoiced anymore, see Component.invoice
+                    component.date_next_prolongation = None
+                    contract.remove_component(component)
+                component.end_date = end_date
+            corrections.save()
+
+            for contract in batch.values():
+                if not contract.termination_date:
+                    contract.termination_date = end_date
+                contract.end_date = end_date
+                contract.status = Contract.ENDED
+                # Contracts that end after the invoiced period are invoiced
+                # until the end date, see Contract.end_invoicing
+                if contract.date_next_prolongation and \
+                        end_date < contract.date_next_prolongation:
+                    contract.date_next_prolongation = None
+
+            ContractPerson.objects.filter(
+                Q(contract_id__in=batch)
+                & Q(start_date__lte=date_today)
+                & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
+            ).update(end_date=end_date)
+            Component.objects.bulk_update(
+                components, ['end_date', 'date_next_prolongation']
+            )
+            Contract.objects.bulk_update(
+                batch.values(),
+                ['termination_date', 'end_date', 'status',
+                 'date_next_prolongation', 'balance', 'base_amount',
+                 'vat_amount', 'total_amount']
+            )
+            Tenancy.raise_data_generation(tenancy.company_id)
+
+        done += len(batch)
+        if progress:
+            progress(done, len(ids))
+
+    return done
+
+
+def get_activatable_contracts(tenancy, contract_ids=None):
+    """Return the contracts among the given ids, or all contracts, that can
+    be activated, as Contract.can_activate checks for a single contract:
+    drafts with a start date, components and contract persons who pay 100
+    percent together. This is one query however many contracts there are.
+    """
+    contracts = tenancy.contract_set.filter(
+        status=Contract.DRAFT,
+        start_date__isnull=False
+    )
+    if contract_ids is not None:
+        contracts = contracts.filter(contract_id__in=contract_ids)
+
+    return contracts.annotate(
+        persons_percentage=Subquery(
+            ContractPerson.objects.filter(
+                contract_id=OuterRef('contract_id'),
+                start_date__lte=OuterRef('start_date')
+            ).values(
+                'contract_id'
+            ).annotate(
+                total=Sum('percentage_of_total')
+            ).values('total')
+        ),
+        has_components=Exists(
+            Component.objects.filter(contract_id=OuterRef('contract_id'))
+        )
+    ).filter(
+        persons_percentage=100,
+        has_components=True
+    )
+
+
+def activate_contracts(tenancy, contract_ids=None, progress=None,
+                       batch_size=BATCH_SIZE):
+    """Activate the contracts among the given ids, or all draft contracts,
+    that can be activated, for instance after a migration. As in
+    Contract.activate, the components and contract persons that start
+    before their contract start with it, and everything is invoiced from
+    the start date of the contract on.
+
+    The contracts are activated in batches with a few UPDATE statements per
+    batch. A contract that has been activated in the meantime, by hand or
+    by another operation, is skipped. The progress function, if given, is
+    called with the amount of contracts done and the total amount after
+    every batch. Returns the amount of contracts that was activated.
+    """
+    ids = list(
+        get_activatable_contracts(
+            tenancy, contract_ids
+        ).order_by(
+            'contract_id'
+        ).values_list(
+            'contract_id', flat=True
+        )
+    )
+    contract_start_date = Subquery(
+        Contract.objects.filter(
+            contract_id=OuterRef('contract_id')
+        ).values('start_date')
+    )
+    activated = 0
+    for i in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            # Lock the contracts that are still drafts, as end_contracts
+            # does, so none is activated twice
+            batch = list(
+                Contract.objects.filter(
+                    contract_id__in=ids[i:i + batch_size],
+                    status=Contract.DRAFT
+                ).select_for_update().values_list('contract_id', flat=True)
+            )
+            for model in [Component, ContractPerson]:
+                model.objects.filter(
+                    contract_id__in=batch,
+                    start_date__lt=F('contract__start_date')
+                ).update(
+                    start_date=contract_start_date
+                )
+            Component.objects.filter(
+                contract_id__in=batch
+            ).update(
+                date_next_prolongation=F('start_date')
+            )
+            Contract.objects.filter(
+                contract_id__in=batch,
+                status=Contract.DRAFT
+            ).update(
+                date_next_prolongation=F('start_date'),
+                status=Case(
+                    When(
+                        termination_date__isnull=False,
+                        then=Value(Contract.TERMINATED)
+                    ),
+                    default=Value(Contract.ACTIVE)
+                )
+            )
+            Tenancy.raise_data_generation(tenancy.company_id)
+
+        activated += len(batch)
+        if progress:
+            progress(min(i + batch_size, len(ids)), len(ids))
+
+    return activated
+
+
+# The background processes started by this server process, with the ids of
+# their operations
+running_processes = {}
+
+
+def start_operation(company_id, description, target, *args):
+    """Record a bulk operation and run the target function in a background
+    process that outlives the request. The function is called with the
+    operation followed by the arguments, and should report its progress on
+    the operation. Returns the operation.
+    """
+    operation = BulkOperation.objects.create(
+        tenancy_id=company_id,
+        description=description
+    )
+    # Close the connections, so the background process opens its own
+    # rather than sharing the ones of this process
+    connections.close_all()
+    reap_operations()
+    process = multiprocessing.get_context('fork').Process(
+        target=run_operation,
+        args=(operation.bulk_operation_id, target) + args
+    )
+    process.start()
+    running_processes[process] = operation.bulk_operation_id
+    return operation
+
+
+def reap_operations():
+    """Clean up the background processes of this server process that have
+    exited. An operation whose process was killed before it could finish
+    the operation is recorded as failed.
+    """
+    for process, bulk_operation_id in list(running_processes.items()):
+        if process.exitcode is None:
+            continue
+        del running_processes[process]
+        if process.exitcode != 0:
+            fail_operation(
+                bulk_operation_id,
+                "The background process exited with code {}.".format(
+                    process.exitcode
+                )
+            )
+
+
+def run_operation(bulk_operation_id, target, *args):
+    """Run a bulk operation in the background process and record how it
+    finished, also when it failed. The process then exits at once, without
+    running the exit handlers it inherited from the server.
+    """
+    exit_code = 1
+    try:
+        operation = BulkOperation.objects.get(
+            bulk_operation_id=bulk_operation_id
+        )
+        try:
+            target(operation, *args)
+        except Exception:
+            operation.finish(error=traceback.format_exc())
+        else:
+            operation.finish()
+            exit_code = 0
+    except BaseException:
+        # The operation could not even be loaded or finished
+        traceback.print_exc()
+        fail_operation(bulk_operation_id, traceback.format_exc())
+    finally:
+        connections.close_all()
+        os._exit(exit_code)
+
+
+def fail_operation(bulk_operation_id, error):
+    """Record that an operation failed, if it has not finished yet."""
+    try:
+        BulkOperation.objects.filter(
+            bulk_operation_id=bulk_operation_id,
+            finished__isnull=True
+        ).update(finished=timezone.now(), error=error)
+    except Exception:
+        traceback.print_exc()
+
+
+def update_vat_rate(operation, vat_rate_id):
+    """Recompute the components of a VAT rate after its percentage changed."""
+    vat_rate = VATRate.objects.get(vat_rate_id=vat_rate_id)
+    replace_vat_rate(vat_rate, vat_rate, operation.advance)
+
+
+def delete_vat_rate(operation, vat_rate_id):
+    """Move the components of a VAT rate to its successor and delete it."""
+    vat_rate = VATRate.objects.select_related(
+        'successor_vat_rate'
+    ).get(vat_rate_id=vat_rate_id)
+    replace_vat_rate(
+        vat_rate, vat_rate.successor_vat_rate, operation.advance
+    )
+    vat_rate.delete()
+
+
+def index_base_components(operation, company_id, start_date, percentage,
+                          amount, base_component_id):
+    """Index the components of one base component or all of them."""
+    index_components(
+        Tenancy.objects.get(company_id=company_id),
+        start_date,
+        percentage,
+        amount,
+        base_component_id,
+        operation.advance
+    )
+
+
+def end_tenancy_contracts(operation, company_id, contract_ids, end_date):
+    """End a set of contracts of a tenancy."""
+    end_contracts(
+        Tenancy.objects.get(company_id=company_id),
+        contract_ids,
+        end_date,
+        operation.advance
+    )
+
+
+def activate_tenancy_contracts(operation, company_id, contract_ids):
+    """Activate a set of draft contracts of a tenancy."""
+    activate_contracts(
+        Tenancy.objects.get(company_id=company_id),
+        contract_ids,
+        operation.advance
+    )
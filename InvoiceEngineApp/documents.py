@@ -0,0 +1,117 @@
+import multiprocessing
+import zipfile
+
+from django.template.loader import render_to_string
+
+from InvoiceEngineApp.models import (
+    Collection,
+    ContractPerson,
+    Invoice,
+    InvoiceLine,
+)
+
+
+# Payment methods for which the payer receives a printed or emailed invoice
+DOCUMENT_PAYMENT_METHODS = [ContractPerson.LETTER, ContractPerson.EMAIL]
+
+# Amount of invoices that is loaded from the database and sent to a worker
+# at once
+CHUNK_SIZE = 500
+
+
+def get_invoice_chunks(tenancy, date, chunk_size=CHUNK_SIZE):
+    """Generate the invoices of an invoicing run in chunks, each invoice
+    with its invoice lines and collections. Every chunk is loaded in three
+    queries, however many lines and collections the invoices have.
+    """
+    invoice_ids = list(
+        Collection.objects.filter(
+            tenancy=tenancy,
+            invoice__date=date,
+            payment_method__in=DOCUMENT_PAYMENT_METHODS
+        ).order_by(
+            'invoice_id'
+        ).values_list(
+            'invoice_id', flat=True
+        ).distinct()
+    )
+
+    for i in range(0, len(invoice_ids), chunk_size):
+        ids = invoice_ids[i:i + chunk_size]
+        invoices = {
+            invoice.invoice_id: (invoice, [], [])
+            for invoice in Invoice.objects.filter(
+                invoice_id__in=ids
+            ).select_related(
+                'tenancy', 'contract__contract_type'
+            ).order_by(
+                'invoice_id'
+            )
+        }
+
+        for invoice_line in InvoiceLine.objects.filter(
+                invoice_id__in=ids, date=date).order_by('invoice_line_id'):
+            invoices[invoice_line.invoice_id][1].append(invoice_line)
+
+        for collection in Collection.objects.filter(
+                invoice_id__in=ids).select_related('contract_person'):
+            invoices[collection.invoice_id][2].append(collection)
+
+        yield list(invoices.values())
+
+
+def render_chunk(chunk):
+    """Render the documents of one chunk of invoices. This runs in a worker
+    process and does not access the database: everything the template needs
+    has been loaded beforehand.
+    """
+    documents = []
+    for invoice, invoice_lines, collections in chunk:
+        documents.append((
+            "{}_{}.html".format(invoice.invoice_number, invoice.contract_id),
+            render_to_string(
+                'InvoiceEngineApp/invoice_document.html',
+                {
+                    'invoice': invoice,
+                    'invoice_lines': invoice_lines,
+                    'collections': collections,
+                }
+            )
+        ))
+    return documents
+
+
+def render_invoice_documents(tenancy, date, file, processes=None,
+                             chunk_size=CHUNK_SIZE):
+    """Render the documents of all invoices of the invoicing run on the given
+    date for payers who receive their invoice by letter or email, and write
+    them into one zip archive.
+
+    The main process loads the chunks from the database while a pool of
+    worker processes renders them. At most two chunks per process are in
+    flight, to bound the memory use. Returns the amount of documents.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    number_of_documents = 0
+
+    # Fork, so the workers inherit the configured Django environment
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes) as pool, \
+            zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        pending = []
+        for chunk in get_invoice_chunks(tenancy, date, chunk_size):
+            pending.append(pool.apply_async(render_chunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                number_of_documents += write_documents(archive, pending.pop(0))
+
+        for result in pending:
+            number_of_documents += write_documents(archive, result)
+
+    return number_of_documents
+
+
+def write_documents(archive, result):
+    documents = result.get()
+    for file_name, document in documents:
+        archive.writestr(file_name, document)
+    return len(documents)
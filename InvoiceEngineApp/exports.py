@@ -0,0 +1,90 @@
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.db import models
+
+
+# Amount of database rows that is fetched, converted and written at once.
+# Every batch becomes one row group in the Parquet file.
+ROW_GROUP_SIZE = 100000
+
+
+def get_arrow_type(field):
+    """Return the Arrow type used to store the values of a model field.
+    General ledger accounts and dimensions only take a handful of distinct
+    values, so they are dictionary-encoded.
+    """
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.CharField):
+        if field.name.startswith('gl_'):
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+    # Primary keys, foreign keys and the other integer fields
+    return pa.int64()
+
+
+def get_arrow_schema(model):
+    """Return the column names and the Arrow schema for a model. Foreign keys
+    are exported as their id, so no related objects have to be loaded.
+    """
+    fields = model._meta.concrete_fields
+    column_names = [field.attname for field in fields]
+    schema = pa.schema([
+        pa.field(field.attname, get_arrow_type(field), nullable=field.null)
+        for field in fields
+    ])
+    return column_names, schema
+
+
+def write_parquet(qs, file):
+    """Write all rows of the queryset to the given file in Parquet format.
+    The rows are streamed from the database with a server-side cursor and
+    written in row groups of ROW_GROUP_SIZE rows, so the memory use does not
+    depend on the size of the export.
+
+    Returns the amount of rows written.
+    """
+    column_names, schema = get_arrow_schema(qs.model)
+    rows = qs.values_list(*column_names).iterator(chunk_size=ROW_GROUP_SIZE)
+
+    number_of_rows = 0
+    batch = []
+    with pq.ParquetWriter(file, schema, compression='snappy') as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == ROW_GROUP_SIZE:
+                writer.write_table(create_table(batch, schema))
+                number_of_rows += len(batch)
+                batch = []
+
+        if batch or not number_of_rows:
+            # Also write an empty table, so the file always has a schema
+            writer.write_table(create_table(batch, schema))
+            number_of_rows += len(batch)
+
+    return number_of_rows
+
+
+def create_table(rows, schema):
+    """Transpose a list of database rows to typed Arrow columns."""
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type)
+         for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def export_parquet(qs):
+    """Write the queryset to a temporary file, which is returned rewound so
+    it can be sent to the user. The file is kept in memory for small exports
+    and moved to disk for large ones.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    write_parquet(qs, file)
+    file.seek(0)
+    return file
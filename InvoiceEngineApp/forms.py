@@ -1,9 +1,36 @@
-import datetime
+import re
 
 from django import forms
-from django.db.models import Func
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Exists, OuterRef
 
-from InvoiceEngineApp import models
+from InvoiceEngineApp import models, validators
+
+
+def get_search_query(value, weights):
+    """Return a text search query that matches every word of the value as
+    the start of a word in the parts of the search vector with the given
+    weights, or None if the value has no words to search for.
+    """
+    words = re.findall(r'[^\W_]+', value.lower())
+    if not words:
+        return None
+    return SearchQuery(
+        ' & '.join("{}:*{}".format(word, weights) for word in words),
+        config='simple',
+        search_type='raw'
+    )
+
+
+def set_choices(field, queryset, objects):
+    """Set the choices of a model choice field from objects that are already
+    in memory. The queryset is only used to validate a submitted choice.
+    """
+    field.queryset = queryset
+    choices = [(obj.pk, field.label_from_instance(obj)) for obj in objects]
+    if field.empty_label is not None:
+        choices.insert(0, ('', field.empty_label))
+    field.choices = choices
 
 
 class TenancySubscriberForm(forms.ModelForm):
@@ -16,6 +43,93 @@ class TenancySubscriberForm(forms.ModelForm):
         ]
 
 
+class ExportPeriodForm(forms.Form):
+    """Optional period to restrict an export to. Both dates are inclusive."""
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+
+    def filter_queryset(self, qs, date_field):
+        if self.cleaned_data.get('start_date'):
+            qs = qs.filter(**{
+                date_field + '__gte': self.cleaned_data.get('start_date')
+            })
+        if self.cleaned_data.get('end_date'):
+            qs = qs.filter(**{
+                date_field + '__lte': self.cleaned_data.get('end_date')
+            })
+        return qs
+
+
+class IndexationForm(forms.Form):
+    """The indexation of the components of one base component, or of all
+    base components, from a start date on. The amounts are raised by a
+    percentage or, for one base component, set to a new amount.
+    """
+    base_component = forms.ModelChoiceField(
+        queryset=models.BaseComponent.objects.none(),
+        required=False,
+        empty_label="All base components"
+    )
+    start_date = forms.DateField()
+    percentage = forms.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    amount = forms.DecimalField(
+        max_digits=15, decimal_places=2, required=False
+    )
+
+    def filter_selectors(self, company_id):
+        set_choices(
+            self.fields['base_component'],
+            models.BaseComponent.objects.filter(tenancy_id=company_id),
+            models.Tenancy.get_reference_data_of(
+                company_id
+            ).base_components.values()
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        percentage = cleaned_data.get('percentage')
+        amount = cleaned_data.get('amount')
+
+        if (percentage is None) == (amount is None):
+            raise forms.ValidationError(
+                "Enter either a percentage or a new amount."
+            )
+        if amount is not None and not cleaned_data.get('base_component'):
+            raise forms.ValidationError(
+                "A new amount can only be set for one base component."
+            )
+        return cleaned_data
+
+
+class ContractIdsForm(forms.Form):
+    """The ids of contracts to change at once."""
+    contract_ids = forms.CharField(
+        widget=forms.Textarea,
+        help_text="Separated by spaces, commas or new lines."
+    )
+
+    def clean_contract_ids(self):
+        try:
+            return sorted({
+                int(value) for value in re.split(
+                    r'[\s,]+', self.cleaned_data['contract_ids']
+                ) if value
+            })
+        except ValueError:
+            raise forms.ValidationError("Enter the contract ids as numbers.")
+
+
+class EndContractsForm(ContractIdsForm):
+    """The contracts to end at once, for instance those of a building that
+    is sold, and the date to end them on.
+    """
+    end_date = forms.DateField()
+
+    field_order = ['end_date', 'contract_ids']
+
+
 class ContractTypeForm(forms.ModelForm):
     """A form for the user to set the fields of a contract type.
     Tenancy is added automatically.
@@ -64,10 +178,12 @@ class ContractForm(forms.ModelForm):
     The user can choose contract type from a drop-down menu.
     """
     def filter_selectors(self, company_id):
-        self.fields['contract_type'].queryset = \
-            models.ContractType.objects.filter(
-                tenancy_id=company_id
-            )
+        reference_data = models.Tenancy.get_reference_data_of(company_id)
+        set_choices(
+            self.fields['contract_type'],
+            models.ContractType.objects.filter(tenancy_id=company_id),
+            reference_data.contract_types.values()
+        )
 
     def disable_fields(self):
         for field in self.fields:
@@ -76,24 +192,12 @@ class ContractForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        if cleaned_data.get('invoicing_period') == self.instance.CUSTOM:
-            if not cleaned_data.get('invoicing_amount_of_days'):
-                raise forms.ValidationError(
-                    "Fill in the amount of days to invoice."
-                )
-        else:
-            if cleaned_data.get('invoicing_amount_of_days'):
-                raise forms.ValidationError(
-                    "Only fill in the amount of days to invoice if choosing "
-                    "Custom invoicing period."
-                )
-
-        start_date = cleaned_data.get('start_date')
-        term_date = cleaned_data.get('termination_date')
-        if start_date and term_date and start_date > term_date:
-            raise forms.ValidationError(
-                "Termination date must be on or after start date."
-            )
+        validators.validate_contract(
+            cleaned_data.get('invoicing_period'),
+            cleaned_data.get('invoicing_amount_of_days'),
+            cleaned_data.get('start_date'),
+            cleaned_data.get('termination_date')
+        )
 
     class Meta:
         model = models.Contract
@@ -141,7 +245,9 @@ class ContractSearchForm(forms.Form):
         required=False,
         widget=forms.DateInput(attrs={'size': 8, 'placeholder': '2021-01-01'})
     )
-    total_amount = forms.FloatField(
+    total_amount = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
         required=False,
         widget=forms.TextInput(
             attrs={'size': 8,
@@ -150,7 +256,31 @@ class ContractSearchForm(forms.Form):
                    }
         )
     )
-    balance = forms.FloatField(
+    min_total_amount = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 4,
+                   'style': 'text-align: right',
+                   'placeholder': 'min'
+                   }
+        )
+    )
+    max_total_amount = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 4,
+                   'style': 'text-align: right',
+                   'placeholder': 'max'
+                   }
+        )
+    )
+    balance = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
         required=False,
         widget=forms.TextInput(
             attrs={'size': 8,
@@ -159,18 +289,30 @@ class ContractSearchForm(forms.Form):
                    }
         )
     )
+    min_balance = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 4,
+                   'style': 'text-align: right',
+                   'placeholder': 'min'
+                   }
+        )
+    )
+    max_balance = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 4,
+                   'style': 'text-align: right',
+                   'placeholder': 'max'
+                   }
+        )
+    )
 
     def filter_queryset(self, qs):
-        class Round2(Func):
-            function = "ROUND"
-            template = "%(function)s(%(expressions)s::numeric, 2)"
-
-            def __rand__(self, other):
-                pass
-
-            def __ror__(self, other):
-                pass
-
         if self.cleaned_data.get('contract_type'):
             qs = qs.filter(
                 contract_type__description__icontains=self.cleaned_data.get(
@@ -202,35 +344,33 @@ class ContractSearchForm(forms.Form):
                     'next_invoice_date'
                 )
             )
-        if self.cleaned_data.get('total_amount'):
-            qs = qs.annotate(rounded_total=Round2('total_amount')).filter(
-                rounded_total=self.cleaned_data.get(
-                    'total_amount'
-                )
-            )
-        if self.cleaned_data.get('balance'):
-            qs = qs.annotate(rounded_balance=Round2('balance')).filter(
-                rounded_balance=self.cleaned_data.get(
-                    'balance'
-                )
-            )
-        if self.cleaned_data.get('name'):
-            qs = qs.filter(
-                contractperson__name__icontains=self.cleaned_data.get(
-                    'name'
-                )
-            )
-        if self.cleaned_data.get('address'):
-            # Filter both the address and the city
-            qs = qs.filter(
-                contractperson__address__icontains=self.cleaned_data.get(
-                    'address'
-                )
-            ) | qs.filter(
-                contractperson__city__icontains=self.cleaned_data.get(
-                    'address'
-                )
+        # The amounts are stored with two decimals, so they are compared
+        # directly and the (tenancy, amount) indexes can be used
+        for field, lookup in [
+            ('total_amount', 'total_amount'),
+            ('min_total_amount', 'total_amount__gte'),
+            ('max_total_amount', 'total_amount__lte'),
+            ('balance', 'balance'),
+            ('min_balance', 'balance__gte'),
+            ('max_balance', 'balance__lte'),
+        ]:
+            if self.cleaned_data.get(field) is not None:
+                qs = qs.filter(**{lookup: self.cleaned_data.get(field)})
+        # Search the name and the address in one semi-join on the contract
+        # persons, so every contract is listed once
+        search = [
+            get_search_query(self.cleaned_data.get(field), weights)
+            for field, weights in [('name', 'A'), ('address', 'B')]
+            if self.cleaned_data.get(field)
+        ]
+        search = [query for query in search if query is not None]
+        if search:
+            persons = models.ContractPerson.objects.filter(
+                contract=OuterRef('pk')
             )
+            for query in search:
+                persons = persons.filter(search_vector=query)
+            qs = qs.filter(Exists(persons))
 
         return qs
 
@@ -241,14 +381,17 @@ class ComponentForm(forms.ModelForm):
         """Filter the querysets of the selectors for base component
         and VAT rate based on the tenancy and the VAT rate's end date.
         """
-        self.fields['base_component'].queryset = \
-            models.BaseComponent.objects.filter(
-                tenancy_id=company_id
-            )
-        self.fields['vat_rate'].queryset = \
-            models.VATRate.objects.filter(
-                tenancy_id=company_id
-            )
+        reference_data = models.Tenancy.get_reference_data_of(company_id)
+        set_choices(
+            self.fields['base_component'],
+            models.BaseComponent.objects.filter(tenancy_id=company_id),
+            reference_data.base_components.values()
+        )
+        set_choices(
+            self.fields['vat_rate'],
+            models.VATRate.objects.filter(tenancy_id=company_id),
+            reference_data.vat_rates.values()
+        )
 
     def disable_fields(self):
         for field in self.fields:
@@ -258,42 +401,19 @@ class ComponentForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        base_amount = cleaned_data.get("base_amount")
-        unit_id = cleaned_data.get("base_component").unit_id
-        unit_amount = cleaned_data.get("unit_amount")
-        number_of_units = cleaned_data.get("number_of_units")
-
-        # Check that using base amount or units is mutually exclusive
-        if unit_id:
-            if base_amount:
-                raise forms.ValidationError(
-                    "Please specify unit amount and number of units for unit "
-                    + unit_id.__str__()
-                    + ". Do not specify base amount."
-                )
-            if not unit_amount or not number_of_units:
-                raise forms.ValidationError(
-                    "Please specify unit amount and number of units for unit "
-                    + unit_id.__str__() + "."
-                )
-        else:
-            if not base_amount:
-                raise forms.ValidationError(
-                    "Please specify a base amount for this component."
-                )
-            if unit_amount or number_of_units:
-                raise forms.ValidationError(
-                    "Please specify a base amount for this component. "
-                    "Do not specify unit amount and number of units."
-                )
-
-        # Check that end date is after start date
         start_date = cleaned_data.get("start_date")
         end_date = cleaned_data.get("end_date")
-        if start_date and end_date and start_date > end_date:
-            raise forms.ValidationError(
-                "Start date cannot be after end date."
-            )
+
+        # Check that using base amount or units is mutually exclusive, and
+        # that end date is after start date
+        validators.validate_component(
+            cleaned_data.get("base_component").unit_id,
+            cleaned_data.get("base_amount"),
+            cleaned_data.get("unit_amount"),
+            cleaned_data.get("number_of_units"),
+            start_date,
+            end_date
+        )
 
         if self.instance.contract_id is not None:
             if start_date and not self.instance.contract.is_draft():
@@ -329,118 +449,27 @@ class ContractPersonFormSet(forms.BaseModelFormSet):
 
     def clean(self):
         super().clean()
-        none_valid = True
-        contract_start_percentage = 0
+        persons = []
         for form in self.forms:
             if self._should_delete_form(form) \
                     or (form.empty_permitted and not form.has_changed()):
                 continue
 
-            none_valid = False
             cleaned_data = form.clean()
-            payment_method = cleaned_data.get("payment_method")
-            iban = cleaned_data.get("iban")
-            mandate = cleaned_data.get("mandate")
-
-            if payment_method == models.ContractPerson.DIRECT_DEBIT:
-                if not iban or not mandate:
-                    raise forms.ValidationError(
-                        "Please provide an iban and a mandate."
-                    )
-            else:
-                if iban or mandate:
-                    raise forms.ValidationError(
-                        "Only fill in IBAN & mandate in case of Direct Debit"
-                        "payment method."
-                    )
-
-            start_date = cleaned_data.get("start_date")
-            end_date = cleaned_data.get("end_date")
-            if end_date and start_date and end_date < start_date:
-                raise forms.ValidationError(
-                    "End date should be after start date."
-                )
-
-            if end_date:
-                end_date += datetime.timedelta(days=1)
-
-            if not start_date:
-                continue
-
-            if start_date <= self.contract.start_date \
-                    and (not end_date or end_date >= self.contract.start_date):
-                contract_start_percentage \
-                    += cleaned_data.get('percentage_of_total')
-
-            percentage_start = 0
-            percentage_end = 0
-            for second_form in self.forms:
-                if self._should_delete_form(second_form) \
-                        or (second_form.empty_permitted
-                            and not second_form.has_changed()) \
-                        or not second_form.instance.start_date:
-                    continue
-
-                if second_form.instance.start_date <= start_date \
-                        and (not second_form.instance.end_date
-                             or start_date <= second_form.instance.end_date):
-                    percentage_start += second_form.instance.percentage_of_total
-
-                if end_date and second_form.instance.start_date <= end_date \
-                        and (not second_form.instance.end_date
-                             or end_date <= second_form.instance.end_date):
-                    percentage_end += second_form.instance.percentage_of_total
-                elif not end_date and not second_form.instance.end_date:
-                    percentage_end += second_form.instance.percentage_of_total
-
-            if percentage_start > 100:
-                raise forms.ValidationError(
-                    'Total of all persons exceeding 100% by '
-                    + (percentage_start - 100).__str__()
-                    + '% on '
-                    + start_date.__str__()
-                )
-            elif percentage_start < 100:
-                raise forms.ValidationError(
-                    'Total of all persons smaller than 100% by '
-                    + (100 - percentage_start).__str__()
-                    + '% on '
-                    + start_date.__str__()
-                )
-
-            if percentage_end > 100:
-                raise forms.ValidationError(
-                    'Total of all persons exceeding 100% by '
-                    + (percentage_end - 100).__str__()
-                    + '% '
-                    + ("on " + end_date.__str__()
-                       if end_date else "at the end.")
-                )
-            elif percentage_end < 100:
-                raise forms.ValidationError(
-                    'Total of all persons smaller than 100% by '
-                    + (100 - percentage_end).__str__()
-                    + "% "
-                    + ("on " + end_date.__str__()
-                       if end_date else "at the end.")
-                )
-
-        if none_valid:
-            raise forms.ValidationError(
-                'Please do not delete all persons.'
-            )
-
-        if contract_start_percentage > 100:
-            raise forms.ValidationError(
-                'Total of all persons exceeding 100% by '
-                + (contract_start_percentage - 100).__str__()
-                + '% '
-                + "on " + self.contract.start_date.__str__()
-            )
-        elif contract_start_percentage < 100:
-            raise forms.ValidationError(
-                'Total of all persons smaller than 100% by '
-                + (100 - contract_start_percentage).__str__()
-                + "% "
-                + "on " + self.contract.start_date.__str__()
+            validators.validate_contract_person(
+                cleaned_data.get("payment_method"),
+                cleaned_data.get("iban"),
+                cleaned_data.get("mandate"),
+                cleaned_data.get("mandate_date"),
+                cleaned_data.get("start_date"),
+                cleaned_data.get("end_date")
             )
+            persons.append((
+                cleaned_data.get("start_date"),
+                cleaned_data.get("end_date"),
+                cleaned_data.get("percentage_of_total")
+            ))
+
+        validators.validate_person_percentages(
+            persons, self.contract.start_date
+        )
@@ -0,0 +1,544 @@
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+
+from InvoiceEngineApp import validators
+from InvoiceEngineApp.bulk import round_two_places
+from InvoiceEngineApp.models import (
+    BaseComponent,
+    Component,
+    Contract,
+    ContractPerson,
+    Tenancy,
+    VATRate,
+)
+
+
+# Amount of contracts that is validated and loaded in one transaction
+IMPORT_BATCH_SIZE = 10000
+
+# The fields that can be imported, the same as in the forms. Foreign keys
+# are given by their id, e.g. contract_type_id.
+CONTRACT_FIELDS = [
+    'external_customer_id', 'contract_type', 'invoicing_period',
+    'invoicing_amount_of_days', 'pricing_type', 'start_date',
+    'termination_date', 'gl_dimension_1', 'gl_dimension_2',
+]
+COMPONENT_FIELDS = [
+    'base_component', 'vat_rate', 'description', 'start_date', 'end_date',
+    'base_amount', 'unit_amount', 'number_of_units',
+]
+PERSON_FIELDS = [
+    'type', 'name', 'address', 'city', 'start_date', 'end_date',
+    'payment_method', 'iban', 'mandate', 'mandate_date', 'email', 'phone',
+    'percentage_of_total', 'payment_day',
+]
+
+
+def read_jsonl(file):
+    """Generate the line number and the record of every contract in a JSON
+    lines file: one contract per line, with its components and persons in
+    the lists "components" and "persons". A line that is not valid JSON
+    gives a ValidationError as its record, so it is reported like an
+    invalid contract.
+    """
+    for line_number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                record = ValidationError(
+                    "Invalid JSON: {}.".format(getattr(error, 'msg', error))
+                )
+            yield line_number, record
+
+
+def read_csv(file):
+    """Generate the line number and the record of every contract in a CSV
+    file. The column "record" says whether a row is a contract, a component
+    or a person; components and persons belong to the contract above them.
+    The other columns are the fields of the three, empty if not applicable.
+    A row that cannot be read gives a ValidationError as its record, as in
+    read_jsonl.
+    """
+    reader = csv.DictReader(file)
+    line_number = None
+    record = None
+    for row in reader:
+        kind = row.pop('record')
+        values = {name: value for name, value in row.items() if value != ''}
+        if kind == 'contract':
+            if record is not None:
+                yield line_number, record
+            line_number = reader.line_num
+            record = dict(values, components=[], persons=[])
+        elif kind not in ('component', 'person'):
+            yield reader.line_num, ValidationError(
+                "Unknown record {}.".format(kind)
+            )
+        elif record is None:
+            yield reader.line_num, ValidationError(
+                "{} before the first contract.".format(kind.capitalize())
+            )
+        else:
+            record[kind + 's'].append(values)
+    if record is not None:
+        yield line_number, record
+
+
+def clean_values(model, names, values):
+    """Convert and validate the values of one object with the model fields,
+    as a model form does, and return them by column name.
+    """
+    cleaned = {}
+    for name in names:
+        field = model._meta.get_field(name)
+        value = values.get(field.attname)
+        if value == '':
+            value = None
+        if value is not None \
+                and not isinstance(value, (str, int, float)):
+            raise ValidationError(
+                "{}: Enter a single value.".format(field.attname)
+            )
+        if value is None and field.has_default():
+            value = field.get_default()
+
+        if field.is_relation:
+            if value is None:
+                if not field.null:
+                    raise ValidationError(
+                        "{}: This field is required.".format(field.attname)
+                    )
+            else:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ValidationError(
+                        "{}: Enter a whole number.".format(field.attname)
+                    )
+        else:
+            try:
+                value = field.clean(value, None)
+            except ValidationError as error:
+                raise ValidationError("{}: {}".format(
+                    field.attname, " ".join(error.messages)
+                ))
+            except (TypeError, ValueError):
+                # E.g. a JSON number for a date
+                raise ValidationError(
+                    "{}: Enter a valid value.".format(field.attname)
+                )
+        cleaned[field.column] = value
+    return cleaned
+
+
+def get_objects(record, name):
+    """Return the list of objects of a record by its name, such as its
+    components, checking that it is one.
+    """
+    objects = record.get(name, [])
+    if not isinstance(objects, list) \
+            or not all(isinstance(values, dict) for values in objects):
+        raise ValidationError("{}: Expected a list of objects.".format(name))
+    return objects
+
+
+def clean_record(record, reference_data):
+    """Validate a contract with its components and persons, with the rules
+    of the forms, and return the cleaned contract, components and persons.
+    Reference data is taken from memory, so nothing is queried.
+    """
+    if isinstance(record, ValidationError):
+        # A line that could not be read, see read_jsonl
+        raise record
+    if not isinstance(record, dict):
+        raise ValidationError("Expected an object.")
+    contract = clean_values(Contract, CONTRACT_FIELDS, record)
+    if contract['contract_type_id'] not in reference_data.contract_types:
+        raise ValidationError("Unknown contract type.")
+    validators.validate_contract(
+        contract['invoicing_period'],
+        contract['invoicing_amount_of_days'],
+        contract['start_date'],
+        contract['termination_date']
+    )
+
+    components = []
+    for values in get_objects(record, 'components'):
+        component = clean_values(Component, COMPONENT_FIELDS, values)
+        base_component = reference_data.base_components.get(
+            component['base_component_id']
+        )
+        if base_component is None:
+            raise ValidationError("Unknown base component.")
+        if component['vat_rate_id'] is not None \
+                and component['vat_rate_id'] not in reference_data.vat_rates:
+            raise ValidationError("Unknown VAT rate.")
+        validators.validate_component(
+            base_component.unit_id,
+            component['base_amount'],
+            component['unit_amount'],
+            component['number_of_units'],
+            component['start_date'],
+            component['end_date']
+        )
+        components.append(component)
+
+    persons = []
+    for values in get_objects(record, 'persons'):
+        person = clean_values(ContractPerson, PERSON_FIELDS, values)
+        validators.validate_contract_person(
+            person['payment_method'],
+            person['iban'],
+            person['mandate'],
+            person['mandate_date'],
+            person['start_date'],
+            person['end_date']
+        )
+        persons.append(person)
+    validators.validate_person_percentages(
+        [
+            (person['start_date'], person['end_date'],
+             person['percentage_of_total'])
+            for person in persons
+        ],
+        contract['start_date']
+    )
+
+    return contract, components, persons
+
+
+def get_columns(model, names):
+    return ['contract_id'] + [
+        model._meta.get_field(name).column for name in names
+    ]
+
+
+def create_staging_table(cursor, name, model, names):
+    """Create a temporary table for the imported values of a model."""
+    fields = [model._meta.get_field(name) for name in names]
+    cursor.execute(
+        'CREATE TEMPORARY TABLE {} (contract_id integer, {}) '
+        'ON COMMIT DROP'.format(
+            name,
+            ', '.join(
+                '{} {}'.format(
+                    connection.ops.quote_name(field.column),
+                    'integer' if field.is_relation
+                    else field.db_type(connection)
+                )
+                for field in fields
+            )
+        )
+    )
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Load rows into a table with COPY, which is much faster than INSERT."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '' if row.get(column) is None else row.get(column)
+            for column in columns
+        ])
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            table,
+            ', '.join(connection.ops.quote_name(column) for column in columns)
+        ),
+        buffer
+    )
+
+
+def allocate_ids(cursor, model, amount):
+    """Take an amount of primary keys from the sequence of a model's table,
+    so the rows that refer to them can be loaded before the rows themselves.
+    """
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+        "FROM generate_series(1, %s)",
+        [
+            connection.ops.quote_name(model._meta.db_table),
+            model._meta.pk.column,
+            amount
+        ]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def quote(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def get_insert_sql():
+    """Return the statement that inserts the staged components, with their
+    VAT and total amounts computed as Component.set_derived_fields does, and
+    the staged contracts, with the sums of the amounts of their components.
+    Staged contracts with the id of an existing draft contract update it.
+    """
+    contract_columns = get_columns(Contract, CONTRACT_FIELDS)
+    component_columns = get_columns(Component, COMPONENT_FIELDS)
+    amount = round_two_places(
+        "COALESCE(staged.number_of_units, 0) "
+        "* COALESCE(staged.unit_amount, 0)"
+    )
+    vat_amount = round_two_places(
+        round_two_places("percentage / 100") + " * amount"
+    )
+    return """
+    WITH components AS (
+        INSERT INTO {component} (
+            tenancy_id, {component_columns}, unit_id, vat_amount,
+            total_amount
+        )
+        SELECT %(company_id)s, {component_columns}, unit_id,
+            vat_amount, amount + vat_amount
+        FROM (
+            SELECT *,
+                CASE WHEN percentage IS NULL THEN 0
+                ELSE {vat_amount} END AS vat_amount
+            FROM (
+                SELECT staged.*, base.unit_id, vat.percentage,
+                    CASE WHEN COALESCE(staged.base_amount, 0) <> 0
+                    THEN staged.base_amount ELSE {amount} END AS amount
+                FROM import_component staged
+                JOIN {base_component} base
+                    ON base.base_component_id = staged.base_component_id
+                LEFT JOIN {vat_rate} vat
+                    ON vat.vat_rate_id = staged.vat_rate_id
+            ) amounts
+        ) derived
+        RETURNING contract_id, total_amount - vat_amount AS base_amount,
+            vat_amount, total_amount
+    )
+    INSERT INTO {contract} (
+        tenancy_id, {contract_columns}, status, balance, base_amount,
+        vat_amount, total_amount
+    )
+    SELECT %(company_id)s, {staged_contract_columns}, %(status)s, 0,
+        COALESCE(sums.base_amount, 0), COALESCE(sums.vat_amount, 0),
+        COALESCE(sums.total_amount, 0)
+    FROM import_contract staged
+    LEFT JOIN (
+        SELECT contract_id, SUM(base_amount) AS base_amount,
+            SUM(vat_amount) AS vat_amount, SUM(total_amount) AS total_amount
+        FROM components
+        GROUP BY contract_id
+    ) sums ON sums.contract_id = staged.contract_id
+    ON CONFLICT (contract_id) DO UPDATE SET
+        {updated_columns}, base_amount = EXCLUDED.base_amount,
+        vat_amount = EXCLUDED.vat_amount,
+        total_amount = EXCLUDED.total_amount
+    WHERE {contract}.tenancy_id = EXCLUDED.tenancy_id
+        AND {contract}.status = EXCLUDED.status
+    """.format(
+        component=quote(Component),
+        contract=quote(Contract),
+        base_component=quote(BaseComponent),
+        vat_rate=quote(VATRate),
+        component_columns=', '.join(
+            connection.ops.quote_name(column) for column in component_columns
+        ),
+        contract_columns=', '.join(
+            connection.ops.quote_name(column) for column in contract_columns
+        ),
+        updated_columns=', '.join(
+            '{0} = EXCLUDED.{0}'.format(connection.ops.quote_name(column))
+            for column in contract_columns[1:]
+        ),
+        staged_contract_columns=', '.join(
+            'staged.' + connection.ops.quote_name(column)
+            for column in contract_columns
+        ),
+        amount=amount,
+        vat_amount=vat_amount,
+    )
+
+
+def load_contracts(tenancy, contracts, contract_ids=None):
+    """Load cleaned contracts, with their components and persons, into the
+    database as draft contracts in one transaction. The rows are copied into
+    staging tables, from which the tables are filled with one statement
+    each. Returns the ids of the contracts.
+
+    Contracts can be given the id of an existing draft contract of the
+    tenancy in contract_ids, to replace that contract with its components
+    and persons. The others, with None as id, are created.
+    """
+    if contract_ids is None:
+        contract_ids = [None] * len(contracts)
+    existing_ids = [
+        contract_id for contract_id in contract_ids if contract_id is not None
+    ]
+    person_columns = get_columns(ContractPerson, PERSON_FIELDS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        new_ids = iter(allocate_ids(
+            cursor, Contract, len(contracts) - len(existing_ids)
+        ))
+        contract_ids = [
+            next(new_ids) if contract_id is None else contract_id
+            for contract_id in contract_ids
+        ]
+        if existing_ids:
+            Component.objects.filter(contract_id__in=existing_ids).delete()
+            # With one statement of our own rather than QuerySet.delete,
+            # which would load every person to send its delete signal and
+            # follow its cascades. The signal would raise the data
+            # generation, which is done once below, and drafts have no
+            # collections to cascade to.
+            cursor.execute(
+                "DELETE FROM {} WHERE contract_id = ANY(%s)".format(
+                    quote(ContractPerson)
+                ),
+                [existing_ids]
+            )
+        contract_rows = []
+        component_rows = []
+        person_rows = []
+        for contract_id, (contract, components, persons) in zip(
+                contract_ids, contracts):
+            contract_rows.append(dict(contract, contract_id=contract_id))
+            component_rows.extend(
+                dict(component, contract_id=contract_id)
+                for component in components
+            )
+            person_rows.extend(
+                dict(person, contract_id=contract_id) for person in persons
+            )
+
+        for table, model, names, rows in [
+                ('import_contract', Contract, CONTRACT_FIELDS, contract_rows),
+                ('import_component', Component, COMPONENT_FIELDS,
+                 component_rows),
+                ('import_person', ContractPerson, PERSON_FIELDS,
+                 person_rows)]:
+            create_staging_table(cursor, table, model, names)
+            copy_rows(cursor, table, get_columns(model, names), rows)
+
+        cursor.execute(get_insert_sql(), {
+            'company_id': tenancy.company_id,
+            'status': Contract.DRAFT,
+        })
+        cursor.execute(
+            'INSERT INTO {} (tenancy_id, {columns}) '
+            'SELECT %s, {columns} FROM import_person'.format(
+                quote(ContractPerson),
+                columns=', '.join(
+                    connection.ops.quote_name(column)
+                    for column in person_columns
+                )
+            ),
+            [tenancy.company_id]
+        )
+        # Within an outer transaction the tables are not dropped on commit
+        cursor.execute(
+            'DROP TABLE import_contract, import_component, import_person'
+        )
+
+        Tenancy.objects.filter(
+            company_id=tenancy.company_id
+        ).update(
+            number_of_contracts=F('number_of_contracts')
+            + len(contracts) - len(existing_ids)
+        )
+        Tenancy.raise_data_generation(tenancy.company_id)
+
+    return contract_ids
+
+
+def import_contracts(tenancy, records, dry_run=False, progress=None,
+                     batch_size=IMPORT_BATCH_SIZE):
+    """Import contracts with their components and persons as drafts, from
+    (line number, record) pairs as generated by read_jsonl and read_csv.
+
+    The records are validated in batches with the rules of the forms, and
+    the valid ones are loaded batch by batch, each in its own transaction.
+    Invalid contracts are skipped. The progress function, if given, is
+    called with the amount of imported contracts and the list of errors so
+    far after every batch. Returns the amount of imported contracts and the
+    errors, as (line number, message) pairs.
+    """
+    reference_data = Tenancy.get_reference_data_of(tenancy.company_id)
+    imported = 0
+    errors = []
+    batch = []
+
+    def load():
+        nonlocal imported
+        if batch and not dry_run:
+            load_contracts(tenancy, batch)
+        imported += len(batch)
+        batch.clear()
+        if progress:
+            progress(imported, errors)
+
+    for line_number, record in records:
+        try:
+            batch.append(clean_record(record, reference_data))
+        except ValidationError as error:
+            errors.append((line_number, " ".join(error.messages)))
+        if len(batch) >= batch_size:
+            load()
+    load()
+
+    return imported, errors
+
+
+def upsert_contracts(tenancy, records):
+    """Create or replace draft contracts, with their components and persons,
+    from records with the layout of read_jsonl. A record with a contract_id
+    replaces that draft contract, the others are created. All valid records
+    are saved in one transaction.
+
+    Returns a result per record, in the same order: the contract id and
+    whether it was created, or the errors of an invalid record.
+    """
+    reference_data = Tenancy.get_reference_data_of(tenancy.company_id)
+    results = []
+    contracts = []
+    contract_ids = []
+    with transaction.atomic():
+        # Lock the drafts, so they are not activated while being replaced
+        drafts = set(Contract.objects.select_for_update().filter(
+            tenancy_id=tenancy.company_id,
+            status=Contract.DRAFT,
+            contract_id__in=[
+                record.get('contract_id') for record in records
+                if isinstance(record, dict)
+                and isinstance(record.get('contract_id'), int)
+            ]
+        ).values_list('contract_id', flat=True))
+
+        for record in records:
+            try:
+                if not isinstance(record, dict):
+                    raise ValidationError("Expected an object.")
+                contract_id = record.get('contract_id')
+                if contract_id is not None:
+                    if not isinstance(contract_id, int) \
+                            or contract_id not in drafts:
+                        raise ValidationError("Unknown draft contract.")
+                    if contract_id in contract_ids:
+                        raise ValidationError("Contract given twice.")
+                contracts.append(clean_record(record, reference_data))
+                contract_ids.append(contract_id)
+                results.append({'created': contract_id is None})
+            except ValidationError as error:
+                results.append({'errors': error.messages})
+
+        if contracts:
+            contract_ids = iter(
+                load_contracts(tenancy, contracts, contract_ids)
+            )
+            for result in results:
+                if 'created' in result:
+                    result['contract_id'] = next(contract_ids)
+
+    return results
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.bulk import BATCH_SIZE, activate_contracts
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Activate many draft contracts of a tenancy at once, for instance " \
+           "after a migration. Contracts that cannot be activated yet are " \
+           "skipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        parser.add_argument('contract_ids', type=int, nargs='*')
+        parser.add_argument(
+            '--file',
+            help="File with more contract ids, one per line."
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Activate all draft contracts of the tenancy."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help="Amount of contracts that is activated per transaction."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        contract_ids = set(options['contract_ids'])
+        if options['file']:
+            with open(options['file']) as file:
+                contract_ids.update(int(line) for line in file if line.strip())
+        if not contract_ids and not options['all']:
+            raise CommandError("No contract ids given, and no --all.")
+
+        def progress(done, total):
+            self.stdout.write("{} of {} contracts done".format(done, total))
+
+        number_of_contracts = activate_contracts(
+            tenancy,
+            None if options['all'] else sorted(contract_ids),
+            progress,
+            options['batch_size']
+        )
+        self.stdout.write("Activated {} contracts".format(number_of_contracts))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.audit import (
+    get_amount_differences,
+    get_percentage_ranges,
+)
+from InvoiceEngineApp.models import Tenancy
+from InvoiceEngineApp.validators import get_percentage_error
+
+
+class Command(BaseCommand):
+    help = "Check the contracts of a tenancy before an invoicing run: the " \
+           "persons of active and terminated contracts pay 100% together, " \
+           "and the amounts of every contract are the sums of those of its " \
+           "components. Fails if a contract does not."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+
+    def handle(self, *args, **options):
+        company_id = options['company_id']
+        if not Tenancy.objects.filter(company_id=company_id).exists():
+            raise CommandError("No tenancy with this company id.")
+
+        contract_ids = set()
+        for contract_id, first_day, last_day, total in \
+                get_percentage_ranges(company_id):
+            contract_ids.add(contract_id)
+            self.stdout.write("Contract {}: {}".format(
+                contract_id,
+                get_percentage_error(total, first_day, last_day)
+            ))
+
+        for contract_id, amounts, sums in get_amount_differences(company_id):
+            contract_ids.add(contract_id)
+            self.stdout.write(
+                "Contract {}: base, VAT and total amount {} {} {}, "
+                "components {} {} {}".format(contract_id, *amounts, *sums)
+            )
+
+        if contract_ids:
+            raise CommandError(
+                "{} contracts failed the audit.".format(len(contract_ids))
+            )
+        self.stdout.write("All contracts passed the audit.")
@@ -0,0 +1,54 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.bulk import CONTRACT_BATCH_SIZE, end_contracts
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "End many contracts of a tenancy at once, for instance those of " \
+           "a building that is sold. Periods after the end date that have " \
+           "already been invoiced are credited with correction invoices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        parser.add_argument('end_date', type=datetime.date.fromisoformat)
+        parser.add_argument('contract_ids', type=int, nargs='*')
+        parser.add_argument(
+            '--file',
+            help="File with more contract ids, one per line."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CONTRACT_BATCH_SIZE,
+            help="Amount of contracts that is ended per transaction."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        contract_ids = set(options['contract_ids'])
+        if options['file']:
+            with open(options['file']) as file:
+                contract_ids.update(int(line) for line in file if line.strip())
+        if not contract_ids:
+            raise CommandError("No contract ids given.")
+
+        def progress(done, total):
+            self.stdout.write("{} of {} contracts done".format(done, total))
+
+        number_of_contracts = end_contracts(
+            tenancy,
+            sorted(contract_ids),
+            options['end_date'],
+            progress,
+            options['batch_size']
+        )
+        self.stdout.write("Ended {} of {} contracts".format(
+            number_of_contracts, len(contract_ids)
+        ))
@@ -0,0 +1,68 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.models import Tenancy
+from InvoiceEngineApp.payments import PAYMENT_BATCH_SIZE, import_bank_statement
+
+
+class Command(BaseCommand):
+    help = "Book the payments of a CAMT.053 bank statement to the open " \
+           "collections of a tenancy, reducing the balances of their " \
+           "invoices and contracts. Payments that match no collection are " \
+           "listed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        parser.add_argument('file')
+        parser.add_argument(
+            '--gl-account',
+            required=True,
+            help="General ledger account of the bank account."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PAYMENT_BATCH_SIZE,
+            help="Amount of transactions that is booked per transaction."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        def progress(done, matched):
+            self.stdout.write(
+                "{} transactions done, {} matched".format(done, matched)
+            )
+
+        start_time = datetime.datetime.now()
+        with open(options['file'], 'rb') as file:
+            number_matched, total, unmatched, number_skipped = \
+                import_bank_statement(
+                    tenancy,
+                    file,
+                    options['gl_account'],
+                    progress,
+                    options['batch_size']
+                )
+
+        for payment in unmatched:
+            self.stdout.write("Not matched: {} {} {} {}".format(
+                payment['date'],
+                payment['reference'] or '',
+                payment['amount'] if payment['credit'] else -payment['amount'],
+                payment['end_to_end_id'] or payment['remittance'] or ''
+            ))
+        self.stdout.write(
+            "Booked {} payments of {:.2f} in total, {} not matched, {} "
+            "booked before, in {}".format(
+                number_matched,
+                total,
+                len(unmatched),
+                number_skipped,
+                datetime.datetime.now() - start_time
+            )
+        )
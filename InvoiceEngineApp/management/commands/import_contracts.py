@@ -0,0 +1,85 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.imports import (
+    IMPORT_BATCH_SIZE,
+    import_contracts,
+    read_csv,
+    read_jsonl,
+)
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Import draft contracts with their components and persons from " \
+           "a JSON lines or CSV file, e.g. when migrating a portfolio. " \
+           "Invalid contracts are reported and skipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        parser.add_argument('file')
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            help="Layout of the file, by default taken from its extension."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help="Amount of contracts that is imported per transaction."
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only validate the file."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        file_format = options['format'] \
+            or ('csv' if options['file'].endswith('.csv') else 'jsonl')
+        read = read_csv if file_format == 'csv' else read_jsonl
+
+        imported = 0
+
+        def progress(done, errors):
+            nonlocal imported
+            imported = done
+            self.stdout.write("{} contracts {}, {} invalid".format(
+                done,
+                'validated' if options['dry_run'] else 'imported',
+                len(errors)
+            ))
+
+        with open(options['file'], newline='') as file:
+            try:
+                imported, errors = import_contracts(
+                    tenancy,
+                    read(file),
+                    options['dry_run'],
+                    progress,
+                    options['batch_size']
+                )
+            except (ValueError, csv.Error) as error:
+                # The file cannot be read on, e.g. it is not UTF-8
+                raise CommandError(
+                    "{}; stopped after {} {} contracts.".format(
+                        error,
+                        imported,
+                        'validated' if options['dry_run'] else 'imported'
+                    )
+                )
+
+        for line_number, message in errors:
+            self.stderr.write("Line {}: {}".format(line_number, message))
+        self.stdout.write("{} {} contracts, skipped {}".format(
+            'Validated' if options['dry_run'] else 'Imported',
+            imported,
+            len(errors)
+        ))
@@ -0,0 +1,63 @@
+import datetime
+import decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.bulk import CONTRACT_BATCH_SIZE, index_components
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Index the components that run on the start date, for instance " \
+           "for the yearly rent increase: replace them by components with " \
+           "an amount raised by a percentage, or set to a new amount."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        parser.add_argument(
+            'start_date',
+            type=datetime.date.fromisoformat,
+            help="Date from which the new amounts apply."
+        )
+        amount = parser.add_mutually_exclusive_group(required=True)
+        amount.add_argument('--percentage', type=decimal.Decimal)
+        amount.add_argument(
+            '--amount',
+            type=decimal.Decimal,
+            help="New amount, or unit amount. Requires --base-component."
+        )
+        parser.add_argument(
+            '--base-component',
+            type=int,
+            help="Id of the base component to index (default: all)."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CONTRACT_BATCH_SIZE,
+            help="Amount of contracts that is changed per transaction."
+        )
+
+    def handle(self, *args, **options):
+        if options['amount'] is not None and not options['base_component']:
+            raise CommandError("A new amount requires --base-component.")
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        def progress(done, total):
+            self.stdout.write("{} of {} contracts done".format(done, total))
+
+        number_of_components = index_components(
+            tenancy,
+            options['start_date'],
+            options['percentage'],
+            options['amount'],
+            options['base_component'],
+            progress,
+            options['batch_size']
+        )
+        self.stdout.write(
+            "Indexed {} components".format(number_of_components)
+        )
@@ -0,0 +1,76 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from InvoiceEngineApp.partitions import (
+    PARTITIONED_MODELS,
+    add_months,
+    create_partition,
+    get_partition_month,
+    get_partition_name,
+    get_partitions,
+    move_partition,
+)
+
+
+def month(value):
+    """Parse a month in the format YYYY-MM."""
+    return datetime.datetime.strptime(value, '%Y-%m').date()
+
+
+class Command(BaseCommand):
+    help = "Create the monthly partitions of the invoice line and general " \
+           "ledger post tables, and move old partitions to another " \
+           "tablespace. Run this before the invoicing runs of a new month."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start',
+            type=month,
+            help="First month to create a partition for, as YYYY-MM "
+                 "(default: this month). Rows of earlier months that are "
+                 "still in the default partition are moved."
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help="Amount of future months to create partitions for."
+        )
+        parser.add_argument(
+            '--tablespace',
+            help="Tablespace to move old partitions to."
+        )
+        parser.add_argument(
+            '--archive-before',
+            type=month,
+            help="Move the partitions of the months before this month "
+                 "(YYYY-MM) to the tablespace."
+        )
+
+    def handle(self, *args, **options):
+        this_month = datetime.date.today().replace(day=1)
+        start = options['start'] or this_month
+        end = add_months(this_month, options['months_ahead'])
+
+        for model in PARTITIONED_MODELS:
+            partitions = get_partitions(model)
+            current = start
+            while current <= end:
+                if get_partition_name(model, current) not in partitions:
+                    moved = create_partition(model, current)
+                    self.stdout.write("Created {} ({} rows moved)".format(
+                        get_partition_name(model, current), moved
+                    ))
+                current = add_months(current, 1)
+
+            if options['tablespace'] and options['archive_before']:
+                for name in sorted(get_partitions(model)):
+                    partition_month = get_partition_month(name)
+                    if partition_month < options['archive_before']:
+                        move_partition(
+                            model, partition_month, options['tablespace']
+                        )
+                        self.stdout.write("Moved {} to {}".format(
+                            name, options['tablespace']
+                        ))
@@ -0,0 +1,73 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.audit import reconcile_balances
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Compare the balances of invoices and contracts with the " \
+           "general ledger, and the collections of invoices with their " \
+           "amount, for tenancies in parallel. Use --fix to correct the " \
+           "balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'company_ids',
+            type=int,
+            nargs='*',
+            help="Tenancies to reconcile (default: all)."
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help="Set the balances to those in the general ledger."
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help="Amount of worker processes (default: amount of CPUs)."
+        )
+
+    def handle(self, *args, **options):
+        company_ids = options['company_ids'] or list(
+            Tenancy.objects.order_by(
+                'company_id'
+            ).values_list('company_id', flat=True)
+        )
+
+        start_time = datetime.datetime.now()
+        unresolved = 0
+        for company_id, balance_differences, collection_differences in \
+                reconcile_balances(
+                    company_ids, options['fix'], options['processes']):
+            for kind, object_id, balance, amount in balance_differences:
+                self.stdout.write(
+                    "Tenancy {}: {} {} has balance {}, ledger {}".format(
+                        company_id, kind, object_id, balance, amount
+                    )
+                )
+            for invoice_id, amount, collected in collection_differences:
+                self.stdout.write(
+                    "Tenancy {}: invoice {} of {}, collections {}".format(
+                        company_id, invoice_id, amount, collected
+                    )
+                )
+            self.stdout.write("Tenancy {}: {} balances {}".format(
+                company_id,
+                len(balance_differences),
+                'fixed' if options['fix'] else 'differ'
+            ))
+
+            unresolved += len(collection_differences)
+            if not options['fix']:
+                unresolved += len(balance_differences)
+
+        self.stdout.write("Reconciled {} tenancies in {}".format(
+            len(company_ids), datetime.datetime.now() - start_time
+        ))
+        if unresolved:
+            raise CommandError(
+                "{} differences are not resolved.".format(unresolved)
+            )
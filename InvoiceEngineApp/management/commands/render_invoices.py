@@ -0,0 +1,55 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.documents import render_invoice_documents
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Render the invoices of an invoicing run for payers who receive " \
+           "their invoice by letter or email, and write them to a zip file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_id', type=int)
+        # Required, as the last invoice date may be that of a correction
+        # invoice rather than of an invoicing run
+        parser.add_argument(
+            'date',
+            type=datetime.date.fromisoformat,
+            help="Date of the invoicing run, as YYYY-MM-DD."
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help="Amount of worker processes (default: amount of CPUs)."
+        )
+        parser.add_argument(
+            '--output',
+            help="File to write to (default: <date>_invoices.zip)."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError("No tenancy with this company id.")
+
+        date = options['date']
+        if not tenancy.invoice_set.filter(date=date).exists():
+            raise CommandError("This tenancy has no invoices on this date.")
+
+        output = options['output'] or "{}_invoices.zip".format(date)
+        start_time = datetime.datetime.now()
+        with open(output, 'wb') as file:
+            number_of_documents = render_invoice_documents(
+                tenancy, date, file, options['processes']
+            )
+
+        self.stdout.write(
+            "Rendered {} invoices to {} in {}".format(
+                number_of_documents,
+                output,
+                datetime.datetime.now() - start_time
+            )
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.bulk import BATCH_SIZE, replace_vat_rate
+from InvoiceEngineApp.models import VATRate
+
+
+class Command(BaseCommand):
+    help = "Recompute the VAT and total amounts of all components of a VAT " \
+           "rate and of their contracts, for instance after its percentage " \
+           "was changed, or move them to another VAT rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('vat_rate_id', type=int)
+        parser.add_argument(
+            '--to',
+            type=int,
+            help="Id of the VAT rate to move the components to (default: "
+                 "keep the VAT rate)."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help="Amount of component ids that is updated per transaction."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            vat_rate = VATRate.objects.get(vat_rate_id=options['vat_rate_id'])
+            new_vat_rate = vat_rate
+            if options['to']:
+                new_vat_rate = VATRate.objects.get(
+                    vat_rate_id=options['to'],
+                    tenancy_id=vat_rate.tenancy_id
+                )
+        except VATRate.DoesNotExist:
+            raise CommandError("No VAT rate with this id in the tenancy.")
+
+        def progress(done, total):
+            self.stdout.write("{} of {} components done".format(done, total))
+
+        number_of_components = replace_vat_rate(
+            vat_rate, new_vat_rate, progress, options['batch_size']
+        )
+        self.stdout.write(
+            "Recomputed {} components of {}".format(
+                number_of_components, vat_rate
+            )
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0054_contract_pricing_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenancy',
+            name='creditor_bic',
+            field=models.CharField(blank=True, default=None, max_length=11, null=True),
+        ),
+        migrations.AddField(
+            model_name='tenancy',
+            name='creditor_iban',
+            field=models.CharField(blank=True, default=None, max_length=34, null=True),
+        ),
+        migrations.AddField(
+            model_name='tenancy',
+            name='creditor_identifier',
+            field=models.CharField(blank=True, default=None, max_length=35, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.7 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0055_tenancy_creditor_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(condition=models.Q(date_next_prolongation__isnull=False), fields=['tenancy', 'date_next_prolongation'], name='contract_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='component',
+            index=models.Index(condition=models.Q(date_next_prolongation__isnull=False), fields=['contract', 'tenancy'], name='component_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contractperson',
+            index=models.Index(fields=['tenancy', 'contract'], name='contractperson_tenancy_idx'),
+        ),
+    ]
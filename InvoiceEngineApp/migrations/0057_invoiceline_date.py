@@ -0,0 +1,42 @@
+# Generated by Django 3.1.7 on 2026-10-19 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_invoice_line_dates(apps, schema_editor):
+    InvoiceLine = apps.get_model('InvoiceEngineApp', 'InvoiceLine')
+    Invoice = apps.get_model('InvoiceEngineApp', 'Invoice')
+    InvoiceLine.objects.update(
+        date=models.Subquery(
+            Invoice.objects.filter(
+                invoice_id=models.OuterRef('invoice_id')
+            ).values('date')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0056_invoicing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceline',
+            name='date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(set_invoice_line_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='date',
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name='generalledgerpost',
+            name='invoice_line',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.invoiceline'),
+        ),
+    ]
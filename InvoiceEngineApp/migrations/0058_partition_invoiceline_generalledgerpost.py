@@ -0,0 +1,95 @@
+# Generated by Django 3.1.7 on 2026-10-19 11:45
+
+from django.db import migrations
+
+
+def partition_table(table, primary_key, foreign_keys, indexes=(),
+                    sequence=None):
+    """Return the SQL to turn a table into a table that is partitioned by
+    range on its date column, and the SQL to revert this.
+
+    The existing table is renamed and attached as the default partition of
+    a new partitioned table with the same columns, so no rows are copied.
+    Monthly partitions are added by the manage_partitions command. The
+    primary key of a partitioned table has to include the partition key,
+    so it becomes (primary_key, date); values of the primary key are still
+    unique, since they are assigned by the application or a sequence.
+    Indexes and foreign keys are created
+    on the partitioned table; PostgreSQL reuses the existing ones of the
+    default partition.
+    """
+    default = table + '_default'
+    sql = [
+        'ALTER TABLE "{t}" RENAME TO "{d}"',
+        'ALTER TABLE "{d}" DROP CONSTRAINT "{t}_pkey"',
+        'CREATE TABLE "{t}" (LIKE "{d}" INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE ("date")',
+        'ALTER TABLE "{t}" ADD PRIMARY KEY ("{pk}", "date")',
+        'ALTER TABLE "{t}" ATTACH PARTITION "{d}" DEFAULT',
+    ]
+    for column, referenced_table, referenced_column in foreign_keys:
+        sql.append(
+            'CREATE INDEX "{{t}}_{c}_idx" ON "{{t}}" ("{c}")'.format(c=column)
+        )
+        sql.append(
+            'ALTER TABLE "{{t}}" ADD CONSTRAINT "{{t}}_{c}_fk" '
+            'FOREIGN KEY ("{c}") REFERENCES "{rt}" ("{rc}") '
+            'DEFERRABLE INITIALLY DEFERRED'.format(
+                c=column, rt=referenced_table, rc=referenced_column
+            )
+        )
+    for column in indexes:
+        sql.append(
+            'CREATE INDEX "{{t}}_{c}_idx" ON "{{t}}" ("{c}")'.format(c=column)
+        )
+    if sequence:
+        sql.append('ALTER SEQUENCE "{s}" OWNED BY "{t}"."{pk}"')
+
+    reverse_sql = [
+        'ALTER TABLE "{t}" DETACH PARTITION "{d}"',
+    ]
+    if sequence:
+        reverse_sql.append('ALTER SEQUENCE "{s}" OWNED BY "{d}"."{pk}"')
+    reverse_sql.extend([
+        'DROP TABLE "{t}"',
+        'ALTER TABLE "{d}" DROP CONSTRAINT "{d}_pkey"',
+        'ALTER TABLE "{d}" ADD CONSTRAINT "{t}_pkey" PRIMARY KEY ("{pk}")',
+        'ALTER TABLE "{d}" RENAME TO "{t}"',
+    ])
+
+    def fill(statements):
+        return [
+            statement.format(t=table, d=default, pk=primary_key, s=sequence)
+            for statement in statements
+        ]
+
+    return migrations.RunSQL(fill(sql), fill(reverse_sql))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0057_invoiceline_date'),
+    ]
+
+    operations = [
+        partition_table(
+            'InvoiceEngineApp_invoiceline',
+            'invoice_line_id',
+            [
+                ('component_id', 'InvoiceEngineApp_component', 'component_id'),
+                ('invoice_id', 'InvoiceEngineApp_invoice', 'invoice_id'),
+            ]
+        ),
+        partition_table(
+            'InvoiceEngineApp_generalledgerpost',
+            'id',
+            [
+                ('tenancy_id', 'InvoiceEngineApp_tenancy', 'company_id'),
+                ('invoice_id', 'InvoiceEngineApp_invoice', 'invoice_id'),
+            ],
+            # No foreign key constraint, as invoice lines are partitioned
+            indexes=['invoice_line_id'],
+            sequence='InvoiceEngineApp_generalledgerpost_id_seq'
+        ),
+    ]
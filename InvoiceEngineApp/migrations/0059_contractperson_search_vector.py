@@ -0,0 +1,66 @@
+# Generated by Django 3.1.7 on 2026-10-19 12:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+TABLE = 'InvoiceEngineApp_contractperson'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0058_partition_invoiceline_generalledgerpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contractperson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE FUNCTION contractperson_search_vector() RETURNS trigger
+                AS $$
+                BEGIN
+                    NEW.search_vector :=
+                        setweight(to_tsvector(
+                            'simple', coalesce(NEW.name, '')
+                        ), 'A') ||
+                        setweight(to_tsvector(
+                            'simple',
+                            coalesce(NEW.address, '') || ' ' ||
+                            coalesce(NEW.city, '')
+                        ), 'B');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+                """,
+                """
+                CREATE TRIGGER contractperson_search_vector
+                BEFORE INSERT OR UPDATE OF name, address, city, search_vector
+                ON "{0}" FOR EACH ROW
+                EXECUTE FUNCTION contractperson_search_vector()
+                """.format(TABLE),
+                # Fill the vector of the existing rows through the trigger
+                'UPDATE "{0}" SET search_vector = NULL'.format(TABLE),
+            ],
+            reverse_sql=[
+                'DROP TRIGGER contractperson_search_vector ON "{0}"'.format(
+                    TABLE
+                ),
+                'DROP FUNCTION contractperson_search_vector()',
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='contractperson',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['search_vector'], name='contractperson_search_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.7 on 2026-10-19 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0059_contractperson_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(
+                fields=['tenancy', 'total_amount'],
+                name='contract_total_amount_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(
+                fields=['tenancy', 'balance'],
+                name='contract_balance_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.7 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0060_contract_amount_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(
+                fields=['tenancy', 'date', 'invoice_id'],
+                name='invoice_tenancy_date_idx'
+            ),
+        ),
+    ]
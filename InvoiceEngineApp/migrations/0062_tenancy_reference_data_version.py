@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0061_invoice_tenancy_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenancy',
+            name='reference_data_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
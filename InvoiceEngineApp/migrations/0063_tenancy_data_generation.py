@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0062_tenancy_reference_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenancy',
+            name='data_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
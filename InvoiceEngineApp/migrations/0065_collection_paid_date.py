@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-19 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0064_bulkoperation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='paid_date',
+            field=models.DateField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['tenancy', 'invoice_number'], name='invoice_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(condition=models.Q(paid_date__isnull=True), fields=['tenancy', 'mandate'], name='collection_open_mandate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(condition=models.Q(paid_date__isnull=True), fields=['tenancy', 'iban'], name='collection_open_iban_idx'),
+        ),
+    ]
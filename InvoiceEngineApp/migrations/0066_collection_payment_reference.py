@@ -0,0 +1,22 @@
+# Generated by Django 3.1.7 on 2026-10-19 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0065_collection_paid_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='payment_reference',
+            field=models.CharField(default=None, max_length=50, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='collection',
+            constraint=models.UniqueConstraint(condition=models.Q(payment_reference__isnull=False), fields=('tenancy', 'payment_reference'), name='collection_payment_reference'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:15
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0066_collection_payment_reference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contractperson',
+            name='mandate_date',
+            field=models.DateField(blank=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contractperson',
+            name='payment_day',
+            field=models.PositiveIntegerField(default=1, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(31)]),
+        ),
+    ]
@@ -1,8 +1,16 @@
+import contextlib
+import contextvars
 import datetime as dt
 import decimal as dc
+import functools
+import weakref
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction
-from django.db.models import Q, F
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
 
 
 TWO_PLACES = dc.Decimal('.01')
@@ -45,6 +53,59 @@ def get_next_invoice_id():
     return next_invoice_id, next_invoice_line_id
 
 
+# The reference data of the tenancies used by this process, by company id
+REFERENCE_DATA_CACHE = {}
+
+# The company id of the tenancy inside a Tenancy.batch_changes block
+BATCHED_TENANCY = contextvars.ContextVar('batched_tenancy', default=None)
+
+# The company ids of the tenancies whose data generation is raised when the
+# transaction of a database connection commits, by connection
+PENDING_DATA_GENERATIONS = weakref.WeakKeyDictionary()
+
+
+class ReferenceData:
+    """The contract types, base components and VAT rates of a tenancy, by
+    id, as of a version of the tenancy's reference data. The successors of
+    the VAT rates are linked to each other.
+    """
+    def __init__(self, company_id, version):
+        self.version = version
+        self.contract_types = {
+            contract_type.pk: contract_type
+            for contract_type in ContractType.objects.filter(
+                tenancy_id=company_id
+            ).order_by('pk')
+        }
+        self.base_components = {
+            base_component.pk: base_component
+            for base_component in BaseComponent.objects.filter(
+                tenancy_id=company_id
+            ).order_by('pk')
+        }
+        self.vat_rates = {
+            vat_rate.pk: vat_rate
+            for vat_rate in VATRate.objects.filter(
+                tenancy_id=company_id
+            ).order_by('pk')
+        }
+        for vat_rate in self.vat_rates.values():
+            vat_rate.successor_vat_rate = self.vat_rates.get(
+                vat_rate.successor_vat_rate_id
+            )
+
+    def attach(self, component):
+        """Set the reference data of a component and its contract from the
+        cache, instead of loading it from the database.
+        """
+        component.base_component = \
+            self.base_components[component.base_component_id]
+        if component.vat_rate_id:
+            component.vat_rate = self.vat_rates[component.vat_rate_id]
+        component.contract.contract_type = \
+            self.contract_types[component.contract.contract_type_id]
+
+
 class Tenancy(models.Model):
     """This class represents a company. Only a user with the same username as
     the tenancy_id has access to this company and all its data. Therefore,
@@ -59,10 +120,83 @@ class Tenancy(models.Model):
     days_until_invoice_expiration = models.PositiveSmallIntegerField(
         default=14
     )
+    # Raised on every change of the tenancy's contract types, base
+    # components and VAT rates, see get_reference_data
+    reference_data_version = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    # Raised on every change of the data shown in the contract and invoice
+    # lists, whose rendered rows are cached per generation
+    data_generation = models.PositiveIntegerField(default=0, editable=False)
+
+    # Creditor details for SEPA direct debit files
+    creditor_iban = models.CharField(
+        max_length=34, null=True, blank=True, default=None
+    )
+    creditor_bic = models.CharField(
+        max_length=11, null=True, blank=True, default=None
+    )
+    creditor_identifier = models.CharField(
+        max_length=35, null=True, blank=True, default=None
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Never write the reference data version and data generation back
+        # from memory, so a concurrent raise of them is not undone
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (
+                    'reference_data_version', 'data_generation'
+                )
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def raise_data_generation(company_id):
+        """Raise the data generation of a tenancy once the current
+        transaction commits, once for all changes to the tenancy in it. The
+        row of the tenancy is then locked only for a moment, rather than
+        until the end of every transaction that changes its data.
+
+        Every change marks the tenancy as pending for the connection and
+        adds a callback on commit. The first callback that runs raises the
+        generation and clears the mark, so the others do nothing. A change
+        in a savepoint that is rolled back loses its callback along with
+        it, but the callbacks of the other changes remain.
+        """
+        connection = transaction.get_connection()
+        PENDING_DATA_GENERATIONS.setdefault(connection, set()).add(company_id)
+        transaction.on_commit(functools.partial(
+            Tenancy.update_data_generation, company_id, connection
+        ))
+
+    @staticmethod
+    def update_data_generation(company_id, connection):
+        pending = PENDING_DATA_GENERATIONS.get(connection, set())
+        if company_id in pending:
+            pending.discard(company_id)
+            Tenancy.objects.filter(
+                company_id=company_id
+            ).update(
+                data_generation=F('data_generation') + 1
+            )
+
+    @contextlib.contextmanager
+    def batch_changes(self):
+        """Raise the data generation once at the end of the block, instead
+        of once for every object of the tenancy that is saved in it.
+        """
+        token = BATCHED_TENANCY.set(self.company_id)
+        try:
+            yield
+        finally:
+            BATCHED_TENANCY.reset(token)
+        Tenancy.raise_data_generation(self.company_id)
+
     def create(self, kwargs):
         pass
 
@@ -73,9 +207,52 @@ class Tenancy(models.Model):
             'number of contracts': self.number_of_contracts,
             'last invoice number': self.last_invoice_number,
             'date of next prolonging': self.date_next_prolongation,
-            'days until invoice expiration': self.days_until_invoice_expiration
+            'days until invoice expiration': self.days_until_invoice_expiration,
+            'creditor IBAN': self.creditor_iban,
+            'creditor BIC': self.creditor_bic,
+            'creditor identifier': self.creditor_identifier
         }
 
+    def get_reference_data(self):
+        """Return the contract types, base components and VAT rates of this
+        tenancy. They are kept in memory by every process, and loaded again
+        once the version on the tenancy shows they have changed.
+        """
+        reference_data = REFERENCE_DATA_CACHE.get(self.company_id)
+        if reference_data is None \
+                or reference_data.version != self.reference_data_version:
+            reference_data = ReferenceData(
+                self.company_id, self.reference_data_version
+            )
+            REFERENCE_DATA_CACHE[self.company_id] = reference_data
+        return reference_data
+
+    @staticmethod
+    def get_reference_data_of(company_id):
+        """Return the reference data of a tenancy, reading only its version
+        from the database if the data is already in memory.
+        """
+        return Tenancy.objects.only(
+            'company_id', 'reference_data_version'
+        ).get(company_id=company_id).get_reference_data()
+
+    def get_due_components(self, date_today):
+        """Return the components of all contracts that have to be invoiced
+        today, ordered by contract. The filters match the partial indexes
+        on Component and Contract (see their Meta classes), so the query
+        only touches due contracts, however large the history is.
+        """
+        return self.component_set.filter(
+            Q(date_next_prolongation__isnull=False)
+            & Q(contract__tenancy_id=self.company_id)
+            & Q(contract__date_next_prolongation__isnull=False)
+            & Q(contract__date_next_prolongation__lte=date_today)
+        ).order_by(
+            'contract_id'
+        ).select_related(
+            'contract'
+        )
+
     def invoice_contracts(self):
         """"Method to go over all components linked to this tenancy, and
         to create invoices, invoice lines, collections, and general ledger
@@ -92,24 +269,17 @@ class Tenancy(models.Model):
         # date_next_prolongation = 2021-01-01 and it has a component with
         # start_date = date_next_prolongation = 2021-05-01, the component
         # will be loaded into memory to discard later
-        components = list(
-            self.component_set.filter(
-                Q(date_next_prolongation__isnull=False)
-                & Q(contract__date_next_prolongation__isnull=False)
-                & Q(contract__date_next_prolongation__lte=date_today)
-            ).order_by(
-                'contract_id'
-            ).select_related(
-                'contract__contract_type',
-                'vat_rate__successor_vat_rate',
-                'base_component'
-            )
-        )
+        components = list(self.get_due_components(date_today))
 
         if not components:
             # There are no contracts to prolong
             return
 
+        # Take the contract types, base components and VAT rates from memory
+        reference_data = self.get_reference_data()
+        for component in components:
+            reference_data.attach(component)
+
         # Load all contract persons into memory
         contract_persons = list(
             self.contractperson_set.filter(
@@ -179,7 +349,7 @@ class Tenancy(models.Model):
         # End of main program loop
         # Save the changes made to the database in one transaction
         # If one fails, they will all fail
-        with transaction.atomic():
+        with transaction.atomic(), self.batch_changes():
             # Loop over the components and associated contracts to update them
             # Bulk update might overload the CPU in this case
             previous_contract = -1
@@ -207,13 +377,49 @@ class Tenancy(models.Model):
                 )
                 previous_contract = component.contract_id
 
+            self.number_invoices(new_invoices)
             Invoice.objects.bulk_create(new_invoices)
             InvoiceLine.objects.bulk_create(new_invoice_lines)
             GeneralLedgerPost.objects.bulk_create(new_gl_posts)
             Collection.objects.bulk_create(new_collections)
 
-            # Save the tenancy with the new last_invoice_number
-            self.save(update_fields=['last_invoice_number'])
+    def number_invoices(self, invoices):
+        """Give new invoices the next invoice numbers of the tenancy, in
+        order. The numbers are reserved with an update of the tenancy, which
+        keeps it locked until the transaction ends, so invoices that are
+        made at the same time never get the same number.
+        """
+        Tenancy.objects.filter(
+            company_id=self.company_id
+        ).update(
+            last_invoice_number=F('last_invoice_number') + len(invoices)
+        )
+        self.last_invoice_number = Tenancy.objects.filter(
+            company_id=self.company_id
+        ).values_list('last_invoice_number', flat=True).get()
+        first_number = self.last_invoice_number - len(invoices) + 1
+        for number, invoice in enumerate(invoices, first_number):
+            invoice.invoice_number = number
+
+    def delete_invoices(self, start_date, end_date):
+        """Delete the invoices of a period (including both dates) together
+        with their invoice lines, general ledger posts and collections.
+        Invoice lines and general ledger posts are deleted by date first,
+        so only the partitions of the period are touched.
+        """
+        with transaction.atomic():
+            GeneralLedgerPost.objects.filter(
+                tenancy=self,
+                date__range=(start_date, end_date)
+            ).delete()
+            InvoiceLine.objects.filter(
+                invoice__tenancy=self,
+                date__range=(start_date, end_date)
+            ).delete()
+            self.invoice_set.filter(
+                date__range=(start_date, end_date)
+            ).delete()
+            Tenancy.raise_data_generation(self.company_id)
 
 
 class TenancyDependentModel(models.Model):
@@ -251,10 +457,24 @@ class ContractType(TenancyDependentModel):
     def can_delete(self):
         return self.can_update_or_delete()
 
+    @classmethod
+    def annotate_in_use(cls, queryset):
+        """Annotate for every contract type whether it is used by a contract
+        that has been invoiced, in one subquery for the whole queryset.
+        """
+        return queryset.annotate(in_use=Exists(
+            Contract.objects.filter(
+                contract_type=OuterRef('pk'),
+                date_prev_prolongation__isnull=False
+            )
+        ))
+
     def can_update_or_delete(self):
         """Method to determine whether the instance can be updated
         or deleted.
         """
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.contract_set.filter(
             date_prev_prolongation__isnull=False
         ).exists()
@@ -286,7 +506,21 @@ class BaseComponent(TenancyDependentModel):
     def can_delete(self):
         return self.can_update_or_delete()
 
+    @classmethod
+    def annotate_in_use(cls, queryset):
+        """Annotate for every base component whether it is used by a
+        component that has been invoiced.
+        """
+        return queryset.annotate(in_use=Exists(
+            Component.objects.filter(
+                base_component=OuterRef('pk'),
+                date_prev_prolongation__isnull=False
+            )
+        ))
+
     def can_update_or_delete(self):
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.component_set.filter(
             date_prev_prolongation__isnull=False
         ).exists()
@@ -326,7 +560,22 @@ class VATRate(TenancyDependentModel):
     def can_delete(self):
         return self.can_update_or_delete()
 
+    @classmethod
+    def annotate_in_use(cls, queryset):
+        """Annotate for every VAT rate whether it is used by a component of
+        a contract that is no longer a draft.
+        """
+        return queryset.annotate(in_use=Exists(
+            Component.objects.filter(
+                vat_rate=OuterRef('pk')
+            ).exclude(
+                contract__status=Contract.DRAFT
+            )
+        ))
+
     def can_update_or_delete(self):
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.component_set.exclude(
             contract__status=Contract.DRAFT
         ).exists()
@@ -345,32 +594,34 @@ class VATRate(TenancyDependentModel):
             old_vat_rate = None
 
         if old_vat_rate:
+            self.save()
+            old_vat_rate.end_date = self.start_date - dt.timedelta(days=1)
+            old_vat_rate.successor_vat_rate = self
+            old_vat_rate.save(
+                update_fields=['successor_vat_rate', 'end_date']
+            )
             if old_vat_rate.can_delete():
-                components = old_vat_rate.component_set.all()
-                for component in components:
-                    component.remove_from_contract()
-                    component.vat_rate = self
-                    component.update()
-                old_vat_rate.delete()
-            else:
-                old_vat_rate.end_date = self.start_date - dt.timedelta(days=1)
-                old_vat_rate.successor_vat_rate = self
-                old_vat_rate.save(
-                    update_fields=['successor_vat_rate', 'end_date']
-                )
+                # Its components are moved to this VAT rate and it is
+                # deleted in the background, see VATRateCreateView
+                self.replaced_vat_rate = old_vat_rate
 
     def update(self):
-        for component in self.component_set.all():
-            component.update()
+        self.replace_by(self)
 
     def delete(self, using=None, keep_parents=False):
         with transaction.atomic():
-            for component in self.component_set.select_related('contract'):
-                component.remove_from_contract()
-                component.vat_rate = self.successor_vat_rate
-                component.update()
+            self.replace_by(self.successor_vat_rate)
             super().delete(using, keep_parents)
 
+    def replace_by(self, new_vat_rate):
+        """Move the components of this VAT rate to a new one, see
+        bulk.replace_vat_rate, which is imported here as it imports the
+        models itself.
+        """
+        from InvoiceEngineApp.bulk import replace_vat_rate
+
+        return replace_vat_rate(self, new_vat_rate)
+
 
 class Contract(TenancyDependentModel):
     """The contract is an agreement between two parties (e.g. a company and a
@@ -454,6 +705,25 @@ class Contract(TenancyDependentModel):
     vat_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            # Contracts that are due for invoicing, see Tenancy.invoice_contracts
+            models.Index(
+                fields=['tenancy', 'date_next_prolongation'],
+                name='contract_due_idx',
+                condition=Q(date_next_prolongation__isnull=False)
+            ),
+            # Amount search, see ContractSearchForm
+            models.Index(
+                fields=['tenancy', 'total_amount'],
+                name='contract_total_amount_idx'
+            ),
+            models.Index(
+                fields=['tenancy', 'balance'],
+                name='contract_balance_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.contract_type.description
 
@@ -590,6 +860,7 @@ class Contract(TenancyDependentModel):
             for component in components:
                 component.end_date = self.end_date
                 component.date_next_prolongation = None
+                self.remove_component(component)
                 base, vat, total, unit = component.get_amounts_between_dates(
                     self.end_date,
                     min(component.end_date + dt.timedelta(days=1),
@@ -627,14 +898,15 @@ class Contract(TenancyDependentModel):
                     )
                 for person in persons:
                     person.save(update_fields=['end_date'])
+                self.tenancy.number_invoices([invoice])
                 invoice.save()
                 InvoiceLine.objects.bulk_create(new_invoice_lines)
                 GeneralLedgerPost.objects.bulk_create(new_gl_posts)
                 Collection.objects.bulk_create(new_collections)
-                self.tenancy.save(update_fields=['last_invoice_number'])
                 self.save(
                     update_fields=[
-                        'end_date', 'status', 'date_next_prolongation'
+                        'end_date', 'status', 'date_next_prolongation',
+                        'base_amount', 'vat_amount', 'total_amount'
                     ]
                 )
 
@@ -759,6 +1031,17 @@ class Component(TenancyDependentModel):
     unit_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
     number_of_units = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Components that are still invoiced, looked up per due
+            # contract by Tenancy.invoice_contracts
+            models.Index(
+                fields=['contract', 'tenancy'],
+                name='component_due_idx',
+                condition=Q(date_next_prolongation__isnull=False)
+            ),
+        ]
+
     def __str__(self):
         return self.description
 
@@ -847,6 +1130,7 @@ class Component(TenancyDependentModel):
         new_component = None
 
         for c in components:
+            c.contract = self.contract
             if self.start_date <= c.start_date \
                     and (not self.end_date or self.end_date >= c.end_date):
                 base, vat, total, unit = c.get_amounts_between_dates(
@@ -854,6 +1138,8 @@ class Component(TenancyDependentModel):
                     min(c.end_date + dt.timedelta(days=1),
                         invoiced_until) if c.end_date else invoiced_until
                 )
+                if c.is_in_contract_amounts():
+                    self.contract.remove_component(c)
                 c.start_date = None
                 c.end_date = None
             elif self.end_date and c.end_date \
@@ -921,16 +1207,16 @@ class Component(TenancyDependentModel):
 
         with transaction.atomic():
             self.contract.save()
+            for component in components:
+                component.save(update_fields=['start_date', 'end_date'])
             if invoice:
+                self.tenancy.number_invoices([invoice])
                 invoice.save()
                 InvoiceLine.objects.bulk_create(new_invoice_lines)
                 GeneralLedgerPost.objects.bulk_create(new_gl_posts)
                 Collection.objects.bulk_create(new_collections)
-                for component in components:
-                    component.save(update_fields=['start_date', 'end_date'])
                 if new_component:
                     new_component.save()
-                self.tenancy.save(update_fields=['last_invoice_number'])
 
     def get_amounts_between_dates(self, start_date, end_date):
         """Method that calculates the exact amount that should be paid for
@@ -992,6 +1278,45 @@ class Component(TenancyDependentModel):
 
         return base_amount, vat_amount, total_amount, unit_amount
 
+    def get_indexed(self, start_date, percentage=None, amount=None):
+        """Return a new component that replaces this one from the start
+        date on, with the amount (or unit amount) raised by a percentage or
+        set to a new amount. Like create, it is added to the amounts of the
+        contract, and starts being invoiced on the start date, or on the
+        next prolongation of the contract if the start date has already
+        been invoiced.
+        """
+        component = Component(
+            tenancy_id=self.tenancy_id,
+            contract=self.contract,
+            base_component=self.base_component,
+            vat_rate=self.vat_rate,
+            description=self.description,
+            start_date=start_date,
+            end_date=self.end_date,
+            unit_id=self.base_component.unit_id,
+            number_of_units=self.number_of_units
+        )
+        # Like validate_component, a component with a unit has a unit
+        # amount and other components have a base amount
+        old_amount = self.unit_amount if self.unit_id else self.base_amount
+        new_amount = amount if amount is not None else (
+            old_amount * (100 + percentage) / 100
+        ).quantize(TWO_PLACES)
+        if self.unit_id:
+            component.unit_amount = new_amount
+        else:
+            component.base_amount = new_amount
+        component.set_derived_fields()
+
+        if not self.is_draft():
+            component.date_next_prolongation = start_date
+            if self.contract.date_next_prolongation \
+                    and start_date < self.contract.date_next_prolongation:
+                component.date_next_prolongation = \
+                    self.contract.date_next_prolongation
+        return component
+
     def can_update(self):
         return self.contract.can_update()
 
@@ -1042,6 +1367,16 @@ class Component(TenancyDependentModel):
     def is_draft(self):
         return self.contract.is_draft()
 
+    def is_in_contract_amounts(self):
+        """Whether the amounts of the contract include this component: it
+        has not been replaced as a whole, and it is either part of a draft
+        or still invoiced. See audit.get_amount_differences.
+        """
+        return self.start_date is not None and (
+            self.is_draft() or self.end_date is None
+            or self.date_next_prolongation is not None
+        )
+
     def create_correction_invoice(self, start_date, end_date, factor):
         """Create an invoice with one invoice line, specifically for
         this component. This can be needed in the case the start date
@@ -1082,11 +1417,11 @@ class Component(TenancyDependentModel):
         invoice.create_gl_post(new_gl_posts)
 
         with transaction.atomic():
+            self.tenancy.number_invoices([invoice])
             invoice.save()
             InvoiceLine.objects.bulk_create(new_invoice_lines)
             GeneralLedgerPost.objects.bulk_create(new_gl_posts)
             Collection.objects.bulk_create(new_collections)
-            self.tenancy.save(update_fields=['last_invoice_number'])
 
     def change_end_date(self, old_end_date):
         """When the end date of this component is changed, check in what
@@ -1095,6 +1430,7 @@ class Component(TenancyDependentModel):
         if self.is_draft():
             return
 
+        was_invoiced = not old_end_date or self.date_next_prolongation
         if old_end_date:
             if self.end_date:
                 # If an existing end date was replaced by a new one
@@ -1123,6 +1459,26 @@ class Component(TenancyDependentModel):
                 self.date_next_prolongation = None
                 self.create_correction_invoice(self.end_date, self.contract.date_next_prolongation, -1)
 
+        self.update_contract_amounts(was_invoiced)
+
+    def update_contract_amounts(self, was_invoiced):
+        """Take this component out of the amounts of its contract when it
+        is not invoiced anymore after its end date was changed, as
+        Component.invoice does, or put it back when it is again.
+        """
+        is_invoiced = not self.end_date or self.date_next_prolongation
+        if bool(is_invoiced) == bool(was_invoiced):
+            return
+        factor = 1 if is_invoiced else -1
+        Contract.objects.filter(contract_id=self.contract_id).update(
+            base_amount=F('base_amount')
+            + factor * (self.total_amount - self.vat_amount),
+            vat_amount=F('vat_amount') + factor * self.vat_amount,
+            total_amount=F('total_amount') + factor * self.total_amount
+        )
+        # The update sends no signals
+        Tenancy.raise_data_generation(self.tenancy_id)
+
     def change_start_date(self, old_start_date):
         """When the start date of this component is changed, check in what
         period the new end date falls. Send a correction invoice if needed.
@@ -1151,6 +1507,7 @@ class Component(TenancyDependentModel):
             invoice_line_id=next_id,
             component=self,
             invoice=invoice,
+            date=invoice.date,
             description=self.description,
             base_amount=base_amount,
             vat_amount=vat_amount,
@@ -1294,10 +1651,34 @@ class ContractPerson(TenancyDependentModel):
     )
     iban = models.CharField(max_length=17, null=True, blank=True, default=None)
     mandate = models.PositiveIntegerField(null=True, blank=True, default=None)
+    # The date on which the mandate was signed, which a direct debit has to
+    # state
+    mandate_date = models.DateField(null=True, blank=True, default=None)
     email = models.EmailField(null=True, default=None)
     phone = models.CharField(max_length=15, null=True, default=None)
     percentage_of_total = models.DecimalField(max_digits=5, decimal_places=2)
-    payment_day = models.PositiveIntegerField(null=True, default=1)
+    payment_day = models.PositiveIntegerField(
+        null=True,
+        default=1,
+        validators=[MinValueValidator(1), MaxValueValidator(31)]
+    )
+
+    # The name (weight A) and the address and city (weight B) as a text
+    # search vector. Maintained by a database trigger, see migration 0059,
+    # so it is also up to date after bulk inserts.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['tenancy', 'contract'],
+                name='contractperson_tenancy_idx'
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='contractperson_search_idx'
+            ),
+        ]
 
     def __str__(self):
         return "contract person " + self.name
@@ -1336,8 +1717,23 @@ class Invoice(TenancyDependentModel):
     invoice_number = models.PositiveIntegerField()
     gl_account = models.CharField(max_length=10)
 
+    class Meta:
+        indexes = [
+            # The keyset paginated invoice list, see InvoiceListView
+            models.Index(
+                fields=['tenancy', 'date', 'invoice_id'],
+                name='invoice_tenancy_date_idx'
+            ),
+            # Matching payments to invoices, see payments.py
+            models.Index(
+                fields=['tenancy', 'invoice_number'],
+                name='invoice_number_idx'
+            ),
+        ]
+
     def get_invoice_lines(self):
-        return self.invoiceline_set.all()
+        # Filter on the date as well, so only one partition is scanned
+        return self.invoiceline_set.filter(date=self.date)
 
     def get_collections(self):
         return self.collection_set.select_related('contract_person')
@@ -1362,9 +1758,15 @@ class Invoice(TenancyDependentModel):
 
 
 class InvoiceLine(models.Model):
+    """Invoice lines are stored in a table that is partitioned by month on
+    the date of the invoice (see the manage_partitions command). Queries
+    that filter on the date only touch the partitions of that period.
+    """
     invoice_line_id = models.PositiveIntegerField(primary_key=True)
     component = models.ForeignKey(Component, on_delete=models.CASCADE)
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
+    # Equal to the date of the invoice; this is the partition key
+    date = models.DateField()
     description = models.CharField(max_length=50)
     vat_type = models.PositiveIntegerField(null=True)
     base_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True)
@@ -1430,6 +1832,35 @@ class Collection(TenancyDependentModel):
     mandate = models.PositiveIntegerField(null=True)
     iban = models.CharField(max_length=17, null=True)
     amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    # Booking date of the payment, once a bank statement shows it
+    paid_date = models.DateField(null=True, default=None)
+    # Reference of the bank to the payment, so it is booked only once
+    payment_reference = models.CharField(
+        max_length=50, null=True, default=None
+    )
+
+    class Meta:
+        indexes = [
+            # Matching payments to the collections that are still open, see
+            # payments.py
+            models.Index(
+                fields=['tenancy', 'mandate'],
+                name='collection_open_mandate_idx',
+                condition=Q(paid_date__isnull=True)
+            ),
+            models.Index(
+                fields=['tenancy', 'iban'],
+                name='collection_open_iban_idx',
+                condition=Q(paid_date__isnull=True)
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenancy', 'payment_reference'],
+                name='collection_payment_reference',
+                condition=Q(payment_reference__isnull=False)
+            ),
+        ]
 
     def get_values_external_file(self):
         return [
@@ -1451,10 +1882,16 @@ class Collection(TenancyDependentModel):
 
 
 class GeneralLedgerPost(TenancyDependentModel):
+    """General ledger posts are stored in a table that is partitioned by
+    month on their date, like invoice lines.
+    """
     invoice = models.ForeignKey(Invoice, null=True, on_delete=models.CASCADE)
+    # A foreign key constraint cannot refer to the partitioned invoice lines
+    # table by invoice_line_id only; the cascade is handled by Django.
     invoice_line = models.ForeignKey(
-        InvoiceLine, null=True, on_delete=models.CASCADE
+        InvoiceLine, null=True, on_delete=models.CASCADE, db_constraint=False
     )
+    # This is the partition key
     date = models.DateField()
     gl_account = models.CharField(max_length=10)
     gl_dimension_base_component = models.CharField(null=True, max_length=10)
@@ -1464,3 +1901,49 @@ class GeneralLedgerPost(TenancyDependentModel):
     description = models.CharField(max_length=30)
     amount_debit = models.DecimalField(max_digits=15, decimal_places=2)
     amount_credit = models.DecimalField(max_digits=15, decimal_places=2)
+
+
+class BulkOperation(TenancyDependentModel):
+    """A bulk operation on the data of a tenancy that runs in a background
+    process. The process records its progress here, so it can be followed
+    while it runs.
+    """
+    bulk_operation_id = models.AutoField(primary_key=True)
+    description = models.CharField(max_length=100)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+    error = models.TextField(null=True)
+
+    @staticmethod
+    def get_running(company_id):
+        """Return the operations of a tenancy that are still running."""
+        return BulkOperation.objects.filter(
+            tenancy_id=company_id,
+            finished__isnull=True
+        ).order_by('started')
+
+    def advance(self, done, total):
+        self.done = done
+        self.total = total
+        self.save(update_fields=['done', 'total'])
+
+    def finish(self, error=None):
+        self.finished = timezone.now()
+        self.error = error
+        self.save(update_fields=['finished', 'error'])
+
+    def get_progress(self):
+        return {
+            'description': self.description,
+            'done': self.done,
+            'total': self.total,
+            'finished': self.finished is not None,
+            'error': self.error,
+        }
+
+
+# Connect the signal receivers. This is done here rather than in the app
+# config, which is not loaded since INSTALLED_APPS lists the bare app name.
+from InvoiceEngineApp import signals  # noqa: E402,F401
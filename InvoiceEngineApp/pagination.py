@@ -0,0 +1,222 @@
+import base64
+import functools
+import json
+import operator
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+# Lists that are estimated to be smaller than this are counted exactly
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def estimate_count(queryset):
+    """Return the amount of rows the query planner estimates the queryset
+    to have, without executing it.
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPage:
+    """One page of a keyset paginated queryset. Instead of page numbers it
+    has cursors, the ordering values of its first and last object, to
+    request the previous and the next page with.
+
+    The objects are only loaded when they are first used, so a page that is
+    rendered from a cached template fragment costs no query.
+    """
+    def __init__(self, paginator, after=None, before=None):
+        self.paginator = paginator
+        self.after = after
+        self.before = before
+
+    @cached_property
+    def _page(self):
+        return self.paginator.load(self.after, self.before)
+
+    @property
+    def object_list(self):
+        return self._page[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._page[1]
+
+    def has_next(self):
+        return self._page[2]
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.get_cursor(self.object_list[0])
+        return ''
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.get_cursor(self.object_list[-1])
+        return ''
+
+
+class KeysetPaginator:
+    """Paginate an ordered queryset on the values of its ordering fields,
+    with the primary key as the last field to break ties. A page is the
+    first objects after (or before) the cursor, so it is found through the
+    index of the ordering and costs the same however deep it is. There is
+    no count and there are no page numbers.
+    """
+    def __init__(self, queryset, per_page, count=None,
+                 exact_count_threshold=EXACT_COUNT_THRESHOLD):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.exact_count_threshold = exact_count_threshold
+        # A count that is maintained elsewhere, or a function returning it,
+        # if there is one
+        self._count = count
+        meta = queryset.model._meta
+
+        # (field name, descending) for every field of the ordering
+        self.ordering = []
+        for name in queryset.query.order_by or meta.ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            self.ordering.append(
+                (meta.pk.name if name == 'pk' else name, descending)
+            )
+        if not any(name == meta.pk.name for name, _ in self.ordering):
+            # Follow the direction of the first field, so the ordering
+            # matches an index on the fields and the primary key
+            descending = self.ordering[0][1] if self.ordering else False
+            self.ordering.append((meta.pk.name, descending))
+
+        self.fields = [meta.get_field(name) for name, _ in self.ordering]
+
+    @cached_property
+    def counted(self):
+        """The total amount of objects and whether it is exact. Large lists
+        are not counted, but estimated by the query planner.
+        """
+        if self.known_count is not None:
+            return self.known_count, True
+        estimate = estimate_count(self.queryset)
+        if estimate < self.exact_count_threshold:
+            return self.queryset.count(), True
+        return estimate, False
+
+    @property
+    def count(self):
+        return self.counted[0]
+
+    @cached_property
+    def known_count(self):
+        if callable(self._count):
+            return self._count()
+        return self._count
+
+    @property
+    def count_is_exact(self):
+        return self.counted[1]
+
+    @property
+    def num_pages(self):
+        return max(1, -(-self.count // self.per_page))
+
+    def get_cursor(self, obj):
+        values = [field.value_from_object(obj) for field in self.fields]
+        return base64.urlsafe_b64encode(
+            json.dumps(values, cls=DjangoJSONEncoder).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [
+                field.to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise Http404("Invalid page cursor.")
+
+    def get_filter(self, ordering, values):
+        """Return the filter for the objects after the values in the given
+        ordering. NULL values come last in ascending order and first in
+        descending order, as in PostgreSQL.
+        """
+        clauses = []
+        equal = Q()
+        for (name, descending), field, value in zip(
+                ordering, self.fields, values):
+            if value is None:
+                if descending:
+                    clauses.append(equal & Q(**{name + '__isnull': False}))
+                equal &= Q(**{name + '__isnull': True})
+            else:
+                later = Q(**{name + ('__lt' if descending else '__gt'): value})
+                if field.null and not descending:
+                    later |= Q(**{name + '__isnull': True})
+                clauses.append(equal & later)
+                equal &= Q(**{name: value})
+
+        keyset = functools.reduce(operator.or_, clauses)
+
+        # Bound the first field as well, so the index on it is range scanned
+        (name, descending), field, value = ordering[0], self.fields[0], values[0]
+        if value is not None and not field.null:
+            keyset &= Q(**{name + ('__lte' if descending else '__gte'): value})
+        return keyset
+
+    def page(self, after=None, before=None):
+        """Return the page after or before a cursor, or the first page."""
+        if before:
+            return KeysetPage(self, before=self.decode_cursor(before))
+        if after:
+            return KeysetPage(self, after=self.decode_cursor(after))
+        return KeysetPage(self)
+
+    def load(self, after=None, before=None):
+        """Return the objects of the page after or before the given ordering
+        values, whether there is a previous page and whether there is a next
+        page.
+        """
+        if before:
+            # Walk the ordering backwards from the cursor
+            ordering = [(name, not desc) for name, desc in self.ordering]
+            qs = self.queryset.filter(self.get_filter(ordering, before))
+        else:
+            ordering = self.ordering
+            qs = self.queryset
+            if after:
+                qs = qs.filter(self.get_filter(ordering, after))
+
+        objects = list(qs.order_by(*[
+            '-' + name if descending else name
+            for name, descending in ordering
+        ])[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+
+        if before:
+            objects.reverse()
+            return objects, has_more, True
+        return objects, bool(after), has_more
@@ -0,0 +1,98 @@
+import datetime as dt
+import re
+
+from django.db import connection, transaction
+
+from InvoiceEngineApp.models import GeneralLedgerPost, InvoiceLine
+
+
+# Models whose tables are partitioned by month on their date column, see
+# migration 0058. Rows outside the existing monthly partitions are stored
+# in the default partition.
+PARTITIONED_MODELS = [InvoiceLine, GeneralLedgerPost]
+
+
+def add_months(month, months):
+    """Return the first day of the month that is a number of months after
+    the month of the given date.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(model, month):
+    return "{}_y{}m{:02d}".format(
+        model._meta.db_table, month.year, month.month
+    )
+
+
+def get_partition_month(name):
+    """Return the month of a partition, given its name."""
+    match = re.search(r'_y(\d{4})m(\d{2})$', name)
+    return dt.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def get_partitions(model):
+    """Return the names of the monthly partitions of a model's table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = %s AND child.relname <> %s",
+            [model._meta.db_table, model._meta.db_table + '_default']
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_partition(model, month, tablespace=None):
+    """Create the partition for a month. Rows of that month are moved out of
+    the default partition first, so existing history can be split up as
+    well. Returns the amount of rows that was moved.
+    """
+    table = model._meta.db_table
+    name = get_partition_name(model, month)
+    start = dt.date(month.year, month.month, 1)
+    end = add_months(start, 1)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE "{}" (LIKE "{}" INCLUDING DEFAULTS){}'.format(
+                name,
+                table,
+                ' TABLESPACE "{}"'.format(tablespace) if tablespace else ''
+            )
+        )
+        cursor.execute(
+            'WITH moved AS ('
+            'DELETE FROM "{}_default" WHERE "date" >= %s AND "date" < %s '
+            'RETURNING *'
+            ') INSERT INTO "{}" SELECT * FROM moved'.format(table, name),
+            [start, end]
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            'ALTER TABLE "{}" ATTACH PARTITION "{}" '
+            'FOR VALUES FROM (%s) TO (%s)'.format(table, name),
+            [start, end]
+        )
+
+    return moved
+
+
+def move_partition(model, month, tablespace):
+    """Move the partition of a month, including its indexes, to another
+    tablespace, for instance one on cheaper storage for old periods.
+    """
+    name = get_partition_name(model, month)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'ALTER TABLE "{}" SET TABLESPACE "{}"'.format(name, tablespace)
+        )
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s", [name]
+        )
+        for (index,) in cursor.fetchall():
+            cursor.execute(
+                'ALTER INDEX "{}" SET TABLESPACE "{}"'.format(index, tablespace)
+            )
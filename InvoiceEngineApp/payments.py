@@ -0,0 +1,448 @@
+import datetime as dt
+import decimal as dc
+import re
+from collections import defaultdict
+from xml.etree import ElementTree
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from InvoiceEngineApp.models import (
+    Collection,
+    Contract,
+    GeneralLedgerPost,
+    Invoice,
+    Tenancy,
+)
+
+
+# Amount of transactions that is matched and booked in one transaction
+PAYMENT_BATCH_SIZE = 10000
+
+NUMBER = re.compile(r'\d+')
+
+
+def get_children(element, prefix):
+    """Return the texts of the children of an element by their name, and
+    the child elements themselves under the name with a prefix.
+    """
+    children = {}
+    for child in element:
+        name = child.tag[prefix:]
+        children[name] = child.text.strip() if child.text else None
+        children['_' + name] = child
+    return children
+
+
+def get_details(detail, prefix):
+    """Return the texts of all elements within the details of a transaction
+    by their name, the first one where a name occurs more than once, with
+    the IBAN of the debtor under "DbtrIBAN".
+    """
+    texts = {}
+    debtor_account = False
+    for element in detail.iter():
+        name = element.tag[prefix:]
+        if name == 'DbtrAcct':
+            debtor_account = True
+        elif name in ('CdtrAcct', 'UltmtDbtr', 'Cdtr'):
+            debtor_account = False
+        elif name == 'IBAN' and debtor_account:
+            name = 'DbtrIBAN'
+        if name not in texts:
+            texts[name] = element.text.strip() if element.text else None
+    return texts
+
+
+def get_transactions(entry, prefix):
+    """Return the transactions of one entry of a statement. A batch booking,
+    such as the collections of a direct debit file, is one entry with the
+    details of every transaction.
+    """
+    children = get_children(entry, prefix)
+    booking_date = None
+    for name in ['_BookgDt', '_ValDt']:
+        if children.get(name) is not None and len(children[name]):
+            booking_date = children[name][0].text.strip()[:10]
+            break
+    status = children.get('Sts')
+    if not status and children.get('_Sts') is not None \
+            and len(children['_Sts']):
+        status = children['_Sts'][0].text
+    common = {
+        'reference': children.get('AcctSvcrRef') or children.get('NtryRef'),
+        'credit': children.get('CdtDbtInd') == 'CRDT',
+        'booked': status == 'BOOK',
+        'date': dt.date.fromisoformat(booking_date),
+    }
+
+    details = []
+    if children.get('_NtryDtls') is not None:
+        details = [
+            detail for detail in children['_NtryDtls']
+            if detail.tag[prefix:] == 'TxDtls'
+        ]
+    if not details:
+        return [dict(
+            common,
+            amount=dc.Decimal(children['Amt']),
+            end_to_end_id=None,
+            mandate=None,
+            iban=None,
+            remittance=children.get('AddtlNtryInf'),
+        )]
+
+    transactions = []
+    for number, detail in enumerate(details, 1):
+        texts = get_details(detail, prefix)
+        amount = texts.get('Amt')
+        if amount is None and len(details) == 1:
+            amount = children['Amt']
+        # The transactions of a batch booking share the reference of the
+        # entry, unless the bank gives each one of its own
+        reference = texts.get('AcctSvcrRef') or common['reference']
+        if reference and len(details) > 1 \
+                and reference == common['reference']:
+            reference = '{}/{}'.format(reference, number)
+        transactions.append(dict(
+            common,
+            reference=reference,
+            amount=dc.Decimal(amount),
+            end_to_end_id=texts.get('EndToEndId'),
+            mandate=texts.get('MndtId'),
+            iban=texts.get('DbtrIBAN'),
+            remittance=texts.get('Ustrd'),
+        ))
+    return transactions
+
+
+def read_statement(file):
+    """Generate the transactions of a CAMT.053 bank statement file. The file
+    is parsed incrementally and every entry is removed once it has been
+    read, so the memory use does not grow with the size of the statement.
+    """
+    prefix = None
+    statement = None
+    for event, element in ElementTree.iterparse(file, ('start', 'end')):
+        if prefix is None:
+            # The namespace differs per version of the standard
+            namespace = element.tag[:element.tag.index('}') + 1]
+            prefix = len(namespace)
+            statement_tag = namespace + 'Stmt'
+            entry_tag = namespace + 'Ntry'
+        if event == 'start':
+            if element.tag == statement_tag:
+                statement = element
+        elif element.tag == entry_tag:
+            yield from get_transactions(element, prefix)
+            if statement is not None:
+                statement.remove(element)
+
+
+def get_invoice_number(payment):
+    """Return the invoice number a payment refers to: the end to end id of
+    a direct debit, see sepa.py, or the number in the description of a
+    transfer.
+    """
+    for reference in [payment['end_to_end_id'], payment['remittance']]:
+        if reference:
+            number = NUMBER.search(reference)
+            if number:
+                return int(number.group())
+    return None
+
+
+def get_mandate(payment):
+    mandate = payment['mandate']
+    if mandate and mandate.isdigit():
+        return int(mandate)
+    return None
+
+
+def get_iban(payment):
+    if payment['iban']:
+        return payment['iban'].replace(' ', '').upper()
+    return None
+
+
+class PaymentMatcher:
+    """Matches payments to open collections of a tenancy by hash lookups: on
+    the invoice number and amount, then on the mandate and amount, then on
+    the IBAN and amount. Every collection is matched at most once. A payment
+    for an invoice that has been paid already is not matched on its mandate
+    or IBAN instead, as it would pay another invoice.
+    """
+    def __init__(self, open_collections, paid_invoice_numbers=()):
+        self.by_invoice = defaultdict(list)
+        self.by_mandate = defaultdict(list)
+        self.by_iban = defaultdict(list)
+        self.open_by_invoice = defaultdict(list)
+        self.paid_invoice_numbers = set(paid_invoice_numbers)
+        self.used = set()
+        for collection in open_collections:
+            self.by_invoice[
+                collection['invoice__invoice_number'], collection['amount']
+            ].append(collection)
+            self.open_by_invoice[collection['invoice__invoice_number']].append(
+                collection['pk']
+            )
+            if collection['mandate'] is not None:
+                self.by_mandate[
+                    collection['mandate'], collection['amount']
+                ].append(collection)
+            if collection['iban']:
+                self.by_iban[
+                    collection['iban'], collection['amount']
+                ].append(collection)
+
+    def take(self, candidates, mandate=None, iban=None):
+        """Return the first collection of the candidates that is not used
+        yet, preferring one with the mandate or IBAN of the payer.
+        """
+        candidates = [
+            collection for collection in candidates
+            if collection['pk'] not in self.used
+        ]
+        if not candidates:
+            return None
+        for collection in candidates:
+            if (mandate is not None and collection['mandate'] == mandate) \
+                    or (iban and collection['iban'] == iban):
+                break
+        else:
+            collection = candidates[0]
+        self.used.add(collection['pk'])
+        return collection
+
+    def is_paid(self, invoice_number):
+        """Return whether an invoice has collections, and all of them have
+        been paid, before or by an earlier payment of the statement.
+        """
+        open_collections = self.open_by_invoice.get(invoice_number, [])
+        return (
+            invoice_number in self.paid_invoice_numbers or open_collections
+        ) and all(pk in self.used for pk in open_collections)
+
+    def match(self, payment):
+        invoice_number = get_invoice_number(payment)
+        mandate = get_mandate(payment)
+        iban = get_iban(payment)
+        amount = payment['amount']
+        collection = self.take(
+            self.by_invoice.get((invoice_number, amount), []),
+            mandate,
+            iban
+        )
+        if collection is not None or self.is_paid(invoice_number):
+            return collection
+        return self.take(
+            self.by_mandate.get((mandate, amount), [])
+        ) or self.take(
+            self.by_iban.get((iban, amount), [])
+        )
+
+
+def get_open_collections(tenancy, payments):
+    """Return the collections of a tenancy that have not been paid yet and
+    that one of the payments could be for, with what is needed to book the
+    payment, locked until the end of the transaction.
+    """
+    invoice_numbers = set()
+    mandates = set()
+    ibans = set()
+    for payment in payments:
+        invoice_numbers.add(get_invoice_number(payment))
+        mandates.add(get_mandate(payment))
+        ibans.add(get_iban(payment))
+    invoice_numbers.discard(None)
+    mandates.discard(None)
+    ibans.discard(None)
+
+    return Collection.objects.select_for_update().filter(
+        Q(
+            invoice__tenancy_id=tenancy.company_id,
+            invoice__invoice_number__in=invoice_numbers
+        )
+        | Q(mandate__in=mandates)
+        | Q(iban__in=ibans),
+        tenancy_id=tenancy.company_id,
+        paid_date__isnull=True
+    ).order_by(
+        'pk'
+    ).values(
+        'pk',
+        'invoice_id',
+        'invoice__invoice_number',
+        'invoice__contract_id',
+        'invoice__gl_account',
+        'invoice__contract__gl_dimension_1',
+        'invoice__contract__gl_dimension_2',
+        'mandate',
+        'iban',
+        'amount',
+    )
+
+
+def get_paid_invoice_numbers(tenancy, payments):
+    """Return the numbers of the invoices of a tenancy that the payments
+    refer to and that have a paid collection.
+    """
+    invoice_numbers = {get_invoice_number(payment) for payment in payments}
+    invoice_numbers.discard(None)
+    return set(Collection.objects.filter(
+        tenancy_id=tenancy.company_id,
+        invoice__tenancy_id=tenancy.company_id,
+        invoice__invoice_number__in=invoice_numbers,
+        paid_date__isnull=False
+    ).values_list('invoice__invoice_number', flat=True))
+
+
+def get_booked_references(tenancy, payments):
+    """Return the references of the payments that have been booked to a
+    collection of the tenancy already, by an earlier import.
+    """
+    references = {payment['reference'] for payment in payments}
+    references.discard(None)
+    return set(Collection.objects.filter(
+        tenancy_id=tenancy.company_id,
+        payment_reference__in=references
+    ).values_list('payment_reference', flat=True))
+
+
+def reduce_balances(model, amounts):
+    """Subtract amounts from the balances of invoices or contracts, given by
+    id, with one statement.
+    """
+    if not amounts:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE {table} SET balance = {table}.balance - paid.amount '
+            'FROM (SELECT UNNEST(%s::integer[]) AS id, '
+            'UNNEST(%s::numeric[]) AS amount) paid '
+            'WHERE {table}.{pk} = paid.id'.format(
+                table=connection.ops.quote_name(model._meta.db_table),
+                pk=connection.ops.quote_name(model._meta.pk.column)
+            ),
+            [list(amounts.keys()), list(amounts.values())]
+        )
+
+
+def book_payments(tenancy, payments, gl_account):
+    """Match a batch of payments to open collections and book the matched
+    ones in one transaction: the collections are marked as paid, the
+    balances of their invoices and contracts are reduced, and every payment
+    gets a debit post on the bank account and a credit post on the debtors
+    account of its invoice. Payments whose reference has been booked before
+    are skipped. Returns the matched, the unmatched and the skipped
+    transactions.
+    """
+    matched = []
+    unmatched = []
+    skipped = []
+    with transaction.atomic():
+        booked_references = get_booked_references(tenancy, payments)
+        matcher = PaymentMatcher(
+            get_open_collections(tenancy, payments),
+            get_paid_invoice_numbers(tenancy, payments)
+        )
+        for payment in payments:
+            if payment['reference'] in booked_references:
+                skipped.append(payment)
+                continue
+            collection = matcher.match(payment) \
+                if payment['credit'] and payment['booked'] else None
+            if collection is None:
+                unmatched.append(payment)
+            else:
+                matched.append((payment, collection))
+        if not matched:
+            return matched, unmatched, skipped
+
+        paid_collections = []
+        invoice_amounts = defaultdict(dc.Decimal)
+        contract_amounts = defaultdict(dc.Decimal)
+        gl_posts = []
+        for payment, collection in matched:
+            paid_collections.append(Collection(
+                pk=collection['pk'],
+                paid_date=payment['date'],
+                payment_reference=payment['reference']
+            ))
+            invoice_amounts[collection['invoice_id']] += payment['amount']
+            contract_amounts[collection['invoice__contract_id']] += \
+                payment['amount']
+            for account, invoice_id, description, debit, credit in [
+                    (gl_account, None, "Payment", payment['amount'], 0),
+                    (collection['invoice__gl_account'],
+                     collection['invoice_id'], "Debtors",
+                     0, payment['amount'])]:
+                gl_posts.append(GeneralLedgerPost(
+                    tenancy_id=tenancy.company_id,
+                    invoice_id=invoice_id,
+                    invoice_line=None,
+                    date=payment['date'],
+                    gl_account=account,
+                    gl_dimension_base_component=None,
+                    gl_dimension_contract_1=collection[
+                        'invoice__contract__gl_dimension_1'
+                    ],
+                    gl_dimension_contract_2=collection[
+                        'invoice__contract__gl_dimension_2'
+                    ],
+                    gl_dimension_vat=None,
+                    description=description,
+                    amount_debit=debit,
+                    amount_credit=credit
+                ))
+
+        Collection.objects.bulk_update(
+            paid_collections, ['paid_date', 'payment_reference'],
+            batch_size=1000
+        )
+        reduce_balances(Invoice, invoice_amounts)
+        reduce_balances(Contract, contract_amounts)
+        GeneralLedgerPost.objects.bulk_create(gl_posts, batch_size=1000)
+        Tenancy.raise_data_generation(tenancy.company_id)
+
+    return matched, unmatched, skipped
+
+
+def import_bank_statement(tenancy, file, gl_account, progress=None,
+                          batch_size=PAYMENT_BATCH_SIZE):
+    """Book the payments of a CAMT.053 bank statement to the collections of
+    a tenancy, in batches of transactions. The progress function, if given,
+    is called with the amount of transactions done and the amount matched
+    after every batch. Returns the amount of matched payments, their total,
+    the transactions that could not be matched and the amount of payments
+    that had been booked before.
+    """
+    number_matched = 0
+    number_skipped = 0
+    total = dc.Decimal(0)
+    unmatched = []
+    done = 0
+    batch = []
+
+    def book():
+        nonlocal number_matched, number_skipped, total, done
+        if batch:
+            matched, not_matched, skipped = book_payments(
+                tenancy, batch, gl_account
+            )
+            number_matched += len(matched)
+            number_skipped += len(skipped)
+            total += sum(payment['amount'] for payment, _ in matched)
+            unmatched.extend(not_matched)
+            done += len(batch)
+            batch.clear()
+            if progress:
+                progress(done, number_matched)
+
+    for payment in read_statement(file):
+        batch.append(payment)
+        if len(batch) >= batch_size:
+            book()
+    book()
+
+    return number_matched, total, unmatched, number_skipped
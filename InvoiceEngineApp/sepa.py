@@ -0,0 +1,259 @@
+import calendar
+import datetime as dt
+import decimal as dc
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+
+
+NAMESPACE = 'urn:iso:std:iso:20022:tech:xsd:pain.008.001.02'
+
+# Banks limit the amount of transactions in one PaymentInformation block
+MAX_BLOCK_SIZE = 10000
+
+# Files are kept in memory up to this size, and moved to disk beyond it
+SPOOL_SIZE = 4 * 1024 * 1024
+
+
+def get_collection_date(invoice_date, payment_day):
+    """Return the first date on or after the invoice date that falls on the
+    payment day of the contract person. The payment day is capped at the
+    last day of the month, and a payment day before the first (stored
+    before payment days were validated) is taken as the first.
+    """
+    payment_day = max(payment_day or 1, 1)
+    year = invoice_date.year
+    month = invoice_date.month
+    day = min(payment_day, calendar.monthrange(year, month)[1])
+    if day < invoice_date.day:
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+        day = min(payment_day, calendar.monthrange(year, month)[1])
+
+    return dt.date(year, month, day)
+
+
+def text(value, max_length=70):
+    """Escape a value for use as XML text, truncated to the maximum length
+    allowed by the SEPA rulebook.
+    """
+    return escape(str(value)[:max_length])
+
+
+class DirectDebitWriter:
+    """Writes a SEPA direct debit initiation (pain.008) file.
+
+    Transactions are added one at a time, ordered by payment day. The
+    transactions of the current PaymentInformation block are written to a
+    temporary file while its control sum is computed, since the totals have
+    to be written before the transactions. The memory use is therefore
+    constant, however many collections there are.
+    """
+    def __init__(self, tenancy, message_id, max_block_size=MAX_BLOCK_SIZE):
+        self.tenancy = tenancy
+        self.message_id = message_id
+        self.max_block_size = max_block_size
+
+        self.blocks = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.number_of_blocks = 0
+        self.number_of_transactions = 0
+        self.control_sum = dc.Decimal(0)
+
+        self.block = None
+        self.block_date = None
+        self.block_transactions = 0
+        self.block_sum = dc.Decimal(0)
+
+    def add(self, collection_date, end_to_end_id, amount, mandate,
+            date_of_signature, name, iban, description):
+        if self.block_date != collection_date \
+                or self.block_transactions == self.max_block_size:
+            self.finish_block()
+            self.start_block(collection_date)
+
+        self.write(self.block, (
+            '<DrctDbtTxInf>'
+            '<PmtId><EndToEndId>{}</EndToEndId></PmtId>'
+            '<InstdAmt Ccy="EUR">{:.2f}</InstdAmt>'
+            '<DrctDbtTx><MndtRltdInf>'
+            '<MndtId>{}</MndtId><DtOfSgntr>{}</DtOfSgntr>'
+            '</MndtRltdInf></DrctDbtTx>'
+            '<DbtrAgt><FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr>'
+            '</FinInstnId></DbtrAgt>'
+            '<Dbtr><Nm>{}</Nm></Dbtr>'
+            '<DbtrAcct><Id><IBAN>{}</IBAN></Id></DbtrAcct>'
+            '<RmtInf><Ustrd>{}</Ustrd></RmtInf>'
+            '</DrctDbtTxInf>\n'
+        ).format(
+            text(end_to_end_id, 35),
+            amount,
+            text(mandate, 35),
+            date_of_signature.isoformat(),
+            text(name),
+            text(iban, 34),
+            text(description, 140)
+        ))
+
+        self.block_transactions += 1
+        self.block_sum += amount
+
+    def start_block(self, collection_date):
+        self.block = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.block_date = collection_date
+        self.block_transactions = 0
+        self.block_sum = dc.Decimal(0)
+
+    def finish_block(self):
+        """Write the header of the current block, now that its totals are
+        known, followed by its transactions.
+        """
+        if not self.block_transactions:
+            return
+
+        self.number_of_blocks += 1
+        self.write(self.blocks, (
+            '<PmtInf>'
+            '<PmtInfId>{}-{}</PmtInfId>'
+            '<PmtMtd>DD</PmtMtd>'
+            '<NbOfTxs>{}</NbOfTxs>'
+            '<CtrlSum>{:.2f}</CtrlSum>'
+            '<PmtTpInf><SvcLvl><Cd>SEPA</Cd></SvcLvl>'
+            '<LclInstrm><Cd>CORE</Cd></LclInstrm><SeqTp>RCUR</SeqTp>'
+            '</PmtTpInf>'
+            '<ReqdColltnDt>{}</ReqdColltnDt>'
+            '<Cdtr><Nm>{}</Nm></Cdtr>'
+            '<CdtrAcct><Id><IBAN>{}</IBAN></Id></CdtrAcct>'
+            '<CdtrAgt><FinInstnId>{}</FinInstnId></CdtrAgt>'
+            '<ChrgBr>SLEV</ChrgBr>'
+            '<CdtrSchmeId><Id><PrvtId><Othr><Id>{}</Id>'
+            '<SchmeNm><Prtry>SEPA</Prtry></SchmeNm>'
+            '</Othr></PrvtId></Id></CdtrSchmeId>\n'
+        ).format(
+            text(self.message_id, 30),
+            self.number_of_blocks,
+            self.block_transactions,
+            self.block_sum,
+            self.block_date.isoformat(),
+            text(self.tenancy.name),
+            text(self.tenancy.creditor_iban, 34),
+            '<BIC>{}</BIC>'.format(text(self.tenancy.creditor_bic, 11))
+            if self.tenancy.creditor_bic
+            else '<Othr><Id>NOTPROVIDED</Id></Othr>',
+            text(self.tenancy.creditor_identifier, 35)
+        ))
+
+        self.block.seek(0)
+        shutil.copyfileobj(self.block, self.blocks)
+        self.block.close()
+        self.write(self.blocks, '</PmtInf>\n')
+
+        self.number_of_transactions += self.block_transactions
+        self.control_sum += self.block_sum
+        self.block_transactions = 0
+
+    def finish(self):
+        """Return the complete file, rewound so it can be sent to the user."""
+        self.finish_block()
+
+        file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.write(file, (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Document xmlns="{}"><CstmrDrctDbtInitn>\n'
+            '<GrpHdr>'
+            '<MsgId>{}</MsgId>'
+            '<CreDtTm>{}</CreDtTm>'
+            '<NbOfTxs>{}</NbOfTxs>'
+            '<CtrlSum>{:.2f}</CtrlSum>'
+            '<InitgPty><Nm>{}</Nm></InitgPty>'
+            '</GrpHdr>\n'
+        ).format(
+            NAMESPACE,
+            text(self.message_id, 35),
+            dt.datetime.now().replace(microsecond=0).isoformat(),
+            self.number_of_transactions,
+            self.control_sum,
+            text(self.tenancy.name)
+        ))
+
+        self.blocks.seek(0)
+        shutil.copyfileobj(self.blocks, file)
+        self.blocks.close()
+        self.write(file, '</CstmrDrctDbtInitn></Document>\n')
+
+        file.seek(0)
+        return file
+
+    @staticmethod
+    def write(file, string):
+        file.write(string.encode('utf-8'))
+
+
+def get_collectable(collections):
+    """Return the collections of a queryset that can be collected by direct
+    debit: positive amounts, from a person with a mandate and an IBAN. The
+    negative collections of correction invoices are paid back otherwise.
+    """
+    return collections.filter(
+        amount__gt=0,
+        mandate__isnull=False,
+        iban__isnull=False
+    ).exclude(
+        iban=''
+    )
+
+
+def get_unsigned(collections):
+    """Return the collections of a queryset whose mandate has no date of
+    signature. A direct debit cannot be made without it.
+    """
+    return get_collectable(collections).filter(
+        contract_person__mandate_date__isnull=True
+    )
+
+
+def write_direct_debits(tenancy, collections, message_id,
+                        max_block_size=MAX_BLOCK_SIZE):
+    """Stream the direct debit collections of a queryset into a pain.008
+    file, with one PaymentInformation block per collection date. Only the
+    needed columns are fetched, with a server-side cursor. Collections that
+    cannot be collected, see get_collectable, are left out. Raises
+    ValueError if a mandate has no date of signature, see get_unsigned, as
+    the bank would reject the file.
+    """
+    unsigned = get_unsigned(collections).count()
+    if unsigned:
+        raise ValueError(
+            "{} collections have a mandate without a date of "
+            "signature.".format(unsigned)
+        )
+
+    rows = get_collectable(collections).order_by(
+        'payment_day', 'invoice__date', 'pk'
+    ).values_list(
+        'invoice__date',
+        'payment_day',
+        'invoice__invoice_number',
+        'amount',
+        'mandate',
+        'contract_person__mandate_date',
+        'contract_person__name',
+        'iban',
+    ).iterator(chunk_size=2000)
+
+    writer = DirectDebitWriter(tenancy, message_id, max_block_size)
+    for (invoice_date, payment_day, invoice_number, amount, mandate,
+         date_of_signature, name, iban) in rows:
+        writer.add(
+            collection_date=get_collection_date(invoice_date, payment_day),
+            end_to_end_id=invoice_number,
+            amount=amount,
+            mandate=mandate,
+            date_of_signature=date_of_signature,
+            name=name or '',
+            iban=iban,
+            description="Invoice " + str(invoice_number)
+        )
+
+    return writer.finish()
@@ -0,0 +1,85 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from InvoiceEngineApp import access
+from InvoiceEngineApp.models import (
+    BATCHED_TENANCY,
+    BaseComponent,
+    Collection,
+    Component,
+    Contract,
+    ContractPerson,
+    ContractType,
+    Invoice,
+    Tenancy,
+    VATRate,
+)
+
+
+def changes_owner(instance, update_fields):
+    return update_fields is None or 'tenancy_id' in update_fields
+
+
+@receiver(pre_save, sender=Tenancy)
+def invalidate_previous_owner(sender, instance, update_fields=None, **kwargs):
+    """When a tenancy is given to another user, the previous user loses
+    access to it.
+    """
+    if instance.pk and changes_owner(instance, update_fields):
+        previous = Tenancy.objects.filter(
+            pk=instance.pk
+        ).values_list('tenancy_id', flat=True).first()
+        if previous is not None and previous != instance.tenancy_id:
+            access.invalidate(previous)
+
+
+@receiver(post_save, sender=Tenancy)
+def invalidate_owner(sender, instance, update_fields=None, **kwargs):
+    if changes_owner(instance, update_fields):
+        access.invalidate(instance.tenancy_id)
+
+
+@receiver(post_delete, sender=Tenancy)
+def invalidate_deleted(sender, instance, **kwargs):
+    access.invalidate(instance.tenancy_id)
+
+
+@receiver(post_save, sender=ContractType)
+@receiver(post_save, sender=BaseComponent)
+@receiver(post_save, sender=VATRate)
+@receiver(post_delete, sender=ContractType)
+@receiver(post_delete, sender=BaseComponent)
+@receiver(post_delete, sender=VATRate)
+def raise_reference_data_version(sender, instance, **kwargs):
+    """Make every process load the reference data of the tenancy again. The
+    version is raised in the same transaction as the change.
+    """
+    Tenancy.objects.filter(
+        company_id=instance.tenancy_id
+    ).update(
+        reference_data_version=F('reference_data_version') + 1
+    )
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=Contract)
+@receiver(post_save, sender=ContractPerson)
+@receiver(post_save, sender=ContractType)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=Contract)
+@receiver(post_delete, sender=ContractPerson)
+@receiver(post_delete, sender=ContractType)
+def raise_data_generation(sender, instance, **kwargs):
+    """Invalidate the cached rows of the contract and invoice lists. Their
+    amounts and balances follow from the components and collections too.
+    Invoices and their collections are deleted in bulk by
+    Tenancy.delete_invoices, which raises the generation itself, so they
+    have no delete receiver that would make Django load every deleted
+    invoice. Queryset updates and bulk operations send no signals, and
+    raise the generation where they are done.
+    """
+    if BATCHED_TENANCY.get() != instance.tenancy_id:
+        Tenancy.raise_data_generation(instance.tenancy_id)
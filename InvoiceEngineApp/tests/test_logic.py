@@ -1,9 +1,27 @@
 import datetime as dt
 import decimal as dc
-
-from django.test import TestCase
+import json
+import zipfile
+from io import BytesIO, StringIO
+from xml.etree import ElementTree
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, TestCase
+from InvoiceEngineApp.audit import get_amount_differences, \
+    get_percentage_ranges as get_tenancy_percentage_ranges, reconcile_tenancy
+from InvoiceEngineApp.bulk import activate_contracts, end_contracts, \
+    get_activatable_contracts, index_components, replace_vat_rate
+from InvoiceEngineApp.documents import get_invoice_chunks, \
+    render_invoice_documents
+from InvoiceEngineApp.forms import ComponentForm
+from InvoiceEngineApp.imports import import_contracts, read_csv, read_jsonl
 from InvoiceEngineApp.models import Contract, Invoice, InvoiceLine, Collection, \
-    GeneralLedgerPost
+    GeneralLedgerPost, ContractPerson, Tenancy, Component, VATRate, div, mul_d
+from InvoiceEngineApp.partitions import create_partition, get_partitions
+from InvoiceEngineApp.payments import import_bank_statement
+from InvoiceEngineApp.sepa import get_collection_date, write_direct_debits
+from InvoiceEngineApp.validators import get_percentage_ranges, \
+    validate_person_percentages
 from model_bakery import baker
 
 
@@ -512,3 +530,1163 @@ class ComponentMethodsTest(TestCase):
                 self.assertEqual(post.amount_debit, 300)
 
         self.assertListEqual(container_credit, [])
+
+
+class DirectDebitTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make(
+            'Tenancy',
+            name='Housing & Co',
+            creditor_iban='NL91ABNA0417164300',
+            creditor_identifier='NL00ZZZ123456780000'
+        )
+        self.invoice = baker.make(
+            'Invoice', tenancy=self.tenancy, date=dt.date(2021, 5, 10)
+        )
+        for payment_day, amount in [(1, '10.00'), (15, '20.50'),
+                                    (15, '30.25'), (15, '1.00')]:
+            baker.make(
+                'Collection',
+                tenancy=self.tenancy,
+                invoice=self.invoice,
+                contract_person__tenancy=self.tenancy,
+                contract_person__mandate_date=dt.date(2020, 12, 1),
+                payment_method=ContractPerson.DIRECT_DEBIT,
+                payment_day=payment_day,
+                mandate=7,
+                iban='NL02ABNA012345678',
+                amount=dc.Decimal(amount)
+            )
+
+    def test_get_collection_date(self):
+        self.assertEqual(
+            get_collection_date(dt.date(2021, 5, 10), 15),
+            dt.date(2021, 5, 15)
+        )
+        self.assertEqual(
+            get_collection_date(dt.date(2021, 5, 10), 1),
+            dt.date(2021, 6, 1)
+        )
+        self.assertEqual(
+            get_collection_date(dt.date(2021, 12, 31), 30),
+            dt.date(2022, 1, 30)
+        )
+        self.assertEqual(
+            get_collection_date(dt.date(2021, 2, 10), 31),
+            dt.date(2021, 2, 28)
+        )
+        # A payment day of 0 is taken as the first
+        self.assertEqual(
+            get_collection_date(dt.date(2021, 5, 10), 0),
+            dt.date(2021, 6, 1)
+        )
+
+    def test_write_direct_debits(self):
+        file = write_direct_debits(
+            self.tenancy,
+            Collection.objects.filter(tenancy=self.tenancy),
+            'TEST-1',
+            max_block_size=2
+        )
+        ns = {'p': 'urn:iso:std:iso:20022:tech:xsd:pain.008.001.02'}
+        root = ElementTree.parse(file).getroot()
+
+        header = root.find('p:CstmrDrctDbtInitn/p:GrpHdr', ns)
+        self.assertEqual(header.find('p:NbOfTxs', ns).text, '4')
+        self.assertEqual(header.find('p:CtrlSum', ns).text, '61.75')
+
+        # One block for the 1st, and the 15th split into blocks of two
+        blocks = root.findall('p:CstmrDrctDbtInitn/p:PmtInf', ns)
+        self.assertEqual(
+            [(b.find('p:ReqdColltnDt', ns).text,
+              b.find('p:NbOfTxs', ns).text,
+              b.find('p:CtrlSum', ns).text) for b in blocks],
+            [('2021-06-01', '1', '10.00'),
+             ('2021-05-15', '2', '50.75'),
+             ('2021-05-15', '1', '1.00')]
+        )
+        self.assertEqual(
+            blocks[0].find('p:Cdtr/p:Nm', ns).text, 'Housing & Co'
+        )
+        self.assertEqual(
+            {element.text for element in root.iter('{%s}DtOfSgntr' % ns['p'])},
+            {'2020-12-01'}
+        )
+
+    def test_unsigned_mandate(self):
+        baker.make(
+            'Collection',
+            tenancy=self.tenancy,
+            invoice=self.invoice,
+            contract_person__tenancy=self.tenancy,
+            contract_person__mandate_date=None,
+            payment_method=ContractPerson.DIRECT_DEBIT,
+            payment_day=1,
+            mandate=8,
+            iban='NL02ABNA012345678',
+            amount=dc.Decimal('5.00')
+        )
+        with self.assertRaisesMessage(ValueError, "1 collections"):
+            write_direct_debits(
+                self.tenancy,
+                Collection.objects.filter(tenancy=self.tenancy),
+                'TEST-1'
+            )
+
+    def test_uncollectable(self):
+        # A credit of a correction invoice, and persons without a mandate
+        # or an IBAN
+        for amount, mandate, iban in [('-5.00', 7, 'NL02ABNA012345678'),
+                                      ('5.00', None, 'NL02ABNA012345678'),
+                                      ('5.00', 7, None)]:
+            baker.make(
+                'Collection',
+                tenancy=self.tenancy,
+                invoice=self.invoice,
+                contract_person__tenancy=self.tenancy,
+                payment_method=ContractPerson.DIRECT_DEBIT,
+                payment_day=1,
+                mandate=mandate,
+                iban=iban,
+                amount=dc.Decimal(amount)
+            )
+        file = write_direct_debits(
+            self.tenancy,
+            Collection.objects.filter(tenancy=self.tenancy),
+            'TEST-1'
+        )
+        ns = {'p': 'urn:iso:std:iso:20022:tech:xsd:pain.008.001.02'}
+        root = ElementTree.parse(file).getroot()
+        header = root.find('p:CstmrDrctDbtInitn/p:GrpHdr', ns)
+        self.assertEqual(header.find('p:NbOfTxs', ns).text, '4')
+        self.assertEqual(header.find('p:CtrlSum', ns).text, '61.75')
+        self.assertNotIn(
+            'None', [element.text for element in root.iter()]
+        )
+
+
+class InvoiceDocumentTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.date = dt.date(2021, 5, 1)
+        for payment_method in [ContractPerson.LETTER, ContractPerson.EMAIL,
+                               ContractPerson.DIRECT_DEBIT]:
+            invoice = baker.make(
+                'Invoice',
+                tenancy=self.tenancy,
+                contract__tenancy=self.tenancy,
+                date=self.date
+            )
+            baker.make(
+                'InvoiceLine',
+                invoice=invoice,
+                date=self.date,
+                description='Rent',
+                _quantity=3
+            )
+            baker.make(
+                'Collection',
+                tenancy=self.tenancy,
+                invoice=invoice,
+                contract_person__name='John Doe',
+                payment_method=payment_method
+            )
+
+    def test_get_invoice_chunks(self):
+        with self.assertNumQueries(7):
+            chunks = list(get_invoice_chunks(self.tenancy, self.date, 1))
+
+        # The direct debit payer does not get a document
+        self.assertEqual(len(chunks), 2)
+        invoice, invoice_lines, collections = chunks[0][0]
+        self.assertEqual(len(invoice_lines), 3)
+        self.assertEqual(len(collections), 1)
+
+    def test_render_invoice_documents(self):
+        file = BytesIO()
+        number_of_documents = render_invoice_documents(
+            self.tenancy, self.date, file, processes=2, chunk_size=1
+        )
+        self.assertEqual(number_of_documents, 2)
+
+        with zipfile.ZipFile(file) as archive:
+            names = archive.namelist()
+            self.assertEqual(len(names), 2)
+            document = archive.read(names[0]).decode()
+        self.assertIn('John Doe', document)
+        self.assertEqual(document.count('<td>Rent</td>'), 3)
+
+
+class PartitionTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.invoice = baker.make(
+            'Invoice', tenancy=self.tenancy, date=dt.date(2021, 5, 1)
+        )
+        baker.make(
+            'InvoiceLine',
+            invoice=self.invoice,
+            date=self.invoice.date,
+            _quantity=2
+        )
+        baker.make(
+            'InvoiceLine',
+            invoice__tenancy=self.tenancy,
+            date=dt.date(2021, 6, 1)
+        )
+
+    def test_create_partition(self):
+        moved = create_partition(InvoiceLine, dt.date(2021, 5, 1))
+        self.assertEqual(moved, 2)
+        self.assertEqual(
+            get_partitions(InvoiceLine),
+            {'InvoiceEngineApp_invoiceline_y2021m05'}
+        )
+        self.assertEqual(InvoiceLine.objects.count(), 3)
+
+        # Only the partition of the invoice's month is scanned
+        plan = self.invoice.get_invoice_lines().explain()
+        self.assertIn('InvoiceEngineApp_invoiceline_y2021m05', plan)
+        self.assertNotIn('InvoiceEngineApp_invoiceline_default', plan)
+        self.assertEqual(self.invoice.get_invoice_lines().count(), 2)
+
+    def test_delete_invoices(self):
+        create_partition(InvoiceLine, dt.date(2021, 5, 1))
+        create_partition(GeneralLedgerPost, dt.date(2021, 5, 1))
+        baker.make(
+            'GeneralLedgerPost',
+            tenancy=self.tenancy,
+            invoice=self.invoice,
+            invoice_line=None,
+            date=self.invoice.date
+        )
+
+        self.tenancy.delete_invoices(dt.date(2021, 5, 1), dt.date(2021, 5, 31))
+        self.assertEqual(InvoiceLine.objects.count(), 1)
+        self.assertFalse(GeneralLedgerPost.objects.exists())
+        self.assertFalse(Invoice.objects.filter(date__month=5).exists())
+
+
+class ReferenceDataTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, successor_vat_rate=None
+        )
+        baker.make('BaseComponent', tenancy=self.tenancy, _quantity=3)
+        baker.make('ContractType', tenancy=self.tenancy)
+
+    def get_reference_data(self):
+        self.tenancy.refresh_from_db()
+        return self.tenancy.get_reference_data()
+
+    def test_cached_until_changed(self):
+        reference_data = self.get_reference_data()
+        self.assertEqual(len(reference_data.base_components), 3)
+        with self.assertNumQueries(0):
+            self.assertIs(
+                self.tenancy.get_reference_data(), reference_data
+            )
+
+        # Any change raises the version, so the data is loaded again
+        self.vat_rate.description = 'High'
+        self.vat_rate.save()
+        reference_data = self.get_reference_data()
+        self.assertEqual(
+            reference_data.vat_rates[self.vat_rate.pk].description, 'High'
+        )
+
+        baker.make('BaseComponent', tenancy=self.tenancy).delete()
+        self.assertIsNot(self.get_reference_data(), reference_data)
+
+    def test_tenancy_save_keeps_version(self):
+        tenancy = Tenancy.objects.get(pk=self.tenancy.pk)
+        self.vat_rate.save()
+        tenancy.name = 'Other name'
+        tenancy.save()
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.name, 'Other name')
+        self.assertGreater(
+            self.tenancy.reference_data_version,
+            tenancy.reference_data_version
+        )
+
+    def test_form_choices(self):
+        Tenancy.get_reference_data_of(self.tenancy.company_id)
+        form = ComponentForm()
+        with self.assertNumQueries(1):
+            form.filter_selectors(self.tenancy.company_id)
+            html = str(form['base_component']) + str(form['vat_rate'])
+        self.assertEqual(html.count('<option'), 6)
+
+
+class VATRateReplacementTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.successor = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=dc.Decimal(9),
+            successor_vat_rate=None
+        )
+        self.vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=dc.Decimal(21),
+            successor_vat_rate=self.successor
+        )
+        self.contract = baker.make(
+            'Contract', tenancy=self.tenancy, base_amount=0, vat_amount=0,
+            total_amount=0
+        )
+        # Amounts with ties when rounded, and one priced per unit
+        for base_amount, number_of_units, unit_amount in [
+                (dc.Decimal('0.50'), None, None),
+                (dc.Decimal('100.00'), None, None),
+                (None, dc.Decimal(3), dc.Decimal('1.115'))]:
+            component = baker.prepare(
+                'Component', tenancy=self.tenancy, contract=self.contract,
+                vat_rate=self.vat_rate, base_amount=base_amount,
+                number_of_units=number_of_units, unit_amount=unit_amount,
+                vat_amount=0, start_date=dt.date(2021, 1, 1),
+                base_component=baker.make(
+                    'BaseComponent', tenancy=self.tenancy
+                )
+            )
+            component.set_derived_fields()
+            component.save()
+        self.contract.save()
+
+    def assert_amounts(self, percentage):
+        """Compare the amounts with those computed in Python."""
+        totals = [0, 0, 0]
+        for component in Component.objects.filter(contract=self.contract):
+            amount = component.base_amount or mul_d(
+                component.number_of_units, component.unit_amount
+            )
+            vat_amount = mul_d(div(percentage, 100), amount)
+            self.assertEqual(component.vat_amount, vat_amount)
+            self.assertEqual(component.total_amount, amount + vat_amount)
+            totals = [totals[0] + amount, totals[1] + vat_amount,
+                      totals[2] + amount + vat_amount]
+        self.contract.refresh_from_db()
+        self.assertEqual(
+            [self.contract.base_amount, self.contract.vat_amount,
+             self.contract.total_amount],
+            totals
+        )
+
+    def test_update(self):
+        self.vat_rate.percentage = dc.Decimal('4.5')
+        self.vat_rate.save()
+        progress = []
+        self.assertEqual(
+            replace_vat_rate(
+                self.vat_rate, self.vat_rate,
+                lambda done, total: progress.append(done), batch_size=1
+            ),
+            3
+        )
+        self.assertEqual(len(progress), 3)
+        self.assert_amounts(dc.Decimal('4.5'))
+
+    def test_delete(self):
+        self.vat_rate.delete()
+        self.assertFalse(
+            VATRate.objects.filter(pk=self.vat_rate.pk).exists()
+        )
+        self.assertEqual(
+            Component.objects.filter(vat_rate=self.successor).count(), 3
+        )
+        self.assert_amounts(dc.Decimal(9))
+
+        self.successor.delete()
+        self.assert_amounts(dc.Decimal(0))
+
+    def test_invoiced_component(self):
+        # An ended component that invoicing has taken out of the amounts of
+        # an active contract
+        self.contract.status = Contract.ACTIVE
+        self.contract.save()
+        component = baker.prepare(
+            'Component', tenancy=self.tenancy, contract=self.contract,
+            vat_rate=self.vat_rate, base_amount=dc.Decimal('40.00'),
+            vat_amount=0, start_date=dt.date(2021, 1, 1),
+            end_date=dt.date(2021, 1, 31),
+            date_next_prolongation=None,
+            base_component=baker.make('BaseComponent', tenancy=self.tenancy)
+        )
+        component.set_derived_fields()
+        component.save()
+
+        self.vat_rate.percentage = dc.Decimal(10)
+        self.vat_rate.save()
+        self.assertEqual(replace_vat_rate(self.vat_rate, self.vat_rate), 4)
+        component.refresh_from_db()
+        self.assertEqual(component.vat_amount, dc.Decimal('4.00'))
+        self.assertEqual(get_amount_differences(self.tenancy.company_id), [])
+
+
+class IndexationTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=dc.Decimal(20),
+            successor_vat_rate=None
+        )
+        self.base_component = baker.make(
+            'BaseComponent', tenancy=self.tenancy, unit_id=None
+        )
+        self.components = []
+        for status, date_next_prolongation in [
+                (Contract.ACTIVE, dt.date(2021, 7, 1)),
+                (Contract.DRAFT, None)]:
+            contract = baker.make(
+                'Contract', tenancy=self.tenancy, status=status,
+                contract_type__tenancy=self.tenancy,
+                invoicing_period=Contract.MONTH,
+                start_date=dt.date(2021, 1, 1), end_date=None,
+                date_prev_prolongation=dt.date(2021, 6, 1)
+                if date_next_prolongation else None,
+                date_next_prolongation=date_next_prolongation,
+                base_amount=dc.Decimal(100), vat_amount=dc.Decimal(20),
+                total_amount=dc.Decimal(120)
+            )
+            baker.make(
+                'ContractPerson', contract=contract, tenancy=self.tenancy,
+                percentage_of_total=100, start_date=dt.date(2021, 1, 1),
+                end_date=None, payment_day=1
+            )
+            self.components.append(baker.make(
+                'Component', tenancy=self.tenancy, contract=contract,
+                base_component=self.base_component, vat_rate=vat_rate,
+                base_amount=dc.Decimal(100), vat_amount=dc.Decimal(20),
+                total_amount=dc.Decimal(120), unit_amount=None,
+                number_of_units=None, start_date=dt.date(2021, 1, 1),
+                end_date=None, date_prev_prolongation=None,
+                date_next_prolongation=date_next_prolongation
+            ))
+
+    def test_index_components(self):
+        progress = []
+        self.assertEqual(
+            index_components(
+                self.tenancy, dt.date(2021, 6, 1), percentage=dc.Decimal(3),
+                progress=lambda done, total: progress.append((done, total)),
+                batch_size=1
+            ),
+            2
+        )
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+
+        for old in self.components:
+            old.refresh_from_db()
+            self.assertEqual(old.end_date, dt.date(2021, 5, 31))
+            new = Component.objects.get(
+                contract=old.contract, start_date=dt.date(2021, 6, 1)
+            )
+            self.assertEqual(new.base_amount, dc.Decimal('103.00'))
+            self.assertEqual(new.vat_amount, dc.Decimal('20.60'))
+            self.assertEqual(new.total_amount, dc.Decimal('123.60'))
+            self.assertEqual(
+                new.date_next_prolongation,
+                old.contract.date_next_prolongation
+            )
+
+        # June has already been invoiced for the active contract, so the
+        # difference is invoiced with one correction invoice
+        invoice = Invoice.objects.get(tenancy=self.tenancy)
+        self.assertEqual(invoice.contract_id, self.components[0].contract_id)
+        self.assertEqual(invoice.invoiceline_set.count(), 2)
+        self.assertEqual(invoice.total_amount, dc.Decimal('3.60'))
+        self.assertEqual(
+            Collection.objects.get(invoice=invoice).amount,
+            dc.Decimal('3.60')
+        )
+        contract = Contract.objects.get(pk=invoice.contract_id)
+        self.assertEqual(contract.balance, dc.Decimal('3.60'))
+        # The old component ended in the invoiced period, so it is not
+        # invoiced again and is taken out of the amounts of the contract
+        self.assertIsNone(self.components[0].date_next_prolongation)
+        self.assertEqual(contract.total_amount, dc.Decimal('123.60'))
+
+        # The next invoicing run only invoices the new component
+        self.tenancy.invoice_contracts()
+        invoice = Invoice.objects.filter(
+            tenancy=self.tenancy
+        ).exclude(pk=invoice.pk).get()
+        self.assertEqual(
+            [line.component.start_date
+             for line in invoice.invoiceline_set.all()],
+            [dt.date(2021, 6, 1)]
+        )
+        self.assertGreater(invoice.total_amount, 0)
+
+    def test_invoice_numbers(self):
+        # Invoices made after the tenancy was loaded, e.g. by another
+        # process
+        Tenancy.objects.filter(pk=self.tenancy.pk).update(
+            last_invoice_number=10
+        )
+        index_components(
+            self.tenancy, dt.date(2021, 6, 1), percentage=dc.Decimal(3)
+        )
+        self.assertEqual(
+            Invoice.objects.get(tenancy=self.tenancy).invoice_number, 11
+        )
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.last_invoice_number, 11)
+
+    def test_index_on_start_date(self):
+        index_components(
+            self.tenancy, dt.date(2021, 1, 1), percentage=dc.Decimal(3)
+        )
+        # The old components are replaced as a whole, so only the new ones
+        # are in the amounts of the contracts
+        for old in self.components:
+            old.refresh_from_db()
+            self.assertIsNone(old.start_date)
+            old.contract.refresh_from_db()
+            self.assertEqual(old.contract.total_amount, dc.Decimal('123.60'))
+        self.assertEqual(get_amount_differences(self.tenancy.company_id), [])
+
+    def test_contract_statuses(self):
+        active, draft = [component.contract for component in self.components]
+        active.status = Contract.TERMINATED
+        active.save()
+        draft.status = Contract.ENDED
+        draft.save()
+        # Terminated contracts still run, ended ones are not indexed
+        self.assertEqual(
+            index_components(
+                self.tenancy, dt.date(2021, 6, 1), percentage=dc.Decimal(3)
+            ),
+            1
+        )
+        self.assertTrue(Component.objects.filter(
+            contract=active, start_date=dt.date(2021, 6, 1)
+        ).exists())
+
+
+class EndContractsTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=dc.Decimal(20),
+            successor_vat_rate=None
+        )
+        self.contracts = []
+        for status in [Contract.ACTIVE, Contract.TERMINATED, Contract.DRAFT]:
+            contract = baker.make(
+                'Contract', tenancy=self.tenancy, status=status,
+                contract_type__tenancy=self.tenancy,
+                invoicing_period=Contract.MONTH,
+                start_date=dt.date(2021, 1, 1), end_date=None,
+                date_prev_prolongation=dt.date(2021, 6, 1),
+                date_next_prolongation=dt.date(2021, 7, 1),
+                base_amount=dc.Decimal(100), vat_amount=dc.Decimal(20),
+                total_amount=dc.Decimal(120)
+            )
+            baker.make(
+                'ContractPerson', contract=contract, tenancy=self.tenancy,
+                percentage_of_total=100, start_date=dt.date(2021, 1, 1),
+                end_date=None, payment_day=1
+            )
+            baker.make(
+                'Component', tenancy=self.tenancy, contract=contract,
+                base_component__tenancy=self.tenancy, vat_rate=vat_rate,
+                base_amount=dc.Decimal(100), vat_amount=dc.Decimal(20),
+                total_amount=dc.Decimal(120), unit_amount=None,
+                number_of_units=None, start_date=dt.date(2021, 1, 1),
+                end_date=None, date_next_prolongation=dt.date(2021, 7, 1)
+            )
+            self.contracts.append(contract)
+
+    def test_end_contracts(self):
+        ids = [contract.contract_id for contract in self.contracts]
+        self.assertEqual(
+            end_contracts(self.tenancy, ids, dt.date(2021, 6, 15)), 2
+        )
+
+        for contract in self.contracts[:2]:
+            contract.refresh_from_db()
+            self.assertEqual(contract.status, Contract.ENDED)
+            self.assertEqual(contract.end_date, dt.date(2021, 6, 15))
+            self.assertIsNone(contract.date_next_prolongation)
+            self.assertEqual(
+                contract.contractperson_set.get().end_date,
+                dt.date(2021, 6, 15)
+            )
+            component = contract.component_set.get()
+            self.assertEqual(component.end_date, dt.date(2021, 6, 15))
+            self.assertIsNone(component.date_next_prolongation)
+
+            # The rest of June is credited
+            invoice = contract.invoice_set.get()
+            self.assertEqual(invoice.total_amount, dc.Decimal('-64.00'))
+            self.assertEqual(
+                invoice.collection_set.get().amount, dc.Decimal('-64.00')
+            )
+            self.assertEqual(contract.balance, dc.Decimal('-64.00'))
+
+        # The components are not invoiced anymore, so they are not in the
+        # amounts of the contracts either
+        self.assertEqual(get_amount_differences(self.tenancy.company_id), [])
+
+        # Draft contracts are not ended
+        self.contracts[2].refresh_from_db()
+        self.assertEqual(self.contracts[2].status, Contract.DRAFT)
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.last_invoice_number, 2)
+
+    def test_end_after_invoiced_period(self):
+        end_contracts(
+            self.tenancy, [self.contracts[0].contract_id], dt.date(2021, 8, 31)
+        )
+        contract = Contract.objects.get(pk=self.contracts[0].contract_id)
+        self.assertEqual(contract.status, Contract.ENDED)
+        # Invoiced until the end date, see Contract.end_invoicing
+        self.assertEqual(contract.date_next_prolongation, dt.date(2021, 7, 1))
+        self.assertFalse(contract.invoice_set.exists())
+
+
+class ContractActivationTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.contracts = []
+        # (termination date, percentage of the person, has components)
+        for termination_date, percentage, has_components in [
+                (None, 100, True),
+                (dt.date(2021, 12, 31), 100, True),
+                (None, 50, True),
+                (None, 100, False)]:
+            contract = baker.make(
+                'Contract', tenancy=self.tenancy, status=Contract.DRAFT,
+                start_date=dt.date(2021, 3, 1),
+                termination_date=termination_date,
+                date_next_prolongation=None
+            )
+            baker.make(
+                'ContractPerson', contract=contract, tenancy=self.tenancy,
+                percentage_of_total=percentage,
+                start_date=dt.date(2021, 1, 1), end_date=None, payment_day=1
+            )
+            if has_components:
+                baker.make(
+                    'Component', tenancy=self.tenancy, contract=contract,
+                    start_date=dt.date(2021, 1, 1), end_date=None,
+                    date_next_prolongation=None
+                )
+            self.contracts.append(contract)
+
+    def test_activate_contracts(self):
+        activatable = get_activatable_contracts(self.tenancy)
+        self.assertEqual(
+            [contract.can_activate() for contract in self.contracts],
+            [contract in activatable for contract in self.contracts]
+        )
+
+        self.assertEqual(
+            activate_contracts(
+                self.tenancy,
+                [contract.contract_id for contract in self.contracts],
+                batch_size=1
+            ),
+            2
+        )
+        statuses = []
+        for contract in self.contracts:
+            contract.refresh_from_db()
+            statuses.append(contract.status)
+        self.assertEqual(statuses, [
+            Contract.ACTIVE, Contract.TERMINATED, Contract.DRAFT,
+            Contract.DRAFT
+        ])
+
+        contract = self.contracts[0]
+        self.assertEqual(contract.date_next_prolongation, dt.date(2021, 3, 1))
+        component = contract.component_set.get()
+        self.assertEqual(component.start_date, dt.date(2021, 3, 1))
+        self.assertEqual(
+            component.date_next_prolongation, dt.date(2021, 3, 1)
+        )
+        self.assertEqual(
+            contract.contractperson_set.get().start_date, dt.date(2021, 3, 1)
+        )
+
+    def test_activated_meanwhile(self):
+        second = self.contracts[1]
+
+        def activate_and_invoice(done, total):
+            # The second contract is activated and invoiced by hand while
+            # the first batch is done
+            if done == 1:
+                Contract.objects.filter(pk=second.pk).update(
+                    status=Contract.TERMINATED,
+                    date_next_prolongation=dt.date(2021, 9, 1)
+                )
+
+        self.assertEqual(
+            activate_contracts(
+                self.tenancy,
+                [contract.contract_id for contract in self.contracts[:2]],
+                progress=activate_and_invoice,
+                batch_size=1
+            ),
+            1
+        )
+        second.refresh_from_db()
+        self.assertEqual(second.date_next_prolongation, dt.date(2021, 9, 1))
+        self.assertIsNone(
+            second.component_set.get().date_next_prolongation
+        )
+
+
+class ContractImportTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy', number_of_contracts=0)
+        self.contract_type = baker.make('ContractType', tenancy=self.tenancy)
+        self.base_component = baker.make(
+            'BaseComponent', tenancy=self.tenancy, unit_id=None
+        )
+        self.vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=21
+        )
+
+    def get_person(self, percentage):
+        return {
+            'type': 'P',
+            'name': 'Tenant',
+            'address': 'Street 1',
+            'city': 'Groningen',
+            'email': 'tenant@example.com',
+            'phone': '0612345678',
+            'start_date': '2021-01-01',
+            'percentage_of_total': percentage,
+        }
+
+    def get_record(self, **kwargs):
+        record = {
+            'external_customer_id': 7,
+            'contract_type_id': self.contract_type.pk,
+            'invoicing_period': 'M',
+            'start_date': '2021-01-01',
+            'gl_dimension_1': 'A',
+            'gl_dimension_2': 'B',
+            'components': [{
+                'base_component_id': self.base_component.pk,
+                'vat_rate_id': self.vat_rate.pk,
+                'description': 'Rent',
+                'start_date': '2021-01-01',
+                'base_amount': '100.50',
+            }],
+            'persons': [self.get_person(100)],
+        }
+        record.update(kwargs)
+        return record
+
+    def test_import_jsonl(self):
+        lines = [
+            self.get_record(),
+            # A person who does not pay everything
+            self.get_record(persons=[self.get_person(50)]),
+            self.get_record(external_customer_id=8),
+        ]
+        file = StringIO('\n'.join(json.dumps(line) for line in lines))
+
+        imported, errors = import_contracts(
+            self.tenancy, read_jsonl(file), batch_size=1
+        )
+        self.assertEqual(imported, 2)
+        self.assertEqual(
+            errors,
+            [(2, 'Total of all persons smaller than 100% by 50% '
+                 'from 2021-01-01 on')]
+        )
+
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.number_of_contracts, 2)
+        contracts = Contract.objects.filter(
+            tenancy=self.tenancy
+        ).order_by('contract_id')
+        self.assertEqual(
+            [contract.external_customer_id for contract in contracts], [7, 8]
+        )
+        contract = contracts[0]
+        self.assertEqual(contract.status, Contract.DRAFT)
+        self.assertEqual(contract.base_amount, dc.Decimal('100.50'))
+        self.assertEqual(contract.vat_amount, dc.Decimal('21.10'))
+        self.assertEqual(contract.total_amount, dc.Decimal('121.60'))
+        component = contract.component_set.get()
+        self.assertEqual(component.total_amount, dc.Decimal('121.60'))
+        person = contract.contractperson_set.get()
+        self.assertEqual(person.payment_method, ContractPerson.INVOICE)
+        self.assertEqual(person.payment_day, 1)
+        self.assertTrue(contract.can_activate())
+
+    def test_read_csv(self):
+        file = StringIO(
+            'record,external_customer_id,description,name\n'
+            'contract,7,,\n'
+            'component,,Rent,\n'
+            'person,,,Tenant\n'
+            'contract,8,,\n'
+        )
+        self.assertEqual(list(read_csv(file)), [
+            (2, {
+                'external_customer_id': '7',
+                'components': [{'description': 'Rent'}],
+                'persons': [{'name': 'Tenant'}],
+            }),
+            (5, {
+                'external_customer_id': '8', 'components': [], 'persons': []
+            }),
+        ])
+
+    def test_invalid_lines(self):
+        file = StringIO(
+            json.dumps(self.get_record()) + '\n{"external_customer_id": 8\n'
+            + '[]\n' + json.dumps(self.get_record(external_customer_id=9))
+        )
+        imported, errors = import_contracts(
+            self.tenancy, read_jsonl(file), batch_size=1
+        )
+        self.assertEqual(imported, 2)
+        self.assertEqual([line_number for line_number, _ in errors], [2, 3])
+        self.assertTrue(errors[0][1].startswith('Invalid JSON'))
+        self.assertEqual(errors[1][1], 'Expected an object.')
+
+        file = StringIO(
+            'record,external_customer_id,description\n'
+            'component,,Rent\n'
+            'contract,7,\n'
+            'line,,\n'
+        )
+        self.assertEqual(
+            [(line_number, " ".join(record.messages))
+             for line_number, record in read_csv(file)
+             if isinstance(record, ValidationError)],
+            [(2, 'Component before the first contract.'),
+             (4, 'Unknown record line.')]
+        )
+
+    def test_dry_run(self):
+        file = StringIO(json.dumps(self.get_record()))
+        imported, errors = import_contracts(
+            self.tenancy, read_jsonl(file), dry_run=True
+        )
+        self.assertEqual((imported, errors), (1, []))
+        self.assertFalse(Contract.objects.filter(tenancy=self.tenancy).exists())
+
+
+class PersonPercentageTest(SimpleTestCase):
+    def test_rotating_persons(self):
+        # One tenant per year, for a long time
+        persons = [
+            (dt.date(year, 1, 1), dt.date(year, 12, 31), 100)
+            for year in range(1900, 2100)
+        ]
+        persons.append((dt.date(2100, 1, 1), None, 100))
+        self.assertEqual(
+            get_percentage_ranges(persons, dt.date(1900, 1, 1)), []
+        )
+        validate_person_percentages(persons, dt.date(1900, 1, 1))
+
+    def test_ranges(self):
+        persons = [
+            (dt.date(2021, 1, 1), dt.date(2021, 3, 31), 100),
+            # Overlaps a day with the first person
+            (dt.date(2021, 3, 31), dt.date(2021, 5, 31), 100),
+            # Leaves a gap in June
+            (dt.date(2021, 7, 1), None, 60),
+        ]
+        self.assertEqual(
+            get_percentage_ranges(persons, dt.date(2020, 12, 1)),
+            [
+                (dt.date(2020, 12, 1), dt.date(2020, 12, 31), 0),
+                (dt.date(2021, 3, 31), dt.date(2021, 3, 31), 200),
+                (dt.date(2021, 6, 1), dt.date(2021, 6, 30), 0),
+                (dt.date(2021, 7, 1), None, 60),
+            ]
+        )
+
+        with self.assertRaises(ValidationError) as context:
+            validate_person_percentages(persons, dt.date(2021, 1, 1))
+        self.assertEqual(context.exception.messages, [
+            'Total of all persons exceeding 100% by 100% on 2021-03-31',
+            'Total of all persons smaller than 100% by 100% '
+            'from 2021-06-01 to 2021-06-30',
+            'Total of all persons smaller than 100% by 40% from 2021-07-01 on',
+        ])
+
+
+class ContractAuditTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.contracts = []
+        for status in [Contract.ACTIVE, Contract.ACTIVE, Contract.DRAFT]:
+            contract = baker.make(
+                'Contract', tenancy=self.tenancy, status=status,
+                start_date=dt.date(2021, 1, 1), base_amount=100,
+                vat_amount=21, total_amount=121
+            )
+            baker.make(
+                'Component', tenancy=self.tenancy, contract=contract,
+                start_date=contract.start_date, vat_amount=21,
+                total_amount=121
+            )
+            self.contracts.append(contract)
+
+    def test_amount_differences(self):
+        self.assertEqual(get_amount_differences(self.tenancy.company_id), [])
+
+        contract = self.contracts[1]
+        baker.make(
+            'Component', tenancy=self.tenancy, contract=contract,
+            start_date=contract.start_date, vat_amount=0, total_amount=50
+        )
+        self.assertEqual(get_amount_differences(self.tenancy.company_id), [(
+            contract.contract_id, (100, 21, 121), (150, 21, 171)
+        )])
+
+    def test_amount_differences_after_invoicing(self):
+        tenancy = baker.make('Tenancy')
+        date_today = dt.date.today()
+        contract = baker.make(
+            'Contract', tenancy=tenancy, status=Contract.ACTIVE,
+            contract_type__tenancy=tenancy, invoicing_period=Contract.MONTH,
+            pricing_type=Contract.PERIOD,
+            start_date=date_today - dt.timedelta(days=60), end_date=None,
+            date_prev_prolongation=date_today - dt.timedelta(days=31),
+            date_next_prolongation=date_today, base_amount=200,
+            vat_amount=40, total_amount=240
+        )
+        # One of the components ends five days into the next period
+        for end_date in [None, date_today + dt.timedelta(days=5)]:
+            baker.make(
+                'Component', tenancy=tenancy, contract=contract,
+                base_component__tenancy=tenancy, vat_rate=None,
+                base_amount=100, vat_amount=20, total_amount=120,
+                unit_amount=None, number_of_units=None,
+                start_date=contract.start_date, end_date=end_date,
+                date_next_prolongation=date_today
+            )
+        tenancy.invoice_contracts()
+
+        contract.refresh_from_db()
+        self.assertEqual(contract.total_amount, 120)
+        self.assertEqual(get_amount_differences(tenancy.company_id), [])
+
+    def test_percentage_ranges(self):
+        first, second, draft = self.contracts
+        for contract in self.contracts:
+            baker.make(
+                'ContractPerson', tenancy=self.tenancy, contract=contract,
+                start_date=dt.date(2021, 1, 1),
+                end_date=dt.date(2021, 6, 30), percentage_of_total=100
+            )
+        baker.make(
+            'ContractPerson', tenancy=self.tenancy, contract=first,
+            start_date=dt.date(2021, 7, 1), percentage_of_total=100
+        )
+        # A gap in July, and a person too many from August on
+        for start_date in [dt.date(2021, 8, 1), dt.date(2021, 8, 1)]:
+            baker.make(
+                'ContractPerson', tenancy=self.tenancy, contract=second,
+                start_date=start_date, percentage_of_total=50
+            )
+        baker.make(
+            'ContractPerson', tenancy=self.tenancy, contract=second,
+            start_date=dt.date(2021, 8, 1), end_date=dt.date(2021, 8, 31),
+            percentage_of_total=0
+        )
+        baker.make(
+            'ContractPerson', tenancy=self.tenancy, contract=second,
+            start_date=dt.date(2021, 8, 1), percentage_of_total=10
+        )
+
+        ranges = get_tenancy_percentage_ranges(self.tenancy.company_id)
+        self.assertEqual(ranges, [
+            (second.contract_id, dt.date(2021, 7, 1), dt.date(2021, 7, 31), 0),
+            (second.contract_id, dt.date(2021, 8, 1), None, 110),
+        ])
+
+        # The same as the form validation
+        persons = second.contractperson_set.values_list(
+            'start_date', 'end_date', 'percentage_of_total'
+        )
+        self.assertEqual(
+            [contract_range[1:] for contract_range in ranges],
+            get_percentage_ranges(persons, second.start_date)
+        )
+
+
+class ContractBalanceTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.contract = baker.make(
+            'Contract', tenancy=self.tenancy, balance=121
+        )
+        self.invoices = []
+        for balance, collected in [(121, 121), (100, 60)]:
+            invoice = baker.make(
+                'Invoice', tenancy=self.tenancy, contract=self.contract,
+                total_amount=121, balance=balance
+            )
+            baker.make(
+                'GeneralLedgerPost', tenancy=self.tenancy, invoice=invoice,
+                invoice_line=None, amount_debit=121, amount_credit=0
+            )
+            # Two persons who pay a third and two thirds
+            third = dc.Decimal('40.33')
+            for amount in [third, collected - third]:
+                baker.make(
+                    'Collection', tenancy=self.tenancy, invoice=invoice,
+                    amount=amount
+                )
+            self.invoices.append(invoice)
+
+    def test_reconcile(self):
+        first, second = self.invoices
+        company_id, balance_differences, collection_differences = \
+            reconcile_tenancy(self.tenancy.company_id, fix=True)
+        self.assertEqual(balance_differences, [
+            ('invoice', second.invoice_id, 100, 121),
+            ('contract', self.contract.contract_id, 121, 242),
+        ])
+        self.assertEqual(
+            collection_differences, [(second.invoice_id, 121, 60)]
+        )
+
+        second.refresh_from_db()
+        self.contract.refresh_from_db()
+        self.assertEqual(second.balance, 121)
+        self.assertEqual(self.contract.balance, 242)
+        self.assertEqual(
+            reconcile_tenancy(self.tenancy.company_id)[1], []
+        )
+
+
+class ContractPaymentTest(TestCase):
+    STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+<BkToCstmrStmt><Stmt><Id>1</Id>
+<Ntry><Amt Ccy="EUR">121.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+<BookgDt><Dt>2021-02-01</Dt></BookgDt><AcctSvcrRef>A</AcctSvcrRef>
+<NtryDtls><TxDtls><Refs><EndToEndId>1001</EndToEndId><MndtId>7</MndtId></Refs>
+</TxDtls></NtryDtls></Ntry>
+<Ntry><Amt Ccy="EUR">60.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+<BookgDt><Dt>2021-02-02</Dt></BookgDt><AcctSvcrRef>B</AcctSvcrRef>
+<NtryDtls>
+<TxDtls><Amt Ccy="EUR">50.00</Amt><Refs><EndToEndId>NOTPROVIDED</EndToEndId>
+</Refs><RltdPties><DbtrAcct><Id><IBAN>NL02 BANK 0000 0000 2</IBAN></Id>
+</DbtrAcct></RltdPties><RmtInf><Ustrd>Rent</Ustrd></RmtInf></TxDtls>
+<TxDtls><Amt Ccy="EUR">10.00</Amt><RmtInf><Ustrd>Gift</Ustrd></RmtInf></TxDtls>
+</NtryDtls></Ntry>
+<Ntry><Amt Ccy="EUR">121.00</Amt><CdtDbtInd>DBIT</CdtDbtInd><Sts>BOOK</Sts>
+<BookgDt><Dt>2021-02-03</Dt></BookgDt><AcctSvcrRef>C</AcctSvcrRef>
+<NtryDtls><TxDtls><Refs><EndToEndId>1001</EndToEndId></Refs></TxDtls>
+</NtryDtls></Ntry>
+</Stmt></BkToCstmrStmt></Document>
+"""
+
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.contract = baker.make(
+            'Contract', tenancy=self.tenancy, balance=171
+        )
+        self.collections = []
+        for invoice_number, amount, mandate, iban in [
+                (1001, 121, 7, 'NL01BANK000000001'),
+                (1002, 50, None, 'NL02BANK000000002')]:
+            invoice = baker.make(
+                'Invoice', tenancy=self.tenancy, contract=self.contract,
+                invoice_number=invoice_number, total_amount=amount,
+                balance=amount
+            )
+            baker.make(
+                'GeneralLedgerPost', tenancy=self.tenancy, invoice=invoice,
+                invoice_line=None, amount_debit=amount, amount_credit=0
+            )
+            self.collections.append(baker.make(
+                'Collection', tenancy=self.tenancy, invoice=invoice,
+                amount=amount, mandate=mandate, iban=iban
+            ))
+
+    def test_import_bank_statement(self):
+        number_matched, total, unmatched, number_skipped = \
+            import_bank_statement(
+                self.tenancy, BytesIO(self.STATEMENT.encode()), '1100',
+                batch_size=2
+            )
+        self.assertEqual((number_matched, total, number_skipped), (2, 171, 0))
+        self.assertEqual(
+            [(payment['reference'], payment['amount'])
+             for payment in unmatched],
+            [('B/2', 10), ('C', 121)]
+        )
+
+        for collection in self.collections:
+            collection.refresh_from_db()
+            collection.invoice.refresh_from_db()
+            self.assertIsNotNone(collection.paid_date)
+            self.assertEqual(collection.invoice.balance, 0)
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.balance, 0)
+        self.assertEqual(
+            GeneralLedgerPost.objects.filter(
+                tenancy=self.tenancy, gl_account='1100'
+            ).count(),
+            2
+        )
+        # The ledger agrees with the balances and the collections
+        self.assertEqual(
+            reconcile_tenancy(self.tenancy.company_id)[1:], ([], [])
+        )
+
+        # Booking the statement again skips the payments booked before
+        number_matched, total, unmatched, number_skipped = \
+            import_bank_statement(
+                self.tenancy, BytesIO(self.STATEMENT.encode()), '1100'
+            )
+        self.assertEqual(
+            (number_matched, len(unmatched), number_skipped), (0, 2, 2)
+        )
+
+    def test_import_bank_statement_same_mandate(self):
+        # Next month's rent, with the same mandate and amount
+        invoice = baker.make(
+            'Invoice', tenancy=self.tenancy, contract=self.contract,
+            invoice_number=1003, total_amount=121, balance=121
+        )
+        baker.make(
+            'GeneralLedgerPost', tenancy=self.tenancy, invoice=invoice,
+            invoice_line=None, amount_debit=121, amount_credit=0
+        )
+        collection = baker.make(
+            'Collection', tenancy=self.tenancy, invoice=invoice, amount=121,
+            mandate=7, iban='NL01BANK000000001'
+        )
+        self.contract.balance = 292
+        self.contract.save()
+
+        for _ in range(2):
+            import_bank_statement(
+                self.tenancy, BytesIO(self.STATEMENT.encode()), '1100'
+            )
+        collection.refresh_from_db()
+        self.assertIsNone(collection.paid_date)
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.balance, 121)
+
+        # Another payment for the paid invoice does not pay the open one
+        statement = self.STATEMENT.replace(
+            '<AcctSvcrRef>A</AcctSvcrRef>', '<AcctSvcrRef>D</AcctSvcrRef>'
+        )
+        number_matched, total, unmatched, number_skipped = \
+            import_bank_statement(
+                self.tenancy, BytesIO(statement.encode()), '1100'
+            )
+        self.assertEqual(number_matched, 0)
+        self.assertIn('D', [payment['reference'] for payment in unmatched])
+        collection.refresh_from_db()
+        self.assertIsNone(collection.paid_date)
+        self.assertEqual(
+            reconcile_tenancy(self.tenancy.company_id)[1:], ([], [])
+        )
@@ -1,6 +1,28 @@
+import datetime
+import decimal
+import json
+from io import BytesIO
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 from django.contrib.auth.models import User
-from django.test import RequestFactory, TestCase
+from django.conf import settings
+from django.db import transaction
+from django.test import Client, RequestFactory, TestCase, \
+    TransactionTestCase, override_settings
+from django.urls import reverse
+from model_bakery import baker
 
+from InvoiceEngineApp.access import get_company_ids, has_access
+from InvoiceEngineApp.bulk import activate_tenancy_contracts, \
+    delete_vat_rate, end_tenancy_contracts, index_base_components, \
+    run_operation, running_processes
+from InvoiceEngineApp.models import BulkOperation, Contract, Invoice, \
+    Tenancy, VATRate
+from InvoiceEngineApp.pagination import KeysetPaginator
+from InvoiceEngineApp.views.base_component_views import BaseComponentListView
+from InvoiceEngineApp.views.contract_views import ContractListView
 from InvoiceEngineApp.views.general_views import UserProfilePage
 
 
@@ -18,3 +40,778 @@ class ProfileTest(TestCase):
         request.user = self.user
         response = UserProfilePage.as_view()(request)
         self.assertEqual(response.status_code, 200)
+
+
+class ParquetExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.invoice = baker.make(
+            'Invoice',
+            tenancy=self.tenancy,
+            date=datetime.date(2021, 5, 1)
+        )
+        baker.make(
+            'GeneralLedgerPost',
+            tenancy=self.tenancy,
+            invoice=self.invoice,
+            invoice_line=None,
+            date=datetime.date(2021, 5, 1),
+            gl_account='1300',
+            amount_debit=decimal.Decimal('121.50'),
+            amount_credit=0,
+            _quantity=3
+        )
+
+    def get_table(self, url_name, **params):
+        response = self.client.get(
+            reverse(url_name, args=[self.tenancy.company_id]), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return pq.read_table(BytesIO(b''.join(response.streaming_content)))
+
+    def test_glposts_types(self):
+        table = self.get_table('export_glposts_parquet')
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(
+            table.schema.field('amount_debit').type, pa.decimal128(15, 2)
+        )
+        self.assertEqual(table.schema.field('date').type, pa.date32())
+        self.assertTrue(
+            pa.types.is_dictionary(table.schema.field('gl_account').type)
+        )
+        self.assertEqual(
+            table.column('amount_debit')[0].as_py(), decimal.Decimal('121.50')
+        )
+
+    def test_period_filter(self):
+        table = self.get_table(
+            'export_glposts_parquet', start_date='2021-05-02'
+        )
+        self.assertEqual(table.num_rows, 0)
+        self.assertIn('gl_account', table.column_names)
+
+    def test_other_tenancy(self):
+        other = baker.make('Tenancy', tenancy_id=54321)
+        response = self.client.get(
+            reverse('export_invoices_parquet', args=[other.company_id])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ContractSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.contract = baker.make('Contract', tenancy=self.tenancy)
+        baker.make(
+            'ContractPerson',
+            tenancy=self.tenancy,
+            contract=self.contract,
+            name='John Doe',
+            address='Hoofdstraat 1',
+            city='Groningen',
+            _quantity=2
+        )
+        baker.make(
+            'ContractPerson',
+            tenancy=self.tenancy,
+            contract__tenancy=self.tenancy,
+            name='Groningen Housing',
+            address='Kerkstraat 5',
+            city='Assen'
+        )
+
+    def search(self, **params):
+        response = self.client.get(
+            reverse('contract_list', args=[self.tenancy.company_id]), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['object_list'])
+
+    def test_search_address(self):
+        # Both contract persons match, but the contract is listed once
+        self.assertEqual(self.search(address='gron'), [self.contract])
+        self.assertEqual(self.search(address='Hoofdstraat 1'), [self.contract])
+
+    def test_search_name(self):
+        self.assertEqual(self.search(name='john'), [self.contract])
+        self.assertEqual(
+            self.search(name='john', address='groningen'), [self.contract]
+        )
+        self.assertEqual(self.search(name='john', address='assen'), [])
+
+    def test_search_without_words(self):
+        # Only punctuation does not filter the contracts
+        self.assertEqual(len(self.search(name='-', address='hoofdstraat')), 1)
+        self.assertEqual(len(self.search(name='-')), 2)
+
+    def test_search_amounts(self):
+        other = baker.make(
+            'Contract',
+            tenancy=self.tenancy,
+            total_amount=decimal.Decimal('100.00'),
+            balance=decimal.Decimal('2500.50')
+        )
+        self.assertEqual(self.search(total_amount='100'), [other])
+        self.assertEqual(self.search(min_balance='2500.50'), [other])
+        contracts = self.search(max_balance='2500.49', total_amount='0')
+        self.assertIn(self.contract, contracts)
+        self.assertNotIn(other, contracts)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+
+    def get_pages(self, url_name, **params):
+        """Follow the next links from the first page to the last one, and
+        then the previous links back to the first one.
+        """
+        url = reverse(url_name, args=[self.tenancy.company_id])
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            pages.append(list(response.context['page_obj']))
+            if not response.context['page_obj'].has_next():
+                break
+            response = self.client.get(url, dict(
+                params, after=response.context['page_obj'].next_cursor
+            ))
+
+        backwards = [pages[-1]]
+        while response.context['page_obj'].has_previous():
+            response = self.client.get(url, dict(
+                params, before=response.context['page_obj'].previous_cursor
+            ))
+            backwards.append(list(response.context['page_obj']))
+        self.assertEqual(backwards[::-1], pages)
+        return pages
+
+    def test_invoice_list(self):
+        # Many invoices on the same date, so the primary key breaks the ties
+        for date in [datetime.date(2021, 5, 1), datetime.date(2021, 6, 1)]:
+            baker.make(
+                'Invoice', tenancy=self.tenancy, date=date, _quantity=13
+            )
+
+        pages = self.get_pages('invoice_list')
+        self.assertEqual([len(page) for page in pages], [10, 10, 6])
+        invoices = [invoice for page in pages for invoice in page]
+        self.assertEqual(
+            invoices,
+            list(Invoice.objects.order_by('-date', '-invoice_id'))
+        )
+
+    def test_contract_list_with_nulls(self):
+        baker.make(
+            'Contract',
+            tenancy=self.tenancy,
+            date_next_prolongation=datetime.date(2021, 5, 1),
+            _quantity=7
+        )
+        baker.make(
+            'Contract',
+            tenancy=self.tenancy,
+            date_next_prolongation=None,
+            _quantity=7
+        )
+
+        pages = self.get_pages('contract_list')
+        contracts = [contract for page in pages for contract in page]
+        self.assertEqual(len(contracts), 14)
+        self.assertEqual(len(set(contracts)), 14)
+        self.assertIsNone(contracts[-1].date_next_prolongation)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse('invoice_list', args=[self.tenancy.company_id]),
+            {'after': 'invalid'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_counts(self):
+        baker.make('Invoice', tenancy=self.tenancy, _quantity=3)
+        url = reverse('invoice_list', args=[self.tenancy.company_id])
+        paginator = self.client.get(url).context['paginator']
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+
+        # Above the threshold the planner's estimate is used
+        paginator = KeysetPaginator(
+            Invoice.objects.order_by('-date'), 10, exact_count_threshold=0
+        )
+        with self.assertNumQueries(1):
+            self.assertIsInstance(paginator.count, int)
+        self.assertFalse(paginator.count_is_exact)
+
+        # A list estimated below the threshold is counted, even when the
+        # estimate was too low
+        paginator = KeysetPaginator(
+            Invoice.objects.order_by('-date'), 10, exact_count_threshold=2
+        )
+        with mock.patch(
+                'InvoiceEngineApp.pagination.estimate_count', return_value=0):
+            self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+
+        # The contract list uses the counter of the tenancy
+        Tenancy.objects.filter(pk=self.tenancy.pk).update(
+            number_of_contracts=123
+        )
+        url = reverse('contract_list', args=[self.tenancy.company_id])
+        self.assertEqual(self.client.get(url).context['paginator'].count, 123)
+        self.assertEqual(
+            self.client.get(url, {'name': 'john'}).context['paginator'].count,
+            0
+        )
+
+
+NO_FRAGMENT_CACHE = dict(settings.CACHES, template_fragments={
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+})
+
+
+@override_settings(CACHES=NO_FRAGMENT_CACHE)
+class ContractListQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        for contract in baker.make(
+                'Contract', tenancy=self.tenancy, _quantity=30):
+            baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract=contract,
+                end_date=None,
+                _quantity=2
+            )
+            # A person who has left is not listed
+            baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract=contract,
+                end_date=datetime.date(2000, 1, 1)
+            )
+
+    def test_query_budget(self):
+        # The tenancies the user has access to are cached after this
+        get_company_ids(self.user.username)
+        url = reverse('contract_list', args=[self.tenancy.company_id])
+        for page_size in [10, 30]:
+            with mock.patch.object(
+                    ContractListView, 'paginate_by', page_size), \
+                    self.assertNumQueries(6):
+                response = self.client.get(url)
+            self.assertEqual(len(response.context['page_obj']), page_size)
+            for contract in response.context['page_obj']:
+                self.assertEqual(len(contract.current_contract_persons), 2)
+
+
+class InvoiceDetailQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.invoice = baker.make(
+            'Invoice',
+            tenancy=self.tenancy,
+            contract__tenancy=self.tenancy,
+            date=datetime.date(2021, 5, 1)
+        )
+        self.url = reverse(
+            'invoice_details',
+            args=[self.tenancy.company_id, self.invoice.invoice_id]
+        )
+
+    def add_lines(self, number):
+        baker.make(
+            'InvoiceLine',
+            invoice=self.invoice,
+            date=self.invoice.date,
+            component__tenancy=self.tenancy,
+            _quantity=number
+        )
+        baker.make(
+            'Collection',
+            tenancy=self.tenancy,
+            invoice=self.invoice,
+            contract_person__tenancy=self.tenancy,
+            _quantity=number
+        )
+
+    def test_query_count(self):
+        # The tenancies the user has access to are cached after this
+        get_company_ids(self.user.username)
+        for number in [1, 20]:
+            self.add_lines(number)
+            with self.assertNumQueries(5):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['invoice_lines']), 21)
+        self.assertEqual(len(response.context['collections']), 21)
+
+
+class InUseAnnotationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.base_components = baker.make(
+            'BaseComponent', tenancy=self.tenancy, unit_id='1', _quantity=30
+        )
+        # The first base component has been invoiced
+        baker.make(
+            'Component',
+            tenancy=self.tenancy,
+            base_component=self.base_components[0],
+            date_prev_prolongation=datetime.date(2021, 5, 1)
+        )
+
+    def test_list_query_budget(self):
+        # The tenancies the user has access to are cached after this
+        get_company_ids(self.user.username)
+        url = reverse('base_component_list', args=[self.tenancy.company_id])
+        for page_size in [10, 30]:
+            # Including one for the running bulk operations
+            with mock.patch.object(
+                    BaseComponentListView, 'paginate_by', page_size), \
+                    self.assertNumQueries(5):
+                response = self.client.get(url)
+            in_use = [
+                not base_component.can_update_or_delete()
+                for base_component in response.context['page_obj']
+            ]
+            self.assertEqual(len(in_use), page_size)
+            self.assertEqual(in_use.count(True), 1)
+
+    def test_update_view(self):
+        url = reverse(
+            'base_component_update',
+            args=[
+                self.tenancy.company_id,
+                self.base_components[0].base_component_id
+            ]
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        url = reverse(
+            'base_component_update',
+            args=[
+                self.tenancy.company_id,
+                self.base_components[1].base_component_id
+            ]
+        )
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class TenancyAccessTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+
+    def get_status(self, company_id):
+        return self.client.get(
+            reverse('invoice_list', args=[company_id])
+        ).status_code
+
+    def test_cached_access(self):
+        self.assertEqual(self.get_status(self.tenancy.company_id), 200)
+        with self.assertNumQueries(0):
+            self.assertTrue(has_access('12345', self.tenancy.company_id))
+
+        # Adding, reassigning and removing tenancies invalidates the cache
+        other = baker.make('Tenancy', tenancy_id=12345)
+        self.assertEqual(self.get_status(other.company_id), 200)
+        other.tenancy_id = 54321
+        other.save()
+        self.assertEqual(self.get_status(other.company_id), 404)
+        company_id = self.tenancy.company_id
+        self.tenancy.delete()
+        self.assertEqual(self.get_status(company_id), 404)
+
+    def test_counter_updates_keep_cache(self):
+        get_company_ids('12345')
+        self.tenancy.number_of_contracts = 5
+        self.tenancy.save(update_fields=['number_of_contracts'])
+        with self.assertNumQueries(0):
+            self.assertTrue(has_access('12345', self.tenancy.company_id))
+
+
+class ListFragmentCacheTest(TransactionTestCase):
+    # The data generation is raised when a transaction commits
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.contract = baker.make(
+            'Contract', tenancy=self.tenancy, total_amount=100
+        )
+        self.url = reverse('contract_list', args=[self.tenancy.company_id])
+        get_company_ids(self.user.username)
+
+    def test_cached_until_changed(self):
+        self.assertContains(self.client.get(self.url), '€100.00')
+
+        # Session, user and data generation
+        with self.assertNumQueries(3):
+            self.assertContains(self.client.get(self.url), '€100.00')
+
+        self.contract.total_amount = 250
+        self.contract.save()
+        self.assertContains(self.client.get(self.url), '€250.00')
+
+    def test_invoicing_run_raises_generation(self):
+        self.tenancy.refresh_from_db()
+        generation = self.tenancy.data_generation
+        with self.tenancy.batch_changes():
+            self.contract.save()
+            self.contract.save()
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.data_generation, generation + 1)
+
+    def test_raised_once_per_transaction(self):
+        self.tenancy.refresh_from_db()
+        generation = self.tenancy.data_generation
+        with transaction.atomic():
+            self.contract.save()
+            baker.make(
+                'ContractPerson', tenancy=self.tenancy, contract=self.contract
+            )
+            # Not before the commit
+            self.tenancy.refresh_from_db()
+            self.assertEqual(self.tenancy.data_generation, generation)
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.data_generation, generation + 1)
+
+        # A rolled back savepoint keeps the raise of the other changes
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self.contract.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            self.contract.save()
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.data_generation, generation + 2)
+
+    def test_component_changes(self):
+        self.tenancy.refresh_from_db()
+        generation = self.tenancy.data_generation
+        component = baker.make(
+            'Component', tenancy=self.tenancy, contract=self.contract,
+            start_date=datetime.date(2021, 1, 1)
+        )
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.data_generation, generation + 1)
+
+        # A queryset update of the amounts of the contract
+        component.end_date = datetime.date(2021, 1, 31)
+        component.update_contract_amounts(was_invoiced=True)
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.data_generation, generation + 2)
+
+
+class BulkOperationViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make('Tenancy', tenancy_id=12345)
+        self.vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, successor_vat_rate=None
+        )
+
+    def test_delete_in_background(self):
+        with mock.patch(
+                'InvoiceEngineApp.views.vat_rate_views.start_operation'
+        ) as start_operation:
+            response = self.client.post(reverse(
+                'vat_rate_delete',
+                args=[self.tenancy.company_id, self.vat_rate.vat_rate_id]
+            ))
+        self.assertEqual(response.status_code, 302)
+        company_id, description, target, vat_rate_id = \
+            start_operation.call_args[0]
+        self.assertEqual(target, delete_vat_rate)
+
+        # Run what the background process runs
+        operation = BulkOperation.objects.create(
+            tenancy=self.tenancy, description=description
+        )
+        target(operation, vat_rate_id)
+        operation.finish()
+        self.assertFalse(
+            VATRate.objects.filter(pk=self.vat_rate.pk).exists()
+        )
+
+        response = self.client.get(reverse(
+            'bulk_operation',
+            args=[self.tenancy.company_id, operation.bulk_operation_id]
+        ))
+        self.assertTrue(response.json()['finished'])
+        self.assertIsNone(response.json()['error'])
+
+    def test_index_components(self):
+        url = reverse('index_components', args=[self.tenancy.company_id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # A new amount needs a base component
+        response = self.client.post(
+            url, {'start_date': '2021-06-01', 'amount': '500'}
+        )
+        self.assertTrue(response.context['form'].non_field_errors())
+
+        with mock.patch(
+                'InvoiceEngineApp.views.base_component_views.start_operation'
+        ) as start_operation:
+            response = self.client.post(
+                url, {'start_date': '2021-06-01', 'percentage': '2.5'}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            start_operation.call_args[0][2:],
+            (index_base_components, self.tenancy.company_id,
+             datetime.date(2021, 6, 1), decimal.Decimal('2.5'), None, None)
+        )
+
+    def test_end_contracts(self):
+        url = reverse('end_contracts', args=[self.tenancy.company_id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with mock.patch(
+                'InvoiceEngineApp.views.contract_views.start_operation'
+        ) as start_operation:
+            response = self.client.post(url, {
+                'end_date': '2021-06-30', 'contract_ids': '12, 5\n12 7'
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            start_operation.call_args[0][2:],
+            (end_tenancy_contracts, self.tenancy.company_id, [5, 7, 12],
+             datetime.date(2021, 6, 30))
+        )
+
+    def test_activate_contracts(self):
+        url = reverse('activate_contracts', args=[self.tenancy.company_id])
+        response = self.client.post(url, {'contract_ids': '3, x'})
+        self.assertTrue(response.context['form'].errors)
+
+        with mock.patch(
+                'InvoiceEngineApp.views.contract_views.start_operation'
+        ) as start_operation:
+            response = self.client.post(url, {'contract_ids': '3 4'})
+        self.assertRedirects(response, url)
+        self.assertEqual(
+            start_operation.call_args[0][2:],
+            (activate_tenancy_contracts, self.tenancy.company_id, [3, 4])
+        )
+
+    def test_replace_in_background(self):
+        self.vat_rate.end_date = None
+        self.vat_rate.save()
+        component = baker.make(
+            'Component', tenancy=self.tenancy, vat_rate=self.vat_rate
+        )
+        with mock.patch(
+                'InvoiceEngineApp.views.vat_rate_views.start_operation'
+        ) as start_operation:
+            response = self.client.post(
+                reverse('vat_rate_create', args=[self.tenancy.company_id]),
+                {'type': self.vat_rate.type, 'description': 'High',
+                 'start_date': '2021-07-01', 'percentage': '21',
+                 'gl_account': 'A', 'gl_dimension': 'B'}
+            )
+        self.assertEqual(response.status_code, 302)
+        company_id, description, target, vat_rate_id = \
+            start_operation.call_args[0]
+        self.assertEqual(
+            (target, vat_rate_id), (delete_vat_rate, self.vat_rate.vat_rate_id)
+        )
+        # The components are not moved in the request
+        component.refresh_from_db()
+        self.assertEqual(component.vat_rate_id, self.vat_rate.vat_rate_id)
+
+        operation = BulkOperation.objects.create(
+            tenancy=self.tenancy, description=description
+        )
+        target(operation, vat_rate_id)
+        component.refresh_from_db()
+        self.assertEqual(component.vat_rate.description, 'High')
+        self.assertFalse(
+            VATRate.objects.filter(pk=self.vat_rate.pk).exists()
+        )
+
+    def test_failed_operation(self):
+        operation = BulkOperation.objects.create(
+            tenancy=self.tenancy, description='Fail'
+        )
+
+        def fail(operation):
+            raise ValueError("Failed")
+
+        # The background process records the failure and exits
+        with mock.patch('InvoiceEngineApp.bulk.connections'), \
+                mock.patch('InvoiceEngineApp.bulk.os._exit') as exit:
+            run_operation(operation.bulk_operation_id, fail)
+        exit.assert_called_once_with(1)
+        operation.refresh_from_db()
+        self.assertIn("ValueError: Failed", operation.error)
+
+        # A process that was killed before finishing its operation
+        operation = BulkOperation.objects.create(
+            tenancy=self.tenancy, description='Killed'
+        )
+        with mock.patch.dict(running_processes, {
+                mock.Mock(exitcode=-9): operation.bulk_operation_id}):
+            progress = self.client.get(reverse(
+                'bulk_operation',
+                args=[self.tenancy.company_id, operation.bulk_operation_id]
+            )).json()
+        self.assertTrue(progress['finished'])
+        self.assertEqual(
+            progress['error'], "The background process exited with code -9."
+        )
+
+
+class ContractApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='12345', password='top_secret')
+        self.client.force_login(self.user)
+        self.tenancy = baker.make(
+            'Tenancy', tenancy_id=12345, number_of_contracts=0
+        )
+        self.contract_type = baker.make('ContractType', tenancy=self.tenancy)
+        self.base_component = baker.make(
+            'BaseComponent', tenancy=self.tenancy, unit_id=None
+        )
+        self.url = reverse('contract_api', args=[self.tenancy.company_id])
+
+    def get_contract(self, base_amount, **kwargs):
+        contract = {
+            'external_customer_id': 7,
+            'contract_type_id': self.contract_type.pk,
+            'start_date': '2021-01-01',
+            'gl_dimension_1': 'A',
+            'gl_dimension_2': 'B',
+            'components': [{
+                'base_component_id': self.base_component.pk,
+                'description': 'Rent',
+                'start_date': '2021-01-01',
+                'base_amount': base_amount,
+            }],
+            'persons': [{
+                'type': 'P',
+                'name': 'Tenant',
+                'address': 'Street 1',
+                'city': 'Groningen',
+                'email': 'tenant@example.com',
+                'phone': '0612345678',
+                'start_date': '2021-01-01',
+                'percentage_of_total': 100,
+            }],
+        }
+        contract.update(kwargs)
+        return contract
+
+    def post(self, contracts):
+        return self.client.post(
+            self.url,
+            json.dumps({'contracts': contracts}),
+            content_type='application/json'
+        )
+
+    def test_upsert(self):
+        response = self.post([
+            self.get_contract('100.00'),
+            self.get_contract('100.00', components=[]),
+            self.get_contract('50.00', persons=[]),
+        ])
+        self.assertEqual(response.status_code, 200)
+        first, second, third = response.json()['results']
+        self.assertTrue(first['created'])
+        self.assertTrue(second['created'])
+        self.assertEqual(
+            third['errors'], ['Please do not delete all persons.']
+        )
+
+        # Replace the first contract and refer to a contract that is active
+        active = baker.make(
+            'Contract', tenancy=self.tenancy, status=Contract.ACTIVE
+        )
+        response = self.post([
+            self.get_contract('80.00', contract_id=first['contract_id']),
+            self.get_contract('80.00', contract_id=active.contract_id),
+        ])
+        first_update, active_update = response.json()['results']
+        self.assertEqual(first_update, {
+            'created': False, 'contract_id': first['contract_id']
+        })
+        self.assertEqual(
+            active_update['errors'], ['Unknown draft contract.']
+        )
+
+        contract = Contract.objects.get(contract_id=first['contract_id'])
+        self.assertEqual(contract.total_amount, decimal.Decimal('80.00'))
+        self.assertEqual(contract.component_set.count(), 1)
+        self.assertEqual(contract.contractperson_set.count(), 1)
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.number_of_contracts, 2)
+
+    def test_malformed_contracts(self):
+        response = self.post([
+            self.get_contract('100.00', start_date=20210101),
+            self.get_contract('100.00', components='x'),
+            self.get_contract('100.00', persons=[5]),
+            self.get_contract('100.00', contract_id=[1]),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['errors'] for result in response.json()['results']],
+            [['start_date: Enter a valid value.'],
+             ['components: Expected a list of objects.'],
+             ['persons: Expected a list of objects.'],
+             ['Unknown draft contract.']]
+        )
+
+    def test_bad_requests(self):
+        response = self.client.post(self.url, {'contracts': '[]'})
+        self.assertEqual(response.status_code, 415)
+        response = self.client.post(
+            self.url, '[]', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.post([]).status_code, 401)
+
+    def test_csrf_token(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(self.user)
+        self.assertEqual(self.post([]).status_code, 403)
+
+        # The login page sets the CSRF cookie
+        self.client.get(reverse('login'))
+        response = self.client.post(
+            self.url,
+            json.dumps({'contracts': []}),
+            content_type='application/json',
+            HTTP_X_CSRFTOKEN=self.client.cookies['csrftoken'].value
+        )
+        self.assertEqual(response.status_code, 200)
@@ -25,6 +25,18 @@ urlpatterns = [
     path('profile/tenancies/<int:company_id>/collections/export',
          export_collections,
          name='export_collections'),
+    path('profile/tenancies/<int:company_id>/collections/export/sepa',
+         export_direct_debits,
+         name='export_direct_debits'),
+    path('profile/tenancies/<int:company_id>/invoices/export/parquet',
+         export_invoices_parquet,
+         name='export_invoices_parquet'),
+    path('profile/tenancies/<int:company_id>/invoice_lines/export/parquet',
+         export_invoice_lines_parquet,
+         name='export_invoice_lines_parquet'),
+    path('profile/tenancies/<int:company_id>/glposts/export/parquet',
+         export_glposts_parquet,
+         name='export_glposts_parquet'),
 
     # Tenancy pages.
     path('profile/tenancies/',
@@ -42,6 +54,10 @@ urlpatterns = [
          invoice_contracts_view,
          name='invoice_contracts'
          ),
+    path('profile/tenancies/<int:company_id>/bulk_operations/<int:bulk_operation_id>/',
+         bulk_operation_view,
+         name='bulk_operation'
+         ),
 
     # Contract type pages.
     path('profile/tenancies/<int:company_id>/contract_types/',
@@ -78,6 +94,10 @@ urlpatterns = [
          BaseComponentDeleteView.as_view(),
          name='base_component_delete'
          ),
+    path('profile/tenancies/<int:company_id>/base_components/index/',
+         IndexationView.as_view(),
+         name='index_components'
+         ),
 
     # VAT rate pages.
     path('profile/tenancies/<int:company_id>/vat_rates/',
@@ -102,6 +122,18 @@ urlpatterns = [
          ContractListView.as_view(),
          name='contract_list'
          ),
+    path('profile/tenancies/<int:company_id>/contracts/end/',
+         EndContractsView.as_view(),
+         name='end_contracts'
+         ),
+    path('profile/tenancies/<int:company_id>/contracts/activate/',
+         ActivateContractsView.as_view(),
+         name='activate_contracts'
+         ),
+    path('profile/tenancies/<int:company_id>/contracts/api/',
+         contract_api_view,
+         name='contract_api'
+         ),
     path('profile/tenancies/<int:company_id>/contracts/create/',
          ContractCreateView.as_view(),
          name='contract_create'
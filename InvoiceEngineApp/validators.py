@@ -0,0 +1,149 @@
+import collections
+import datetime
+
+from django.core.exceptions import ValidationError
+
+from InvoiceEngineApp import models
+
+
+def validate_contract(invoicing_period, invoicing_amount_of_days, start_date,
+                      termination_date):
+    """The rules of ContractForm.clean."""
+    if invoicing_period == models.Contract.CUSTOM:
+        if not invoicing_amount_of_days:
+            raise ValidationError("Fill in the amount of days to invoice.")
+    else:
+        if invoicing_amount_of_days:
+            raise ValidationError(
+                "Only fill in the amount of days to invoice if choosing "
+                "Custom invoicing period."
+            )
+
+    if start_date and termination_date and start_date > termination_date:
+        raise ValidationError(
+            "Termination date must be on or after start date."
+        )
+
+
+def validate_component(unit_id, base_amount, unit_amount, number_of_units,
+                       start_date, end_date):
+    """The rules of ComponentForm.clean that do not depend on the contract:
+    a component of a base component with a unit has a unit amount and a
+    number of units, other components have a base amount.
+    """
+    if unit_id:
+        if base_amount:
+            raise ValidationError(
+                "Please specify unit amount and number of units for unit "
+                + unit_id.__str__()
+                + ". Do not specify base amount."
+            )
+        if not unit_amount or not number_of_units:
+            raise ValidationError(
+                "Please specify unit amount and number of units for unit "
+                + unit_id.__str__() + "."
+            )
+    else:
+        if not base_amount:
+            raise ValidationError(
+                "Please specify a base amount for this component."
+            )
+        if unit_amount or number_of_units:
+            raise ValidationError(
+                "Please specify a base amount for this component. "
+                "Do not specify unit amount and number of units."
+            )
+
+    if start_date and end_date and start_date > end_date:
+        raise ValidationError("Start date cannot be after end date.")
+
+
+def validate_contract_person(payment_method, iban, mandate, mandate_date,
+                             start_date, end_date):
+    """The rules of ContractPersonFormSet.clean for a single person."""
+    if payment_method == models.ContractPerson.DIRECT_DEBIT:
+        if not iban or not mandate:
+            raise ValidationError("Please provide an iban and a mandate.")
+        if not mandate_date:
+            raise ValidationError(
+                "Please provide the date the mandate was signed."
+            )
+    else:
+        if iban or mandate or mandate_date:
+            raise ValidationError(
+                "Only fill in IBAN & mandate in case of Direct Debit"
+                "payment method."
+            )
+
+    if end_date and start_date and end_date < start_date:
+        raise ValidationError("End date should be after start date.")
+
+
+def get_percentage_ranges(persons, contract_start_date=None):
+    """Return the date ranges in which the persons of a contract, given as
+    (start date, end date, percentage of total) tuples, do not pay 100
+    percent together, as (first day, last day, percentage) tuples. The last
+    day of a range that runs on indefinitely is None. The ranges start from
+    the start date of the contract or the first start date of a person,
+    whichever is earlier.
+
+    The dates on which the total changes are sorted and swept once, so this
+    takes O(n log n) time for n persons.
+    """
+    changes = collections.defaultdict(int)
+    for start_date, end_date, percentage in persons:
+        if not start_date or percentage is None:
+            continue
+        changes[start_date] += percentage
+        if end_date:
+            changes[end_date + datetime.timedelta(days=1)] -= percentage
+    if contract_start_date:
+        changes[contract_start_date] += 0
+
+    ranges = []
+    total = 0
+    dates = sorted(changes)
+    for date, next_date in zip(dates, dates[1:] + [None]):
+        total += changes[date]
+        if total == 100:
+            continue
+        last_day = next_date - datetime.timedelta(days=1) \
+            if next_date else None
+        if ranges and ranges[-1][2] == total \
+                and ranges[-1][1] == date - datetime.timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], last_day, total)
+        else:
+            ranges.append((date, last_day, total))
+    return ranges
+
+
+def get_percentage_error(percentage, first_day, last_day):
+    if last_day is None:
+        moment = 'from ' + first_day.__str__() + ' on'
+    elif first_day == last_day:
+        moment = 'on ' + first_day.__str__()
+    else:
+        moment = 'from ' + first_day.__str__() + ' to ' + last_day.__str__()
+
+    if percentage > 100:
+        return 'Total of all persons exceeding 100% by ' \
+               + (percentage - 100).__str__() + '% ' + moment
+    return 'Total of all persons smaller than 100% by ' \
+           + (100 - percentage).__str__() + '% ' + moment
+
+
+def validate_person_percentages(persons, contract_start_date):
+    """The rules of ContractPersonFormSet.clean for the persons of a
+    contract together, given as (start date, end date, percentage of total)
+    tuples: from the start of the contract on, the persons pay 100 percent
+    together on every day. The error names every range where they do not.
+    """
+    if not persons:
+        raise ValidationError('Please do not delete all persons.')
+
+    ranges = get_percentage_ranges(persons, contract_start_date)
+    if ranges:
+        raise ValidationError([
+            get_percentage_error(percentage, first_day, last_day)
+            for first_day, last_day, percentage in ranges
+        ])
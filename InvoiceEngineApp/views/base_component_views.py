@@ -1,6 +1,12 @@
-from InvoiceEngineApp.forms import BaseComponentForm
+from django.urls import reverse
+from django.views.generic import FormView
+
+from InvoiceEngineApp.bulk import index_base_components, start_operation
+from InvoiceEngineApp.forms import BaseComponentForm, IndexationForm
 from InvoiceEngineApp.models import BaseComponent
 from InvoiceEngineApp.views.parent_views import (
+    InUseAnnotationMixin,
+    TenancyAccessMixin,
     ParentListView,
     ParentCreateView,
     ParentUpdateView,
@@ -8,10 +14,11 @@ from InvoiceEngineApp.views.parent_views import (
 )
 
 
-class BaseComponentListView(ParentListView):
+class BaseComponentListView(InUseAnnotationMixin, ParentListView):
     template_name = 'InvoiceEngineApp/base_component_list.html'
     model = BaseComponent
     ordering = ['unit_id']
+    show_operations = True
 
 
 class BaseComponentCreateView(ParentCreateView):
@@ -19,15 +26,57 @@ class BaseComponentCreateView(ParentCreateView):
     list_page = "base_component_list"
 
 
-class BaseComponentUpdateView(ParentUpdateView):
+class BaseComponentUpdateView(InUseAnnotationMixin, ParentUpdateView):
     model = BaseComponent
     form_class = BaseComponentForm
     list_page = "base_component_list"
     pk_url_kwarg = 'base_component_id'
 
 
-class BaseComponentDeleteView(ParentDeleteView):
+class BaseComponentDeleteView(InUseAnnotationMixin, ParentDeleteView):
     model = BaseComponent
     list_page = "base_component_list"
     success_page = "base_component_list"
     pk_url_kwarg = 'base_component_id'
+
+
+class IndexationView(TenancyAccessMixin, FormView):
+    """Index the components of one or all base components, for instance for
+    the yearly rent increase. The indexation runs in the background.
+    """
+    template_name = 'InvoiceEngineApp/display_form.html'
+    form_class = IndexationForm
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.filter_selectors(self.kwargs.get('company_id'))
+        return form
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['list_page'] = [
+            'base_component_list', self.kwargs.get('company_id')
+        ]
+        return context
+
+    def form_valid(self, form):
+        base_component = form.cleaned_data['base_component']
+        start_operation(
+            self.kwargs.get('company_id'),
+            "Index the components of {} from {}".format(
+                base_component or "all base components",
+                form.cleaned_data['start_date']
+            ),
+            index_base_components,
+            self.kwargs.get('company_id'),
+            form.cleaned_data['start_date'],
+            form.cleaned_data['percentage'],
+            form.cleaned_data['amount'],
+            base_component.pk if base_component else None
+        )
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse(
+            'base_component_list', args=[self.kwargs.get('company_id')]
+        )
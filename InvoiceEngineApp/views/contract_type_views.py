@@ -1,6 +1,7 @@
 from InvoiceEngineApp.forms import ContractTypeForm
 from InvoiceEngineApp.models import ContractType
 from InvoiceEngineApp.views.parent_views import (
+    InUseAnnotationMixin,
     ParentListView,
     ParentCreateView,
     ParentUpdateView,
@@ -8,7 +9,7 @@ from InvoiceEngineApp.views.parent_views import (
 )
 
 
-class ContractTypeListView(ParentListView):
+class ContractTypeListView(InUseAnnotationMixin, ParentListView):
     template_name = 'InvoiceEngineApp/contract_type_list.html'
     model = ContractType
     ordering = ['code']
@@ -19,14 +20,14 @@ class ContractTypeCreateView(ParentCreateView):
     list_page = "contract_type_list"
 
 
-class ContractTypeUpdateView(ParentUpdateView):
+class ContractTypeUpdateView(InUseAnnotationMixin, ParentUpdateView):
     model = ContractType
     form_class = ContractTypeForm
     list_page = "contract_type_list"
     pk_url_kwarg = 'contract_type_id'
 
 
-class ContractTypeDeleteView(ParentDeleteView):
+class ContractTypeDeleteView(InUseAnnotationMixin, ParentDeleteView):
     model = ContractType
     list_page = "contract_type_list"
     success_page = "contract_type_list"
@@ -1,14 +1,35 @@
+import datetime
+import json
+
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
+from django.db.models import Prefetch, Q
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
-
+from django.views.decorators.http import require_POST
+from django.views.generic import FormView
+
+from InvoiceEngineApp.access import check_access
+from InvoiceEngineApp.bulk import (
+    activate_tenancy_contracts,
+    end_tenancy_contracts,
+    start_operation,
+)
 from InvoiceEngineApp.forms import (
     ContractForm,
+    ContractIdsForm,
     ContractSearchForm,
+    EndContractsForm,
+)
+from InvoiceEngineApp.imports import upsert_contracts
+from InvoiceEngineApp.models import (
+    BulkOperation,
+    Contract,
+    ContractPerson,
+    Tenancy,
 )
-from InvoiceEngineApp.models import Contract
 from InvoiceEngineApp.views.parent_views import (
+    TenancyAccessMixin,
     ParentListView,
     ParentCreateView,
     ParentUpdateView,
@@ -16,9 +37,13 @@ from InvoiceEngineApp.views.parent_views import (
 )
 
 
+# Maximum amount of contracts in one request to the contract API
+API_MAX_CONTRACTS = 1000
+
+
 def get_contract_qs(username, company_id, contract_id):
+    check_access(username, company_id)
     return Contract.objects.filter(
-        tenancy__tenancy_id=username,
         tenancy_id=company_id,
         contract_id=contract_id
     )
@@ -36,6 +61,43 @@ def get_details_page(company_id, contract_id):
     )
 
 
+@require_POST
+def contract_api_view(request, company_id):
+    """Create or replace draft contracts, with their components and persons,
+    from a JSON object {"contracts": [...]}, with the layout of the
+    import_contracts command. A contract with a contract_id replaces that
+    draft contract. All valid contracts are saved in one transaction, and
+    the response has a result per contract, in the same order.
+
+    The view is meant for integrations that log in with a session. Like
+    every other post, it needs the CSRF token, in the X-CSRFToken header.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Log in first."}, status=401)
+    check_access(request.user.username, company_id)
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': "Send JSON."}, status=415)
+
+    try:
+        contracts = json.loads(request.body)['contracts']
+    except (ValueError, KeyError, TypeError):
+        contracts = None
+    if not isinstance(contracts, list):
+        return JsonResponse(
+            {'error': "Send an object with a list of contracts."}, status=400
+        )
+    if len(contracts) > API_MAX_CONTRACTS:
+        return JsonResponse(
+            {'error': "Send at most {} contracts at once.".format(
+                API_MAX_CONTRACTS
+            )},
+            status=400
+        )
+
+    tenancy = get_object_or_404(Tenancy, company_id=company_id)
+    return JsonResponse({'results': upsert_contracts(tenancy, contracts)})
+
+
 @login_required(login_url='/login/')
 def contract_activation_view(request, company_id, contract_id):
     """View function to set the status of the contract to ACTIVE, so
@@ -65,11 +127,73 @@ def contract_ending_view(request, company_id, contract_id):
     return get_details_page(company_id, contract_id)
 
 
+class BulkContractsView(TenancyAccessMixin, FormView):
+    """Change many contracts at once, in the background. The page shows the
+    bulk operations that are running.
+    """
+    template_name = 'InvoiceEngineApp/display_form.html'
+    success_page = None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['list_page'] = ['contract_list', self.kwargs.get('company_id')]
+        context['running_operations'] = BulkOperation.get_running(
+            self.kwargs.get('company_id')
+        )
+        return context
+
+    def get_success_url(self):
+        return reverse(self.success_page, args=[self.kwargs.get('company_id')])
+
+
+class ActivateContractsView(BulkContractsView):
+    """Activate many draft contracts at once, for instance after they have
+    been migrated. Contracts that cannot be activated are skipped.
+    """
+    form_class = ContractIdsForm
+    success_page = 'activate_contracts'
+
+    def form_valid(self, form):
+        contract_ids = form.cleaned_data['contract_ids']
+        start_operation(
+            self.kwargs.get('company_id'),
+            "Activate {} contracts".format(len(contract_ids)),
+            activate_tenancy_contracts,
+            self.kwargs.get('company_id'),
+            contract_ids
+        )
+        return super().form_valid(form)
+
+
+class EndContractsView(BulkContractsView):
+    """End many contracts at once. The contracts are ended, and credited
+    where necessary, in the background.
+    """
+    form_class = EndContractsForm
+    success_page = 'end_contracts'
+
+    def form_valid(self, form):
+        contract_ids = form.cleaned_data['contract_ids']
+        start_operation(
+            self.kwargs.get('company_id'),
+            "End {} contracts on {}".format(
+                len(contract_ids), form.cleaned_data['end_date']
+            ),
+            end_tenancy_contracts,
+            self.kwargs.get('company_id'),
+            contract_ids,
+            form.cleaned_data['end_date']
+        )
+        return super().form_valid(form)
+
+
 class ContractListView(ParentListView):
     template_name = 'InvoiceEngineApp/contract_list.html'
     form_class = ContractSearchForm
     model = Contract
     ordering = ['date_next_prolongation']
+    keyset_pagination = True
+    cache_rows = True
 
     def get_context_data(self, **kwargs):
         """Add the search form to the context data."""
@@ -77,10 +201,37 @@ class ContractListView(ParentListView):
         context['form'] = self.form_class(self.request.GET)
         return context
 
+    def get_count(self, queryset):
+        """Without a search, the list contains all contracts of the tenancy,
+        of which the tenancy keeps count.
+        """
+        form = self.form_class(self.request.GET)
+        if not form.is_valid() or all(
+                value in (None, '') for value in form.cleaned_data.values()):
+            return Tenancy.objects.filter(
+                company_id=self.kwargs.get('company_id')
+            ).values_list('number_of_contracts', flat=True).get()
+        return None
+
     def get_queryset(self):
         """Filter the queryset based on the submitted search form."""
-        # Get the contract list filtered by tenancy
-        qs = super().get_queryset()
+        # Get the contract list filtered by tenancy, with the contract type
+        # and the current contract persons of the listed contracts loaded in
+        # two more queries
+        today = datetime.date.today()
+        qs = super().get_queryset().select_related(
+            'contract_type'
+        ).prefetch_related(
+            Prefetch(
+                'contractperson_set',
+                queryset=ContractPerson.objects.filter(
+                    Q(end_date__isnull=True) | Q(end_date__gte=today)
+                ).defer(
+                    'search_vector'
+                ).order_by('contract_person_id'),
+                to_attr='current_contract_persons'
+            )
+        )
         form = self.form_class(self.request.GET)
 
         # Filter the contract list further by user input
@@ -11,18 +11,34 @@ class InvoiceListView(ParentListView):
     template_name = 'InvoiceEngineApp/invoice_list.html'
     model = Invoice
     ordering = ['-date']
+    keyset_pagination = True
+    cache_rows = True
 
 
 class InvoiceDetailView(TenancyAccessMixin, DetailView):
     template_name = 'InvoiceEngineApp/invoice_details.html'
 
     def get_context_data(self, **kwargs):
+        """Add the invoice lines and the collections, each loaded in one
+        query, with everything the template shows of them.
+        """
         context = super().get_context_data()
         context['list_page'] = ["invoice_list", self.kwargs.get('company_id')]
+        context['invoice_lines'] = list(
+            self.object.get_invoice_lines().select_related(
+                'component'
+            ).order_by('invoice_line_id')
+        )
+        context['collections'] = list(
+            self.object.get_collections().order_by('pk')
+        )
         return context
 
     def get_object(self, queryset=Invoice.objects.all()):
         qs = queryset.filter(
+            tenancy_id=self.kwargs.get('company_id'),
             invoice_id=self.kwargs.get('invoice_id'),
+        ).select_related(
+            'tenancy', 'contract__contract_type'
         )
         return get_object_or_404(qs)
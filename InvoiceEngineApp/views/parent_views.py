@@ -2,6 +2,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
 from django.http import Http404
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import (
     ListView,
     CreateView,
@@ -9,7 +10,9 @@ from django.views.generic import (
     DeleteView,
 )
 
-from InvoiceEngineApp.models import Tenancy
+from InvoiceEngineApp.access import check_access
+from InvoiceEngineApp.models import BulkOperation, Tenancy
+from InvoiceEngineApp.pagination import KeysetPaginator
 
 
 class TenancyAccessMixin(LoginRequiredMixin):
@@ -19,19 +22,33 @@ class TenancyAccessMixin(LoginRequiredMixin):
 
     def dispatch(self, request, *args, **kwargs):
         """"Perform a check whether this user has access to this tenancy."""
-        tenancy_qs = Tenancy.objects.filter(
-            company_id=self.kwargs.get('company_id'),
-            tenancy_id=request.user.username
-        )
-        if not tenancy_qs.exists():
-            raise Http404("No Tenancy matches the given query.")
+        if request.user.is_authenticated:
+            check_access(request.user.username, self.kwargs.get('company_id'))
 
         return super().dispatch(request, *args, **kwargs)
 
 
+class InUseAnnotationMixin:
+    """For views of models that cannot be changed once they are in use.
+    Annotates the in use flag on the queryset, so can_update and can_delete
+    do not run a query per object.
+    """
+    def get_queryset(self):
+        return self.model.annotate_in_use(super().get_queryset())
+
+
 class ParentListView(TenancyAccessMixin, ListView):
     """This class defines common methods of ListViews used in this project."""
     paginate_by = 10
+    # Paginate with cursors on the ordering instead of page numbers, for
+    # lists that can become long
+    keyset_pagination = False
+    # Add the tenancy's data generation to the context, for the template to
+    # cache its rendered rows with
+    cache_rows = False
+    # Add the bulk operations of the tenancy that are still running to the
+    # context, for lists whose objects they change
+    show_operations = False
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -39,9 +56,42 @@ class ParentListView(TenancyAccessMixin, ListView):
             tenancy_id=self.kwargs.get('company_id')
         )
 
+    def get_count(self, queryset):
+        """Return the length of the queryset if it is known without counting,
+        for instance from a counter on the tenancy. Otherwise the paginator
+        counts or estimates it.
+        """
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_pagination:
+            return super().paginate_queryset(queryset, page_size)
+
+        # Nothing is queried until the page is rendered
+        paginator = KeysetPaginator(
+            queryset, page_size, count=lambda: self.get_count(queryset)
+        )
+        page = paginator.page(
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before')
+        )
+        # is_paginated is a boolean that is only evaluated when used, so
+        # the rows are not loaded when they are cached
+        return (
+            paginator, page, page, SimpleLazyObject(page.has_other_pages)
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['company_id'] = self.kwargs.get('company_id')
+        if self.cache_rows:
+            context['data_generation'] = Tenancy.objects.filter(
+                company_id=self.kwargs.get('company_id')
+            ).values_list('data_generation', flat=True).get()
+        if self.show_operations:
+            context['running_operations'] = BulkOperation.get_running(
+                self.kwargs.get('company_id')
+            )
         return context
 
 
@@ -1,11 +1,17 @@
 import csv
+import datetime
 import multiprocessing
 import zipfile
 from io import BytesIO, StringIO
 
 from django.contrib.auth.decorators import login_required
 from django.db.models import Max
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.decorators import method_decorator
@@ -15,23 +21,33 @@ from django.views.generic import (
     UpdateView
 )
 
-from InvoiceEngineApp.forms import TenancySubscriberForm
+from InvoiceEngineApp.access import check_access
+from InvoiceEngineApp.bulk import reap_operations
+from InvoiceEngineApp.exports import export_parquet
+from InvoiceEngineApp.forms import ExportPeriodForm, TenancySubscriberForm
 from InvoiceEngineApp.models import (
+    BulkOperation,
     Tenancy,
     Collection,
     Invoice,
+    InvoiceLine,
     GeneralLedgerPost,
     ContractPerson
 )
+from InvoiceEngineApp.sepa import (
+    get_collectable,
+    get_unsigned,
+    write_direct_debits,
+)
 
 
 @login_required(login_url='/login/')
 def export_collections(request, company_id):
+    check_access(request.user.username, company_id)
     date = Invoice.objects.aggregate(Max('date')).get('date__max')
     collection_list = list(
         Collection.objects.filter(
             tenancy_id=company_id,
-            tenancy__tenancy_id=request.user.username,
             invoice__date=date
         ).select_related(
             'invoice', 'contract_person'
@@ -84,6 +100,53 @@ def export_collections(request, company_id):
     return response
 
 
+@login_required(login_url='/login/')
+def export_direct_debits(request, company_id):
+    """Export the direct debit collections of the last invoicing run as a
+    SEPA direct debit initiation (pain.008) file.
+    """
+    tenancy = get_object_or_404(
+        Tenancy.objects.filter(
+            company_id=company_id,
+            tenancy_id=request.user.username
+        )
+    )
+    if not tenancy.creditor_iban or not tenancy.creditor_identifier:
+        # The file cannot be made without the creditor's bank details
+        return HttpResponseRedirect(reverse('tenancy_update', args=[company_id]))
+
+    date = tenancy.invoice_set.aggregate(Max('date')).get('date__max')
+    collections = get_collectable(Collection.objects.filter(
+        tenancy=tenancy,
+        invoice__date=date,
+        payment_method=ContractPerson.DIRECT_DEBIT
+    ))
+
+    if not collections.exists():
+        return HttpResponseRedirect(reverse('tenancy_list'))
+    unsigned = get_unsigned(collections).count()
+    if unsigned:
+        # The bank rejects direct debits without the date of the mandate
+        return HttpResponse(
+            "{} collections have a mandate without a date of signature. "
+            "Fill in the mandate dates of their contract persons.".format(
+                unsigned
+            ),
+            status=409,
+            content_type='text/plain'
+        )
+
+    message_id = "{}-{}".format(
+        company_id, datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    )
+    return FileResponse(
+        write_direct_debits(tenancy, collections, message_id),
+        as_attachment=True,
+        filename="{}_direct_debits.xml".format(date),
+        content_type='application/xml'
+    )
+
+
 @login_required(login_url='/login/')
 def export_invoices(request, company_id):
     return general_export(
@@ -99,11 +162,11 @@ def export_glposts(request, company_id):
 
 
 def general_export(model, company_id, tenancy_id, file_name):
+    check_access(tenancy_id, company_id)
     date = Invoice.objects.aggregate(Max('date')).get('date__max')
     qs = list(
         model.objects.filter(
             tenancy_id=company_id,
-            tenancy__tenancy_id=tenancy_id,
             date=date
         )
     )
@@ -126,6 +189,57 @@ def general_export(model, company_id, tenancy_id, file_name):
     return response
 
 
+@login_required(login_url='/login/')
+def export_invoices_parquet(request, company_id):
+    return parquet_export(
+        request, Invoice, company_id, "invoices", 'date'
+    )
+
+
+@login_required(login_url='/login/')
+def export_invoice_lines_parquet(request, company_id):
+    return parquet_export(
+        request, InvoiceLine, company_id, "invoice_lines", 'date'
+    )
+
+
+@login_required(login_url='/login/')
+def export_glposts_parquet(request, company_id):
+    return parquet_export(
+        request, GeneralLedgerPost, company_id, "glposts", 'date'
+    )
+
+
+def parquet_export(request, model, company_id, file_name, date_field):
+    """Export all objects of the tenancy as a Parquet file, optionally
+    restricted to the period given in the GET parameters. Unlike the csv
+    exports, this covers the full history by default so it can be loaded
+    into an analytics environment.
+    """
+    tenancy = get_object_or_404(
+        Tenancy.objects.filter(
+            company_id=company_id,
+            tenancy_id=request.user.username
+        )
+    )
+
+    if model is InvoiceLine:
+        qs = model.objects.filter(invoice__tenancy=tenancy)
+    else:
+        qs = model.objects.filter(tenancy=tenancy)
+
+    form = ExportPeriodForm(request.GET)
+    if form.is_valid():
+        qs = form.filter_queryset(qs, date_field)
+
+    return FileResponse(
+        export_parquet(qs.order_by('pk')),
+        as_attachment=True,
+        filename="{}_{}.parquet".format(file_name, company_id),
+        content_type='application/vnd.apache.parquet'
+    )
+
+
 @login_required(login_url='/login/')
 def invoice_contracts_view(request, company_id):
     tenancy = get_object_or_404(
@@ -140,6 +254,21 @@ def invoice_contracts_view(request, company_id):
     return HttpResponseRedirect(reverse('tenancy_list'))
 
 
+@login_required(login_url='/login/')
+def bulk_operation_view(request, company_id, bulk_operation_id):
+    """Return the progress of a bulk operation as JSON, for a page to poll
+    while the operation runs in the background.
+    """
+    check_access(request.user.username, company_id)
+    reap_operations()
+    operation = get_object_or_404(
+        BulkOperation,
+        tenancy_id=company_id,
+        bulk_operation_id=bulk_operation_id
+    )
+    return JsonResponse(operation.get_progress())
+
+
 @method_decorator(login_required(login_url='/login/'), name='dispatch')
 class TenancyListView(ListView):
     """Show the user a list of all tenancies available to them."""
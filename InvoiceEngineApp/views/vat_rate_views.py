@@ -1,8 +1,10 @@
-from django.db import transaction
+from django.http import HttpResponseRedirect
 
+from InvoiceEngineApp.bulk import delete_vat_rate, start_operation, update_vat_rate
 from InvoiceEngineApp.forms import VATRateForm
 from InvoiceEngineApp.models import VATRate
 from InvoiceEngineApp.views.parent_views import (
+    InUseAnnotationMixin,
     ParentListView,
     ParentCreateView,
     ParentUpdateView,
@@ -10,32 +12,65 @@ from InvoiceEngineApp.views.parent_views import (
 )
 
 
-class VATRateListView(ParentListView):
+class VATRateListView(InUseAnnotationMixin, ParentListView):
     template_name = 'InvoiceEngineApp/vat_rate_list.html'
     model = VATRate
     ordering = ['type', 'start_date']
+    keyset_pagination = True
+    show_operations = True
 
 
 class VATRateCreateView(ParentCreateView):
     form_class = VATRateForm
     list_page = "vat_rate_list"
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        replaced_vat_rate = getattr(self.object, 'replaced_vat_rate', None)
+        if replaced_vat_rate:
+            # The components of the VAT rate it replaces are moved to it
+            # and that VAT rate is deleted in the background
+            start_operation(
+                self.kwargs.get('company_id'),
+                "Replace {}".format(replaced_vat_rate),
+                delete_vat_rate,
+                replaced_vat_rate.vat_rate_id
+            )
+        return response
+
 
-class VATRateUpdateView(ParentUpdateView):
+class VATRateUpdateView(InUseAnnotationMixin, ParentUpdateView):
     model = VATRate
     form_class = VATRateForm
     list_page = "vat_rate_list"
     pk_url_kwarg = 'vat_rate_id'
 
     def form_valid(self, form):
-        self.object = form.instance
-        with transaction.atomic():
-            self.object.update()
-            return super().form_valid(form)
+        response = super().form_valid(form)
+        # Recompute the components in the background, there can be many
+        start_operation(
+            self.kwargs.get('company_id'),
+            "Update the components of {}".format(self.object),
+            update_vat_rate,
+            self.object.vat_rate_id
+        )
+        return response
 
 
-class VATRateDeleteView(ParentDeleteView):
+class VATRateDeleteView(InUseAnnotationMixin, ParentDeleteView):
     model = VATRate
     list_page = "vat_rate_list"
     success_page = "vat_rate_list"
     pk_url_kwarg = 'vat_rate_id'
+
+    def delete(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        # The components are moved to the successor and the VAT rate is
+        # deleted in the background
+        start_operation(
+            self.kwargs.get('company_id'),
+            "Delete {}".format(self.object),
+            delete_vat_rate,
+            self.object.vat_rate_id
+        )
+        return HttpResponseRedirect(self.get_success_url())
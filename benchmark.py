@@ -200,3 +200,23 @@ def run_invoice_engine():
     print("started invoicing at " + start_time.__str__())
     print("ended invoicing at " + end_time.__str__())
     print("invoicing time was " + invoicing_time.__str__())
+
+
+def explain_invoice_engine(indexes=('component_due_idx', 'contract_due_idx')):
+    """Print the query plan of the query that loads the due components at the
+    start of run_invoice_engine(), and check that it uses the indexes defined
+    for it. Returns whether all indexes are used.
+
+    Note that the planner may prefer a sequential scan when nearly all
+    contracts are due, as is the case right after generate_benchmark_data().
+    """
+    tenancy = Tenancy.objects.get(tenancy_id=113582)
+    plan = tenancy.get_due_components(datetime.date.today()).explain()
+    print(plan)
+
+    missing = [index for index in indexes if index not in plan]
+    if missing:
+        print("WARNING: the query does not use " + ", ".join(missing))
+    else:
+        print("The query uses " + ", ".join(indexes))
+    return not missing
@@ -87,6 +87,34 @@ DATABASES = {
 }
 
 
+# Cache
+# The tenancies a user has access to are cached in the access cache (see
+# InvoiceEngineApp.access). It is shared by all server processes, so that
+# revoking access clears it for all of them: memcached at MEMCACHED_LOCATION,
+# which docker-compose runs. Without it, like when running the tests, a local
+# memory cache is used, which is only right with a single server process.
+# The rendered rows of the contract and invoice lists are cached in
+# template_fragments, keyed on the data generation of the tenancy.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'access': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.getenv('MEMCACHED_LOCATION'),
+    } if os.getenv('MEMCACHED_LOCATION') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'access',
+    },
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+        'TIMEOUT': 3600,
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 